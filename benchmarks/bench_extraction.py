@@ -0,0 +1,232 @@
+"""
+Micro-benchmark: image/table extraction from tool results.
+
+Builds ToolMessages shaped like real Tableau MCP results (a multi-MB
+query-datasource result, a double-encoded result, datasource metadata and a
+view image) and times utilities.chat.extract_from_tool_message against the
+previous implementation, which walked each payload twice (once for images,
+once for tables) and tried json.loads on every string. The baseline is kept
+here, verbatim in behavior, so the comparison can be re-run.
+
+    python -m benchmarks.bench_extraction --rows 50000 --repeat 5
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import statistics
+import time
+from typing import Any, List
+
+from langchain_core.messages import ToolMessage
+
+from utilities.chat import extract_from_tool_message
+
+
+# --- Baseline: the previous two-walk extractor -------------------------------
+
+_DATA_URI_IMAGE_RE = re.compile(r"data:image/[a-zA-Z0-9.+-]+;base64,[A-Za-z0-9+/=\s]+")
+_BASE64_RE = re.compile(r"^[A-Za-z0-9+/]+=*$")
+
+
+def _baseline_block_url(obj: Any) -> str | None:
+    if isinstance(obj, dict) and obj.get("type") == "image":
+        data = obj.get("data")
+        mime = obj.get("mimeType") or obj.get("mime_type") or "image/png"
+        if isinstance(data, str) and data.strip():
+            return f"data:{mime};base64,{data.strip()}"
+    return None
+
+
+def _baseline_images(content: Any) -> List[str]:
+    found: List[str] = []
+    seen: set = set()
+
+    def add(url: str) -> None:
+        normalized = re.sub(r"\s+", "", url.strip())
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            found.append(normalized)
+
+    def walk(value: Any) -> None:
+        if value is None:
+            return
+        block_url = _baseline_block_url(value)
+        if block_url:
+            add(block_url)
+            return
+        if isinstance(value, str):
+            for m in _DATA_URI_IMAGE_RE.finditer(value):
+                add(m.group(0))
+            compact = re.sub(r"\s+", "", value)
+            if len(compact) > 500 and _BASE64_RE.fullmatch(compact):
+                add("data:image/png;base64," + compact)
+            try:
+                decoded = json.loads(value)
+            except (TypeError, ValueError):
+                return
+            walk(decoded)
+            return
+        if isinstance(value, dict):
+            for sub in value.values():
+                walk(sub)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(content)
+    return found
+
+
+def _baseline_rows(rows: Any) -> List[dict]:
+    if not isinstance(rows, list):
+        return []
+    out = []
+    for row in rows[:120]:
+        if isinstance(row, dict):
+            clean = {str(k): v for k, v in row.items() if v is None or isinstance(v, (str, int, float, bool))}
+            if clean:
+                out.append(clean)
+    return out
+
+
+def _baseline_tables(content: Any) -> List[dict]:
+    candidates: List[dict] = []
+    seen: set = set()
+
+    def add_table(rows: List[dict], title: str) -> None:
+        if len(rows) < 2:
+            return
+        if not any(isinstance(v, (int, float)) and not isinstance(v, bool) for row in rows for v in row.values()):
+            return
+        key = json.dumps(rows[:20], sort_keys=True, default=str)
+        if key not in seen:
+            seen.add(key)
+            candidates.append({"title": title, "rows": rows})
+
+    def walk(value: Any, hint: str = "Tool Result") -> None:
+        if value is None:
+            return
+        if isinstance(value, str):
+            try:
+                decoded = json.loads(value)
+            except (TypeError, ValueError):
+                return
+            walk(decoded, hint)
+            return
+        if isinstance(value, list):
+            rows = _baseline_rows(value)
+            if rows:
+                add_table(rows, hint)
+            for item in value:
+                walk(item, hint)
+            return
+        if isinstance(value, dict):
+            title = str(value.get("name") or value.get("title") or value.get("caption") or hint)
+            for key in ("data", "result", "results", "records", "items", "values"):
+                rows = _baseline_rows(value.get(key))
+                if rows:
+                    add_table(rows, title)
+            for k, sub in value.items():
+                walk(sub, str(k))
+
+    walk(content)
+    return candidates
+
+
+def baseline_extract(message: ToolMessage):
+    images = _baseline_images(message.content) + [
+        url for url in _baseline_images(message.artifact) if url not in _baseline_images(message.content)
+    ]
+    if "view-image" in (message.name or ""):
+        return images, []
+    return images, (_baseline_tables(message.content) + _baseline_tables(message.artifact))[:4]
+
+
+# --- Payloads -----------------------------------------------------------------
+
+def _query_rows(rows: int) -> List[dict]:
+    rng = random.Random(7)
+    regions = ["East", "West", "Central", "South"]
+    categories = ["Furniture", "Office Supplies", "Technology"]
+    return [
+        {
+            "Region": regions[i % 4],
+            "Category": categories[i % 3],
+            "Order Date": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            "Customer Name": f"Customer {i}",
+            "SUM(Sales)": round(rng.uniform(10, 5000), 2),
+            "SUM(Profit)": round(rng.uniform(-500, 1500), 2),
+        }
+        for i in range(rows)
+    ]
+
+
+def build_payloads(rows: int) -> dict:
+    data = _query_rows(rows)
+    query_text = json.dumps({"data": data})
+    metadata = {
+        "data": [
+            {"fieldName": f"Field {i}", "fieldCaption": f"Field {i}", "dataType": "REAL" if i % 3 else "STRING",
+             "description": "A field description " * 4}
+            for i in range(2000)
+        ]
+    }
+    image = base64.b64encode(os.urandom(1_500_000)).decode()
+    return {
+        "query-datasource": ToolMessage(
+            content=[{"type": "text", "text": query_text}], name="query-datasource", tool_call_id="q"
+        ),
+        "query-datasource (structured)": ToolMessage(
+            content=[{"type": "text", "text": query_text}], name="query-datasource", tool_call_id="s",
+            artifact={"structured_content": {"data": data}},
+        ),
+        "query-datasource (double-encoded)": ToolMessage(
+            content=json.dumps(json.dumps({"data": data[: max(1, rows // 10)]})), name="query-datasource",
+            tool_call_id="d",
+        ),
+        "get-datasource-metadata": ToolMessage(
+            content=[{"type": "text", "text": json.dumps(metadata)}], name="get-datasource-metadata", tool_call_id="m"
+        ),
+        "get-view-image": ToolMessage(
+            content=[
+                {"type": "text", "text": "Here is the view image."},
+                {"type": "image", "data": image, "mime_type": "image/png"},
+            ],
+            name="get-view-image", tool_call_id="v",
+        ),
+    }
+
+
+def _time(fn, message, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(message)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="rows in the query-datasource result")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.rows)
+    print(f"{'payload':36} {'size':>8} {'baseline':>10} {'single-pass':>12} {'speedup':>8}  tables/images")
+    for name, message in payloads.items():
+        size = len(json.dumps(message.content)) + len(json.dumps(message.artifact or {}))
+        old = _time(baseline_extract, message, args.repeat)
+        new = _time(extract_from_tool_message, message, args.repeat)
+        old_images, old_tables = baseline_extract(message)
+        images, tables = extract_from_tool_message(message)
+        found = f"{len(old_tables)}/{len(old_images)} -> {len(tables)}/{len(images)}"
+        print(f"{name:36} {size / 1e6:>6.1f}MB {old * 1000:>8.1f}ms {new * 1000:>10.1f}ms {old / new:>7.1f}x  {found}")
+
+
+if __name__ == "__main__":
+    main()
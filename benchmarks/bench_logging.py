@@ -0,0 +1,99 @@
+"""
+Event-loop stalls from logging: synchronous FileHandler vs the queue pipeline.
+
+A coroutine logs --records lines while a ticker measures event-loop lag. The
+file is written through a stream that stalls for --stall-ms every --every
+writes (standing in for a slow disk or fsync). With the synchronous handler
+the stall lands on the event loop; with the queue pipeline
+(utilities.logging_config) only the writer thread waits, and records beyond
+the queue are dropped and counted.
+
+    python -m benchmarks.bench_logging --records 20000 --stall-ms 50
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from utilities.logging_config import open_pipeline
+
+
+class StallingHandler(logging.FileHandler):
+    def __init__(self, path: str, every: int, stall: float):
+        super().__init__(path, delay=True)
+        self.every, self.stall, self.writes = every, stall, 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        self.writes += 1
+        if self.writes % self.every == 0:
+            time.sleep(self.stall)
+
+
+async def measure(logger: logging.Logger, records: int) -> dict:
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("[thread-%d] Stream completed, final response length: %d", i % 50, i)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    lags.sort()
+    return {"elapsed": elapsed, "p99_lag": lags[int(len(lags) * 0.99)] if lags else 0.0, "max_lag": max(lags, default=0.0)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--every", type=int, default=2000, help="writes between stalls")
+    parser.add_argument("--stall-ms", type=float, default=50)
+    args = parser.parse_args()
+    stall = args.stall_ms / 1000
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        sync_logger = logging.getLogger("bench.sync")
+        sync_logger.propagate = False
+        sync_logger.setLevel(logging.INFO)
+        handler = StallingHandler(os.path.join(directory, "sync.log"), args.every, stall)
+        handler.setFormatter(formatter)
+        sync_logger.addHandler(handler)
+        sync = asyncio.run(measure(sync_logger, args.records))
+        handler.close()
+
+        queued_logger = logging.getLogger("bench.queued")
+        queued_logger.propagate = False
+        queued_logger.setLevel(logging.INFO)
+        pipeline = open_pipeline(os.path.join(directory, "queued.log"), formatter)
+        # Same stalling disk behind the writer thread
+        stalling = StallingHandler(os.path.join(directory, "queued.log"), args.every, stall)
+        stalling.setFormatter(formatter)
+        pipeline.listener.handlers = (stalling,)
+        queued_logger.addHandler(pipeline.handler)
+        queued = asyncio.run(measure(queued_logger, args.records))
+        pipeline.stop()
+        stalling.close()
+
+    print(f"{args.records} records, {args.stall_ms:g}ms stall every {args.every} writes")
+    for name, result in (("sync FileHandler", sync), ("queue pipeline", queued)):
+        print(f"{name:18} logging took {result['elapsed'] * 1000:7.1f}ms  "
+              f"loop lag p99 {result['p99_lag'] * 1000:6.2f}ms  max {result['max_lag'] * 1000:6.1f}ms")
+    print(f"queue pipeline: {pipeline.handler.stats()}")
+
+
+if __name__ == "__main__":
+    main()
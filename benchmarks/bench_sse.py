@@ -0,0 +1,176 @@
+"""
+SSE serialization benchmark for /chat/stream.
+
+Replays recorded streams (JSON lines written when the server runs with
+SSE_RECORD_DIR set) through three encoders and reports time and bytes on the
+wire:
+
+- baseline: f"data: {json.dumps(event, ensure_ascii=False)}" per event, as
+  generate_stream did before utilities/sse.py
+- full: SSEEncoder with the "full" wire format (orjson when installed)
+- delta: SSEEncoder with the "delta" wire format
+
+Delta output is also decoded back (mirroring expandWireEvent in script.js)
+and checked against the original events. Without recordings, synthetic
+streams shaped like real token-streamed answers with tables are used.
+
+    SSE_RECORD_DIR=.state/sse_recordings uvicorn web_app:app   # then chat a bit
+    python -m benchmarks.bench_sse --dir .state/sse_recordings --repeat 20
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import time
+from typing import List
+
+from utilities import sse
+from utilities.sse import SSEEncoder, TableLedger
+from utilities.tables import table_from_rows
+
+
+def load_streams(directory: str) -> List[List[dict]]:
+    streams = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl"))):
+        with open(path, "rb") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        if events:
+            streams.append(events)
+    return streams
+
+
+def synthetic_streams(count: int, rows: int = 120) -> List[List[dict]]:
+    rng = random.Random(11)
+    words = "the west region leads sales while profit in technology grew faster than furniture this year".split()
+    streams = []
+    for n in range(count):
+        events: List[dict] = []
+        thinking = " ".join(rng.choice(words) for _ in range(40))
+        for i in range(0, len(thinking), 6):
+            events.append({"type": "token", "content": thinking[i:i + 6], "is_final": False})
+        events.append({"type": "step", "content": thinking, "is_final": False})
+        events.append({"type": "tool_start", "name": "query-datasource", "tool_call_id": f"call_{n}",
+                       "args": {"datasourceLuid": "abc", "query": {"fields": [{"fieldCaption": "Region"}]}},
+                       "is_final": False})
+        events.append({"type": "tool_end", "name": "query-datasource", "tool_call_id": f"call_{n}",
+                       "status": "success", "is_final": False})
+        answer = "According to the data, " + " ".join(rng.choice(words) for _ in range(150))
+        for i in range(0, len(answer), 6):
+            events.append({"type": "token", "content": answer[i:i + 6], "is_final": False})
+        events.append({"type": "step", "content": answer, "is_final": False})
+        tables = [
+            table_from_rows([
+                {"Region": f"Region {r}", "Category": "Technology", "SUM(Sales)": round(rng.uniform(1, 1e5), 2),
+                 "SUM(Profit)": round(rng.uniform(-1e4, 1e4), 2)}
+                for r in range(rows)
+            ], f"Result {t}")
+            for t in range(3)
+        ]
+        events.append({"type": "final", "content": answer, "images": [], "tables": tables,
+                       "usage": {"model_calls": 2, "input_tokens": 9000, "output_tokens": 400}, "is_final": True})
+        streams.append(events)
+    return streams
+
+
+def baseline_encode(events: List[dict]) -> int:
+    size = 0
+    for event in events:
+        size += len(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+    return size
+
+
+def encoder_encode(events: List[dict], wire_format: str) -> int:
+    encoder = SSEEncoder("bench", wire_format, ledger=TableLedger(), record_dir="")
+    for event in events:
+        encoder.encode(event)
+    return encoder.bytes
+
+
+def decode_delta(events: List[dict]) -> List[dict]:
+    """Encode as delta, then expand the frames the way script.js does."""
+    encoder = SSEEncoder("check", sse.DELTA, ledger=TableLedger(), record_dir="")
+    frames = []
+    for event in events:
+        for chunk in encoder.encode(event).split(b"\n\n"):
+            if chunk.startswith(b"data: "):
+                frames.append(json.loads(chunk[6:]))
+    text, tables, out = "", {}, []
+    for data in frames:
+        if data["type"] == "table":
+            tables[data["id"]] = {k: v for k, v in data.items() if k not in ("type", "id")}
+            continue
+        if data["type"] == "token":
+            text += data.get("content") or ""
+        elif data["type"] == "tool_start":
+            text = ""
+        elif data["type"] in ("step", "final"):
+            if "append" in data:
+                data["content"] = text[:data.pop("keep")] + data.pop("append")
+            text = data.get("content", text)
+            if "table_ids" in data:
+                data["tables"] = [tables[i] for i in data.pop("table_ids") if i in tables]
+        data["is_final"] = data["type"] == "final"
+        out.append(data)
+    return out
+
+
+def _same(original: dict, decoded: dict) -> bool:
+    if original.get("content") != decoded.get("content"):
+        return False
+    return original.get("tables") == decoded.get("tables")
+
+
+def _time(fn, streams, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for events in streams:
+            fn(events)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=os.getenv("SSE_RECORD_DIR") or ".state/sse_recordings")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=20, help="synthetic streams to use when none are recorded")
+    args = parser.parse_args()
+
+    streams = load_streams(args.dir)
+    source = f"{len(streams)} recorded streams from {args.dir}"
+    if not streams:
+        streams = synthetic_streams(args.synthetic)
+        source = f"{len(streams)} synthetic streams (nothing recorded in {args.dir})"
+    total_events = sum(len(events) for events in streams)
+    print(f"{source}, {total_events} events, serializer: {'orjson' if sse.orjson else 'json'}")
+
+    mismatches = 0
+    for events in streams:
+        decoded = decode_delta(events)
+        mismatches += sum(1 for a, b in zip(events, decoded) if not _same(a, b)) + abs(len(events) - len(decoded))
+    print(f"delta round-trip mismatches: {mismatches}")
+
+    rows = [
+        ("baseline (json.dumps)", baseline_encode),
+        ("full", lambda events: encoder_encode(events, sse.FULL)),
+        ("delta", lambda events: encoder_encode(events, sse.DELTA)),
+    ]
+    base_time = base_bytes = None
+    print(f"{'encoder':24} {'time':>10} {'per event':>10} {'bytes':>12} {'vs baseline':>22}")
+    for name, fn in rows:
+        elapsed = _time(fn, streams, args.repeat)
+        size = sum(fn(events) for events in streams)
+        if base_time is None:
+            base_time, base_bytes = elapsed, size
+        print(
+            f"{name:24} {elapsed * 1000:>8.1f}ms {elapsed / total_events * 1e6:>8.1f}us {size:>12,} "
+            f"{base_time / elapsed:>8.1f}x faster {size / base_bytes:>6.0%} size"
+        )
+
+
+if __name__ == "__main__":
+    main()
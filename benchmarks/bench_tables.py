@@ -0,0 +1,109 @@
+"""
+Chart table payloads: previous row dicts vs columnar, downsampled tables.
+
+For query results of a few shapes, compares what the old extractor sent (the
+first 120 rows as dicts, column names repeated on every row) with
+utilities.tables: JSON bytes, build time, and whether the chart is still
+right - how much of the date range a line chart covers, how much of the
+total a bar chart accounts for, and whether the largest value survives.
+
+    python -m benchmarks.bench_tables --rows 100000
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from utilities.tables import table_from_rows
+
+OLD_MAX_ROWS = 120
+
+
+def old_rows(rows: List[dict]) -> List[dict]:
+    return [
+        {str(k): v for k, v in row.items() if v is None or isinstance(v, (str, int, float, bool))}
+        for row in rows[:OLD_MAX_ROWS]
+    ]
+
+
+def datasets(n: int) -> Dict[str, List[dict]]:
+    rng = random.Random(5)
+    start = datetime(2015, 1, 1)
+    series = [
+        {"Order Date": (start + timedelta(hours=i)).isoformat(), "SUM(Sales)": round(rng.gauss(1000, 150), 2)}
+        for i in range(n)
+    ]
+    series[n * 2 // 3]["SUM(Sales)"] = 9000.0  # one spike a chart must keep
+    rng.shuffle(series)
+    daily_by_category = [
+        {"Order Date": (start + timedelta(days=i // 3)).date().isoformat(),
+         "Category": ("Furniture", "Office Supplies", "Technology")[i % 3],
+         "SUM(Sales)": round(rng.uniform(100, 5000), 2)}
+        for i in range(n)
+    ]
+    customers = [
+        {"Customer Name": f"Customer {i}", "Region": ("East", "West", "Central", "South")[i % 4],
+         "SUM(Sales)": round(rng.paretovariate(1.5) * 100, 2)}
+        for i in range(n)
+    ]
+    return {"time series": series, "daily x category": daily_by_category, "customers": customers}
+
+
+DATE_UNIT_SECONDS = {"day": 86400, "s": 1, "ms": 0.001}
+
+
+def _dates(values: List[Any], unit: str = "") -> List[str]:
+    if unit:
+        # Encoded dates (see utilities.tables), back to naive ISO strings
+        values = [(datetime(1970, 1, 1) + timedelta(seconds=v * DATE_UNIT_SECONDS[unit])).isoformat()
+                  for v in values if v is not None]
+    return sorted(v for v in values if isinstance(v, str))
+
+
+def correctness(rows: List[dict], shown_rows: List[dict], table: dict) -> str:
+    sales = [r["SUM(Sales)"] for r in rows]
+    if "Order Date" in rows[0]:
+        all_dates = _dates([r["Order Date"] for r in rows])
+        old = _dates([r["Order Date"] for r in shown_rows])
+        new = _dates(table["values"][table["columns"].index("Order Date")], table.get("date_unit", ""))
+        span = lambda d: (datetime.fromisoformat(d[-1]) - datetime.fromisoformat(d[0])).total_seconds()
+        peak = max(table["values"][table["columns"].index("SUM(Sales)")])
+        by_date: Dict[str, float] = {}
+        for r in rows:
+            by_date[r["Order Date"]] = by_date.get(r["Order Date"], 0.0) + r["SUM(Sales)"]
+        return (f"date range covered {span(old) / span(all_dates):.1%} -> {span(new) / span(all_dates):.1%}, "
+                f"peak {max(r['SUM(Sales)'] for r in shown_rows):g} -> {peak:g} (true {max(by_date.values()):g})")
+    total = sum(sales)
+    old = sum(r["SUM(Sales)"] for r in shown_rows[:30])
+    new = sum(table["values"][table["columns"].index("SUM(Sales)")])
+    return (f"bars account for {old / total:.1%} -> {new / total:.1%} of total, "
+            f"largest bar {max(r['SUM(Sales)'] for r in shown_rows[:30]):g} -> "
+            f"{max(table['values'][table['columns'].index('SUM(Sales)')][:-1]):g} (true {max(sales):g})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, rows in datasets(args.rows).items():
+        shown = old_rows(rows)
+        old_bytes = len(json.dumps({"title": name, "rows": shown}))
+        start = time.perf_counter()
+        table = table_from_rows(rows, name)
+        elapsed = time.perf_counter() - start
+        new_bytes = len(json.dumps(table))
+        merged = table.get("aggregated") and table["aggregated"][table["columns"].index("SUM(Sales)")]
+        sampled = "+".join(filter(None, [merged, table.get("sampled")])) or "none"
+        points = len(table["values"][0])
+        print(f"{name} ({len(rows):,} rows, built in {elapsed * 1000:.0f}ms, {sampled}): "
+              f"{len(shown)} rows in {old_bytes:,} bytes ({old_bytes / len(shown):.0f}/row) -> "
+              f"{points} points in {new_bytes:,} bytes ({new_bytes / points:.0f}/point)")
+        print(f"    {correctness(rows, shown, table)}")
+
+
+if __name__ == "__main__":
+    main()
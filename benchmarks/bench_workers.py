@@ -0,0 +1,162 @@
+"""
+Throughput scaling benchmark: 1..N gunicorn workers sharing the SQLite state backend.
+
+Starts the stub MCP server, then for each worker count starts gunicorn serving
+benchmarks.stub_app with STATE_BACKEND=sqlite and drives concurrent clients.
+Each client conversation creates a session and sends two questions. The
+requests land on whichever worker accepts them, so this also checks that a
+conversation survives hopping between workers. Before each run it checks that
+a busy conversation rejects a second question with 409 and that /chat/cancel
+stops its run, whichever worker receives them.
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --clients 32 --duration 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+async def _conversation(client: httpx.AsyncClient, base_url: str) -> None:
+    thread_id = (await client.get(f"{base_url}/session")).json()["thread_id"]
+    for question in ("Sales by region?", "And which region is last?"):
+        async with client.stream(
+            "POST", f"{base_url}/chat/stream", json={"message": question, "thread_id": thread_id}
+        ) as response:
+            response.raise_for_status()
+            body = b"".join([chunk async for chunk in response.aiter_bytes()])
+        if b'"type": "final"' not in body and b'"type":"final"' not in body:
+            raise RuntimeError("stream ended without a final event")
+        if b"Unknown thread_id" in body:
+            raise RuntimeError("conversation lost between workers")
+
+
+async def _check_single_run(base_url: str, attempts: int = 4) -> None:
+    async with httpx.AsyncClient(timeout=60) as client:
+        thread_id = (await client.get(f"{base_url}/session")).json()["thread_id"]
+        async with client.stream(
+            "POST", f"{base_url}/chat/stream", json={"message": "Sales by region?", "thread_id": thread_id}
+        ) as running:
+            running.raise_for_status()
+            chunks = running.aiter_bytes()
+            body = await chunks.__anext__()
+            for _ in range(attempts):
+                second = await client.post(f"{base_url}/chat/stream", json={"message": "Again?", "thread_id": thread_id})
+                if second.status_code != 409:
+                    raise RuntimeError(f"second run on a busy conversation got {second.status_code}, expected 409")
+            if not (await client.post(f"{base_url}/chat/cancel", json={"thread_id": thread_id})).json()["cancelled"]:
+                raise RuntimeError("cancel did not find the running conversation")
+            body += b"".join([chunk async for chunk in chunks])
+        if b"Stopped." not in body:
+            raise RuntimeError(f"cancelled run did not stop: {body[-600:]!r}")
+
+
+async def _drive(base_url: str, clients: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client_loop():
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=120) as client:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    await _conversation(client, base_url)
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "conversations": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else float("nan"),
+    }
+
+
+def _start(cmd, env) -> subprocess.Popen:
+    return subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mcp-port", type=int, default=3928)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        "TABLEAU_MCP_HTTP_URL": f"http://127.0.0.1:{args.mcp_port}/tableau-mcp",
+        "STATE_BACKEND": "sqlite",
+        "USE_LANGFUSE": "none",
+        # Workers poll for cancels sent to another worker at this interval
+        "RUN_DISCONNECT_POLL_SECONDS": "0.2",
+    })
+    mcp_server = _start([sys.executable, "-m", "benchmarks.stubs", str(args.mcp_port)], env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    try:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as state_dir:
+                env["STATE_SQLITE_PATH"] = os.path.join(state_dir, "bench.sqlite")
+                server = _start([
+                    sys.executable, "-m", "gunicorn",
+                    "--workers", str(workers),
+                    "--worker-class", "uvicorn.workers.UvicornWorker",
+                    "--bind", f"127.0.0.1:{args.port}",
+                    "benchmarks.stub_app:app",
+                ], env)
+                try:
+                    asyncio.run(_wait_ready(f"{base_url}/session"))
+                    asyncio.run(_check_single_run(base_url))
+                    result = asyncio.run(_drive(base_url, args.clients, args.duration))
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+            result["workers"] = workers
+            results.append(result)
+            print(f"workers={workers}: {result['throughput']:.1f} conv/s, p50={result['p50']:.2f}s, "
+                  f"p95={result['p95']:.2f}s, errors={result['errors']}", flush=True)
+    finally:
+        mcp_server.terminate()
+
+    base = results[0]["throughput"] or 1
+    print("\nworkers  conv/s  speedup  p50(s)  p95(s)  errors")
+    for r in results:
+        print(f"{r['workers']:>7}  {r['throughput']:>6.1f}  {r['throughput'] / base:>6.2f}x  "
+              f"{r['p50']:>6.2f}  {r['p95']:>6.2f}  {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
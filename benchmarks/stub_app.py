@@ -0,0 +1,17 @@
+"""
+web_app with the LLM swapped for StubChatModel, for benchmarks.
+
+    gunicorn -w 4 -k uvicorn.workers.UvicornWorker benchmarks.stub_app:app
+"""
+
+import os
+
+os.environ.setdefault("USE_LANGFUSE", "none")
+
+import utilities.model_provider as model_provider
+from benchmarks.stubs import StubChatModel
+
+# web_app imports get_llm by name, so patch before importing it
+model_provider.get_llm = lambda *args, **kwargs: StubChatModel()
+
+from web_app import app  # noqa: E402
@@ -0,0 +1,90 @@
+"""
+Stub LLM and MCP server for benchmarks.
+
+StubChatModel plays a fixed two-step ReAct turn (one query-datasource call, then
+an answer) with configurable latency and CPU cost. The stub MCP server exposes
+the Tableau MCP tool names over Streamable HTTP with canned results.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+def _burn_cpu(ms: float) -> None:
+    """Busy-loop to stand in for per-call CPU work (tokenizing, parsing, serializing)."""
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+class StubChatModel(BaseChatModel):
+    """Calls query-datasource once per question, then answers."""
+
+    latency: float = float(os.getenv("STUB_LLM_LATENCY", "0.3"))
+    cpu_ms: float = float(os.getenv("STUB_LLM_CPU_MS", "20"))
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages) -> AIMessage:
+        _burn_cpu(self.cpu_ms)
+        if not isinstance(messages[-1], ToolMessage):
+            return AIMessage(
+                content="Querying the datasource.",
+                tool_calls=[{
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "name": "query-datasource",
+                    "args": {"datasourceLuid": "stub-luid", "query": {"fields": [{"fieldCaption": "Region"}]}},
+                }],
+            )
+        return AIMessage(content="According to the data, West leads with **$725K** in sales.")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+
+def run_stub_mcp_server(port: int) -> None:
+    """Serve stub Tableau MCP tools at http://127.0.0.1:<port>/tableau-mcp."""
+    from mcp.server.fastmcp import FastMCP
+
+    latency = float(os.getenv("STUB_MCP_LATENCY", "0.2"))
+    server = FastMCP("stub-tableau", host="127.0.0.1", port=port, streamable_http_path="/tableau-mcp", log_level="WARNING")
+    rows = [{"Region": r, "SUM(Sales)": s} for r, s in (("West", 725457.8), ("East", 678781.2), ("Central", 501239.9), ("South", 391721.9))]
+
+    @server.tool(name="list-datasources")
+    async def list_datasources() -> str:
+        await asyncio.sleep(latency)
+        return json.dumps([{"id": "stub-luid", "name": "Superstore", "projectName": "Samples"}])
+
+    @server.tool(name="get-datasource-metadata")
+    async def get_datasource_metadata(datasourceLuid: str) -> str:
+        await asyncio.sleep(latency)
+        return json.dumps({"fields": [{"name": "Region", "dataType": "STRING"}, {"name": "Sales", "dataType": "REAL"}]})
+
+    @server.tool(name="query-datasource")
+    async def query_datasource(datasourceLuid: str, query: dict) -> str:
+        await asyncio.sleep(latency)
+        return json.dumps({"data": rows})
+
+    server.run(transport="streamable-http")
+
+
+if __name__ == "__main__":
+    run_stub_mcp_server(int(sys.argv[1]) if len(sys.argv) > 1 else 3928)
@@ -6,6 +6,8 @@ console.log("script.js IS LOADED");
 let THREAD_ID = null;
 // AbortController for stopping requests
 let currentAbortController = null;
+// Tables received over the delta wire format, by id (kept for the conversation)
+let WIRE_TABLES = new Map();
 
 // -----------------------------
 // Status indicator helpers
@@ -46,6 +48,7 @@ async function initSession() {
         const res = await fetch('/session');
         const data = await res.json();
         THREAD_ID = data.thread_id;
+        WIRE_TABLES = new Map();
         
         console.log("Initialized conversation thread:", THREAD_ID);
         setStatus('● Connected', 'ok');
@@ -102,11 +105,34 @@ async function sendMessage() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 message: message,
-                thread_id: THREAD_ID
+                thread_id: THREAD_ID,
+                stream_tokens: true,
+                wire_format: 'delta'
             }),
             signal: currentAbortController.signal
         });
 
+        if (response.status === 400) {
+            // Session expired or was evicted on the server - start a fresh one
+            await initSession();
+            updateStreamingMessage(streamingContext, {
+                type: 'final',
+                content: '⌛ Your session expired, so a new one was started. Please send your question again.',
+                is_final: true
+            });
+            return;
+        }
+        if (response.status === 409 || response.status === 429) {
+            // Already answering in this conversation, or the server queue is full
+            updateStreamingMessage(streamingContext, {
+                type: 'final',
+                content: response.status === 409
+                    ? '⏳ Still working on your previous question. Please wait for it to finish or stop it first.'
+                    : '🚦 Tabby is busy right now. Please try again in a few seconds.',
+                is_final: true
+            });
+            return;
+        }
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}`);
         }
@@ -114,6 +140,11 @@ async function sendMessage() {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = '';
+        const wireState = { text: '' };
+        const handleEvent = (data) => {
+            const event = expandWireEvent(wireState, data);
+            if (event) updateStreamingMessage(streamingContext, event);
+        };
 
         while (true) {
             const { value, done } = await reader.read();
@@ -125,7 +156,7 @@ async function sendMessage() {
                         if (line.startsWith('data: ')) {
                             try {
                                 const data = JSON.parse(line.slice(6));
-                                updateStreamingMessage(streamingContext, data);
+                                handleEvent(data);
                             } catch (e) {
                                 console.error('Error parsing SSE data on close:', e, 'Line:', line.substring(0, 100));
                             }
@@ -146,7 +177,7 @@ async function sendMessage() {
                     try {
                         const jsonStr = line.slice(6);
                         const data = JSON.parse(jsonStr);
-                        updateStreamingMessage(streamingContext, data);
+                        handleEvent(data);
                     } catch (e) {
                         console.error('Error parsing SSE data:', e);
                         console.error('Problematic line:', line.substring(0, 200));
@@ -188,12 +219,73 @@ async function sendMessage() {
     }
 }
 
+// -----------------------------
+// Delta wire format
+// -----------------------------
+/**
+ * Turn a delta-format event back into the full event updateStreamingMessage expects.
+ * step/final carry {keep, append} against the text currently shown; tables arrive once
+ * as `table` events and `final` lists their ids. Returns null for table events.
+ */
+function expandWireEvent(state, data) {
+    if (data.type === 'table') {
+        const { type, id, ...table } = data;
+        WIRE_TABLES.set(id, decodeTableDates(table));
+        return null;
+    }
+    if (data.type === 'token') {
+        state.text += data.content || '';
+    } else if (data.type === 'tool_start') {
+        state.text = '';
+    } else if (data.type === 'step' || data.type === 'final') {
+        if (typeof data.content !== 'string' && typeof data.append === 'string') {
+            data.content = state.text.slice(0, data.keep || 0) + data.append;
+        }
+        if (typeof data.content === 'string') state.text = data.content;
+        if (Array.isArray(data.table_ids)) {
+            data.tables = data.table_ids.map((id) => WIRE_TABLES.get(id)).filter(Boolean);
+        }
+    }
+    if (Array.isArray(data.tables)) data.tables.forEach(decodeTableDates);
+    data.is_final = data.type === 'final';
+    return data;
+}
+
+const DATE_UNIT_MS = { day: 86400000, s: 1000, ms: 1 };
+
+/**
+ * Date columns arrive as numbers since the epoch in `table.date_unit`; turn them back
+ * into ISO strings (UTC) in place. Tables already decoded are left alone.
+ */
+function decodeTableDates(table) {
+    const scale = table && DATE_UNIT_MS[table.date_unit];
+    if (!scale || !Array.isArray(table.values)) return table;
+    const length = table.date_unit === 'day' ? 10 : table.date_unit === 's' ? 19 : 23;
+    (table.dtypes || []).forEach((dtype, i) => {
+        if (dtype !== 'date' || !Array.isArray(table.values[i])) return;
+        table.values[i] = table.values[i].map((v) => (
+            v == null ? null : new Date(v * scale).toISOString().slice(0, length)
+        ));
+    });
+    delete table.date_unit;
+    return table;
+}
+
 // -----------------------------
 // Stop generation
 // -----------------------------
 function stopGeneration() {
     if (currentAbortController) {
         console.log('Stopping generation...');
+        // Tell the server to stop the agent run too, not just this fetch
+        if (THREAD_ID) {
+            fetch('/chat/cancel', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ thread_id: THREAD_ID }),
+                keepalive: true
+            }).catch(err => console.warn('Cancel request failed:', err));
+        }
         currentAbortController.abort();
     }
 }
@@ -296,7 +388,8 @@ function escapeAttr(value) {
 }
 
 function renderImage(src, alt = 'View image') {
-    if (typeof src !== 'string' || !src.startsWith('data:image/')) return '';
+    // Server-stored images arrive as /images/<hash>; inline data URLs are still accepted
+    if (typeof src !== 'string' || !(src.startsWith('/images/') || src.startsWith('data:image/'))) return '';
     return `<figure class="chat-image-wrap"><img class="chat-image" alt="${escapeAttr(alt)}" src="${escapeAttr(src)}"></figure>`;
 }
 
@@ -319,52 +412,37 @@ function formatChatReply(text, images) {
     return html;
 }
 
-function toNumber(value) {
-    if (typeof value === 'number' && Number.isFinite(value)) return value;
-    if (typeof value === 'string') {
-        const cleaned = value.replace(/[$,%\s,]/g, '');
-        const n = Number(cleaned);
-        return Number.isFinite(n) ? n : null;
-    }
-    return null;
-}
-
-function toDateMs(value) {
-    if (typeof value !== 'string' && typeof value !== 'number') return null;
-    const ms = new Date(value).getTime();
-    return Number.isFinite(ms) ? ms : null;
-}
-
+/**
+ * Chart config for a columnar table from the server (utilities/tables.py): column
+ * dtypes are already inferred, numbers are numbers, dates are sorted ISO strings
+ * (decoded by expandWireEvent) and large results arrive downsampled, with merged rows marked in `aggregated`.
+ */
 function inferChartConfig(table) {
-    if (!table || !Array.isArray(table.rows) || table.rows.length < 2) return null;
-    const rows = table.rows.slice(0, 80);
-    const columns = Object.keys(rows[0] || {});
-    if (!columns.length) return null;
-
-    const numericCols = columns.filter((col) => {
-        let ok = 0;
-        for (const row of rows) if (toNumber(row[col]) !== null) ok += 1;
-        return ok >= Math.max(2, Math.floor(rows.length * 0.5));
-    });
+    if (!table || !Array.isArray(table.columns) || !Array.isArray(table.values)) return null;
+    const columns = table.columns;
+    const dtypes = table.dtypes || [];
+    const column = (name) => table.values[columns.indexOf(name)] || [];
+    const numericCols = columns.filter((c, i) => dtypes[i] === 'number');
     if (!numericCols.length) return null;
-
-    const dateCols = columns.filter((col) => {
-        let ok = 0;
-        for (const row of rows) if (toDateMs(row[col]) !== null) ok += 1;
-        return ok >= Math.max(2, Math.floor(rows.length * 0.6));
-    });
-
-    if (dateCols.length) {
-        const dateCol = dateCols[0];
-        const valueCol = numericCols.find((c) => c !== dateCol) || numericCols[0];
-        const points = rows
-            .map((r) => ({ t: toDateMs(r[dateCol]), x: r[dateCol], y: toNumber(r[valueCol]) }))
-            .filter((p) => p.t !== null && p.y !== null)
-            .sort((a, b) => a.t - b.t);
+    const shown = column(columns[0]).length;
+    let note = '';
+    if (table.sampled === 'top_n') note = ` (top ${shown - 1} of ${table.row_count} + Other)`;
+    else if (table.sampled) note = ` (${shown} of ${table.row_count} points)`;
+
+    const dateCol = columns.find((c, i) => dtypes[i] === 'date');
+    if (dateCol) {
+        const valueCol = numericCols[0];
+        const ys = column(valueCol);
+        const points = column(dateCol)
+            .map((x, i) => ({ x: x, y: ys[i] }))
+            .filter((p) => p.x != null && p.y != null);
         if (points.length < 2) return null;
+        // Rows merged per date say how each number column was combined
+        const merged = Array.isArray(table.aggregated) ? table.aggregated[columns.indexOf(valueCol)] : null;
+        const prefix = { sum: 'Total ', min: 'Lowest ', max: 'Highest ' }[merged] || '';
         return {
             type: 'line',
-            title: `${table.title || 'Time Series'}: ${valueCol} over ${dateCol}`,
+            title: `${table.title || 'Time Series'}: ${prefix}${valueCol} over ${dateCol}${note}`,
             labels: points.map((p) => String(p.x)),
             datasets: [{
                 label: valueCol,
@@ -377,19 +455,20 @@ function inferChartConfig(table) {
         };
     }
 
-    const categoryCol = columns.find((c) => !numericCols.includes(c)) || columns[0];
-    const valueCol = numericCols[0];
-    const bars = rows
-        .map((r) => ({ c: r[categoryCol], y: toNumber(r[valueCol]) }))
-        .filter((p) => p.c != null && p.y !== null);
+    const categoryCol = columns.find((c, i) => dtypes[i] === 'string') || columns[0];
+    const valueCol = numericCols.find((c) => c !== categoryCol) || numericCols[0];
+    const ys = column(valueCol);
+    const bars = column(categoryCol)
+        .map((c, i) => ({ c: c, y: ys[i] }))
+        .filter((p) => p.c != null && p.y != null);
     if (bars.length < 2) return null;
     return {
         type: 'bar',
-        title: `${table.title || 'Category Metrics'}: ${valueCol} by ${categoryCol}`,
-        labels: bars.slice(0, 30).map((p) => String(p.c)),
+        title: `${table.title || 'Category Metrics'}: ${valueCol} by ${categoryCol}${note}`,
+        labels: bars.map((p) => String(p.c)),
         datasets: [{
             label: valueCol,
-            data: bars.slice(0, 30).map((p) => p.y),
+            data: bars.map((p) => p.y),
             backgroundColor: 'rgba(59, 130, 246, 0.7)',
             borderColor: 'rgba(59, 130, 246, 1)',
             borderWidth: 1
@@ -476,8 +555,24 @@ function updateStreamingMessage(streamingElement, data) {
         return;
     }
     
-    if (data.type === 'step') {
-        // Update with intermediate step content
+    if (data.type === 'token') {
+        // Token streaming: append to the in-progress AI message and re-render
+        streamingElement._tokenText = (streamingElement._tokenText || '') + (data.content || '');
+        streamingElement.innerHTML = `<div class="thinking"><img src="static/favicon.ico" class="thinking-cat"> ${formatMarkdown(streamingElement._tokenText)}</div>`;
+        const chatBox = document.getElementById('chatBox');
+        chatBox.scrollTop = chatBox.scrollHeight;
+    } else if (data.type === 'queued') {
+        // Waiting for a free run slot on the server
+        streamingElement.innerHTML = `<div class="thinking"><img src="static/favicon.ico" class="thinking-cat"> Waiting in line… position ${data.position}</div>`;
+    } else if (data.type === 'tool_start') {
+        // The next AI message starts a fresh token buffer
+        streamingElement._tokenText = '';
+        streamingElement.innerHTML = `<div class="thinking"><img src="static/favicon.ico" class="thinking-cat"> ${formatMarkdown('Running `' + (data.name || 'tool') + '`…')}</div>`;
+    } else if (data.type === 'tool_end') {
+        // Nothing to render; the next token/step event replaces the tool status
+    } else if (data.type === 'step') {
+        // Update with intermediate step content (the complete AI message)
+        streamingElement._tokenText = '';
         streamingElement.innerHTML = `<div class="thinking"><img src="static/favicon.ico" class="thinking-cat"> ${formatMarkdown(data.content)}</div>`;
         // Only scroll if it is an intermediate step and not the final response
         const chatBox = document.getElementById('chatBox');
@@ -0,0 +1,202 @@
+"""
+Blob Store
+
+Content-addressed storage for large binary payloads (view images) so they can be
+served from a cacheable URL instead of travelling inline in SSE events.
+
+Blobs are keyed by the SHA-256 of their bytes. A bounded in-memory LRU serves hot
+blobs; every blob is also written to a bounded directory on disk, which survives
+memory eviction and is shared by all workers on the host. Disk writes happen on
+a background thread, so put() never waits for the disk.
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:([a-zA-Z0-9.+/-]+);base64,(.*)$", re.DOTALL)
+
+
+def is_blob_hash(value: str) -> bool:
+    return bool(_HASH_RE.fullmatch(value or ""))
+
+
+class BlobStore:
+    """
+    Bounded content-addressed blob store with memory LRU and disk spill.
+
+    Args:
+        directory: Disk location for blobs. If None, reads <env_prefix>_DIR
+            (default ".state/images"); an empty value keeps blobs in memory only.
+        memory_mb: Memory cache size. If None, reads <env_prefix>_MEMORY_MB (default 64).
+        disk_mb: Disk quota; oldest files are removed beyond it. If None, reads
+            <env_prefix>_DISK_MB (default 1024).
+        env_prefix: Prefix of the environment variables above (default "IMAGE_STORE").
+        default_directory: Directory used when <env_prefix>_DIR is unset.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        memory_mb: Optional[float] = None,
+        disk_mb: Optional[float] = None,
+        env_prefix: str = "IMAGE_STORE",
+        default_directory: str = ".state/images",
+    ):
+        self.directory = directory if directory is not None else os.getenv(f"{env_prefix}_DIR", default_directory)
+        memory = memory_mb if memory_mb is not None else float(os.getenv(f"{env_prefix}_MEMORY_MB", "64"))
+        disk = disk_mb if disk_mb is not None else float(os.getenv(f"{env_prefix}_DISK_MB", "1024"))
+        self.max_memory_bytes = int(memory * 1024 * 1024)
+        self.max_disk_bytes = int(disk * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        # hash -> (mime, data), least recently used first
+        self._memory: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        # Blobs queued for the disk writer; served from here until written
+        self._pending: Dict[str, Tuple[str, bytes]] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-writer")
+        self._disk_bytes = 0
+        self.puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    def put(self, data: bytes, mime: str = "application/octet-stream") -> str:
+        """Store bytes and return their hash. Storing the same bytes twice is a no-op."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.puts += 1
+            self._remember(digest, mime, data)
+            if not self.directory or digest in self._pending:
+                return digest
+            self._pending[digest] = (mime, data)
+        self._writer.submit(self._write_disk, digest, mime, data)
+        return digest
+
+    def put_data_url(self, url: str) -> Optional[str]:
+        """Store a base64 data URL. Returns the blob hash, or None if it can't be decoded."""
+        match = _DATA_URL_RE.match(url)
+        if not match:
+            return None
+        try:
+            data = base64.b64decode(re.sub(r"\s+", "", match.group(2)), validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return self.put(data, match.group(1))
+
+    def get(self, digest: str) -> Optional[Tuple[str, bytes]]:
+        """Return (mime, data) for a hash, or None if it was never stored or has been evicted."""
+        if not is_blob_hash(digest):
+            return None
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None:
+                self._memory.move_to_end(digest)
+                self.memory_hits += 1
+                return entry
+            entry = self._pending.get(digest)
+            if entry is not None:
+                self.memory_hits += 1
+                return entry
+        if not self.directory:
+            self.misses += 1
+            return None
+        try:
+            with open(self._disk_path(digest), "rb") as f:
+                # File layout: mime type, newline, raw bytes
+                mime = f.readline().decode("ascii", "replace").strip() or "application/octet-stream"
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(digest, mime, data)
+        return mime, data
+
+    def _remember(self, digest: str, mime: str, data: bytes) -> None:
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return
+        if len(data) > self.max_memory_bytes:
+            return
+        self._memory[digest] = (mime, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def _write_disk(self, digest: str, mime: str, data: bytes) -> None:
+        """Runs on the writer thread."""
+        try:
+            path = self._disk_path(digest)
+            if os.path.exists(path):
+                return
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                header = mime.encode("ascii", "replace") + b"\n"
+                with open(tmp_path, "wb") as f:
+                    f.write(header)
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to write blob {digest[:12]} to disk: {e}")
+                return
+            self._disk_bytes += len(header) + len(data)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._trim_disk()
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def flush(self) -> None:
+        """Wait for queued disk writes and stop the writer thread."""
+        self._writer.shutdown(wait=True)
+
+    def _trim_disk(self) -> None:
+        """Remove the oldest blob files until the directory is back under quota."""
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                continue
+        self._disk_bytes = total
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "pending_writes": len(self._pending),
+            "puts": self.puts,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -1,6 +1,14 @@
 import json
+import logging
+import os
 import re
-from typing import Any, List
+import time
+from typing import Any, List, Tuple
+
+from utilities import metrics
+from utilities.tables import TableSource, table_key
+
+logger = logging.getLogger(__name__)
 
 
 def _mcp_image_block_to_data_url(obj: Any) -> str | None:
@@ -8,7 +16,8 @@ def _mcp_image_block_to_data_url(obj: Any) -> str | None:
     if obj is None:
         return None
     if isinstance(obj, dict) and obj.get("type") == "image":
-        data = obj.get("data")
+        # MCP ImageContent dumps use "data"; LangChain image blocks use "base64"
+        data = obj.get("data") or obj.get("base64")
         mime = obj.get("mimeType") or obj.get("mime_type") or "image/png"
         if isinstance(data, str) and data.strip():
             return f"data:{mime};base64,{data.strip()}"
@@ -23,168 +32,167 @@ def _mcp_image_block_to_data_url(obj: Any) -> str | None:
 _DATA_URI_IMAGE_RE = re.compile(r"data:image/[a-zA-Z0-9.+-]+;base64,[A-Za-z0-9+/=\s]+")
 _BASE64_RE = re.compile(r"^[A-Za-z0-9+/]+=*$")
 
-
-def _extract_images_from_any(content: Any) -> List[str]:
-    """Extract data:image URLs from strings, dict/list content, or image blocks."""
-    found: List[str] = []
-    seen: set[str] = set()
-
-    def add(url: str) -> None:
-        normalized = re.sub(r"\s+", "", url.strip())
-        if not normalized or normalized in seen:
-            return
-        seen.add(normalized)
-        found.append(normalized)
-
-    def walk(value: Any) -> None:
-        if value is None:
-            return
-        block_url = _mcp_image_block_to_data_url(value)
-        if block_url:
-            add(block_url)
-            return
-        if isinstance(value, str):
-            for m in _DATA_URI_IMAGE_RE.finditer(value):
-                add(m.group(0))
-            compact = re.sub(r"\s+", "", value)
-            if len(compact) > 500 and _BASE64_RE.fullmatch(compact):
-                add("data:image/png;base64," + compact)
-            try:
-                decoded = json.loads(value)
-            except (TypeError, ValueError, json.JSONDecodeError):
-                return
-            walk(decoded)
-            return
-        if isinstance(value, dict):
-            for _, sub in value.items():
-                walk(sub)
-            return
-        if isinstance(value, list):
-            for item in value:
-                walk(item)
-
-    walk(content)
-    return found
+# Work caps for extract_from_tool_message, so a multi-MB result can't stall the event loop:
+# containers/strings visited per message, and the largest string worth json-decoding
+EXTRACT_MAX_NODES = int(os.getenv("TOOL_EXTRACT_MAX_NODES", "50000"))
+EXTRACT_MAX_JSON_CHARS = int(float(os.getenv("TOOL_EXTRACT_MAX_JSON_MB", "16")) * 1024 * 1024)
+# JSON nested inside JSON strings is decoded at most this many levels deep
+EXTRACT_MAX_DECODE_DEPTH = 2
+# Keep payload modest for SSE
+MAX_TABLES_PER_MESSAGE = 4
+# Rows of a recognized table that are walked for nested images/tables
+TABLE_SCAN_ROWS = 120
+TABLE_CONTAINER_KEYS = ("data", "result", "results", "records", "items", "values")
+
+
+def _is_image_tool(tool_name: Any) -> bool:
+    if not isinstance(tool_name, str):
+        return False
+    tl = tool_name.lower().replace("_", "-")
+    return "view-image" in tl or tl.endswith("get-view-image")
 
 
-def extract_images_from_tool_message(message: Any) -> List[str]:
-    urls: List[str] = []
-    for url in _extract_images_from_any(getattr(message, "content", None)):
-        if url not in urls:
-            urls.append(url)
-    for url in _extract_images_from_any(getattr(message, "artifact", None)):
-        if url not in urls:
-            urls.append(url)
-    return urls
+def _looks_like_json(text: str) -> bool:
+    return text[:64].lstrip()[:1] in ("{", "[", "\"")
 
 
 def _is_scalar(value: Any) -> bool:
     return value is None or isinstance(value, (str, int, float, bool))
 
 
-def _normalize_rows_dict_list(rows: Any, max_rows: int = 120) -> List[dict]:
-    if not isinstance(rows, list):
-        return []
-    normalized: List[dict] = []
-    for row in rows[:max_rows]:
-        if isinstance(row, dict):
-            clean = {str(k): v for k, v in row.items() if _is_scalar(v)}
-            if clean:
-                normalized.append(clean)
-    return normalized
-
-
-def _normalize_rows_with_columns(obj: dict, max_rows: int = 120) -> List[dict]:
-    columns = obj.get("columns")
-    rows = obj.get("rows")
-    if not isinstance(columns, list) or not isinstance(rows, list):
-        return []
-    col_names = [str(c) for c in columns]
-    normalized: List[dict] = []
-    for row in rows[:max_rows]:
-        if isinstance(row, list):
-            mapped = {}
-            for i, col in enumerate(col_names):
-                if i < len(row) and _is_scalar(row[i]):
-                    mapped[col] = row[i]
-            if mapped:
-                normalized.append(mapped)
-        elif isinstance(row, dict):
-            mapped = {str(k): v for k, v in row.items() if _is_scalar(v)}
-            if mapped:
-                normalized.append(mapped)
-    return normalized
-
-
-def _extract_tables_from_any(content: Any) -> List[dict]:
-    """Extract compact tabular data candidates from tool outputs."""
-    candidates: List[dict] = []
-    seen: set[str] = set()
-
-    def add_table(rows: List[dict], title: str = "Tool Result") -> None:
-        if len(rows) < 2:
+class _ToolOutputExtractor:
+    """
+    One walk over a tool result collecting view images and chartable tables.
+
+    Each JSON string is decoded once; strings that can't be JSON (don't start
+    with {, [ or a quote) are never handed to json.loads. Plain scalar cells are
+    skipped without a recursive call, rows of a recognized table past the first
+    TABLE_SCAN_ROWS aren't walked, and base64 scanning only happens for image
+    tools. Tables are deduped by a hash of their first rows and built as
+    columnar, downsampled payloads (utilities.tables).
+    """
+
+    def __init__(self, scan_base64: bool, collect_tables: bool):
+        self.scan_base64 = scan_base64
+        self.collect_tables = collect_tables
+        self.images: List[str] = []
+        self.tables: List[dict] = []
+        self.nodes = 0
+        self.truncated = False
+        self._image_keys: set = set()
+        self._table_keys: set = set()
+        self._sources: dict = {}
+
+    def add_image(self, url: str) -> None:
+        normalized = "".join(url.split())
+        if not normalized or normalized in self._image_keys:
             return
-        # Require at least one numeric value somewhere for charting potential.
-        has_numeric = any(
-            isinstance(v, (int, float)) and not isinstance(v, bool)
-            for row in rows for v in row.values()
-        )
-        if not has_numeric:
+        self._image_keys.add(normalized)
+        self.images.append(normalized)
+
+    def add_table(self, source: TableSource | None, title: str) -> None:
+        # Require a number column for charting potential
+        if source is None or not source.chartable or len(self.tables) >= MAX_TABLES_PER_MESSAGE:
             return
-        key = json.dumps(rows[:20], sort_keys=True, default=str)
-        if key in seen:
+        key = source.key()
+        if key in self._table_keys:
             return
-        seen.add(key)
-        candidates.append({"title": title, "rows": rows})
+        self._table_keys.add(key)
+        self.tables.append(source.build(title))
 
-    def walk(value: Any, path_hint: str = "Tool Result") -> None:
-        if value is None:
+    def _wants(self, value: Any) -> bool:
+        """Whether a child value could hold an image or table."""
+        if isinstance(value, (dict, list)):
+            return True
+        if isinstance(value, str):
+            return self.scan_base64 or _looks_like_json(value)
+        return not _is_scalar(value)
+
+    def _source(self, value: Any) -> TableSource | None:
+        # A container list is also reached by the walk itself; type it once
+        if not isinstance(value, list):
+            return None
+        # (the list is kept alongside, so its id can't be reused while we walk)
+        entry = self._sources.get(id(value))
+        if entry is None:
+            entry = self._sources[id(value)] = (value, TableSource.from_records(value))
+        return entry[1]
+
+    def walk(self, value: Any, hint: str = "Tool Result", depth: int = 0) -> None:
+        if self.nodes >= EXTRACT_MAX_NODES:
+            self.truncated = True
             return
+        self.nodes += 1
         if isinstance(value, str):
-            try:
-                decoded = json.loads(value)
-            except (TypeError, ValueError, json.JSONDecodeError):
-                return
-            walk(decoded, path_hint)
+            self._walk_string(value, hint, depth)
             return
-        if isinstance(value, list):
-            rows = _normalize_rows_dict_list(value)
-            if rows:
-                add_table(rows, path_hint)
-            for item in value:
-                walk(item, path_hint)
+        block_url = _mcp_image_block_to_data_url(value)
+        if block_url:
+            self.add_image(block_url)
             return
         if isinstance(value, dict):
-            title = str(value.get("name") or value.get("title") or value.get("caption") or path_hint)
-            # Common tabular container shapes.
-            for key in ("data", "result", "results", "records", "items", "values"):
-                rows = _normalize_rows_dict_list(value.get(key))
-                if rows:
-                    add_table(rows, title)
-            rows = _normalize_rows_with_columns(value)
-            if rows:
-                add_table(rows, title)
+            if self.collect_tables:
+                title = str(value.get("name") or value.get("title") or value.get("caption") or hint)
+                # Common tabular container shapes.
+                for key in TABLE_CONTAINER_KEYS:
+                    self.add_table(self._source(value.get(key)), title)
+                if "columns" in value and "rows" in value:
+                    self.add_table(TableSource.from_columns(value), title)
             for k, sub in value.items():
-                walk(sub, str(k))
+                if self._wants(sub):
+                    self.walk(sub, str(k), depth)
+        elif isinstance(value, list):
+            items = value
+            if self.collect_tables:
+                source = self._source(value)
+                if source is not None:
+                    self.add_table(source, hint)
+                    # Result rows share one shape; only the first few are worth a look
+                    items = value[:TABLE_SCAN_ROWS]
+            for item in items:
+                if self._wants(item):
+                    self.walk(item, hint, depth)
+
+    def _walk_string(self, value: str, hint: str, depth: int) -> None:
+        if self.scan_base64:
+            if "data:image/" in value:
+                for m in _DATA_URI_IMAGE_RE.finditer(value):
+                    self.add_image(m.group(0))
+            elif len(value) > 500:
+                compact = "".join(value.split())
+                if _BASE64_RE.fullmatch(compact):
+                    self.add_image("data:image/png;base64," + compact)
+                    return
+        if depth >= EXTRACT_MAX_DECODE_DEPTH or len(value) > EXTRACT_MAX_JSON_CHARS or not _looks_like_json(value):
+            return
+        try:
+            decoded = json.loads(value)
+        except (TypeError, ValueError):
+            return
+        self.walk(decoded, hint, depth + 1)
 
-    walk(content)
-    return candidates
 
+def extract_from_tool_message(message: Any) -> Tuple[List[str], List[dict]]:
+    """
+    Collect data:image URLs and chart-ready tables from a ToolMessage in one pass.
 
-def extract_tables_from_tool_message(message: Any) -> List[dict]:
-    """Skip tabular extraction for view-image tools — metadata shapes confuse auto-charts."""
+    Content and artifact (structured content) are walked together, so a result
+    present in both yields one table. Tables are skipped for view-image tools -
+    metadata shapes confuse auto-charts - and base64 scanning is skipped for
+    every other tool.
+    """
+    start = time.perf_counter()
     tool_name = getattr(message, "name", None) or ""
-    if isinstance(tool_name, str):
-        tl = tool_name.lower().replace("_", "-")
-        if "view-image" in tl or tl.endswith("get-view-image"):
-            return []
-    tables: List[dict] = []
-    for table in _extract_tables_from_any(getattr(message, "content", None)):
-        tables.append(table)
-    for table in _extract_tables_from_any(getattr(message, "artifact", None)):
-        tables.append(table)
-    # Keep payload modest for SSE
-    return tables[:4]
+    image_tool = _is_image_tool(tool_name)
+    extractor = _ToolOutputExtractor(scan_base64=image_tool, collect_tables=not image_tool)
+    extractor.walk(getattr(message, "content", None))
+    extractor.walk(getattr(message, "artifact", None))
+    metrics.EXTRACTION_SECONDS.observe(time.perf_counter() - start, tool=tool_name or "unknown")
+    if extractor.truncated:
+        logger.info(
+            f"Stopped scanning '{getattr(message, 'name', None)}' result after {EXTRACT_MAX_NODES} nodes"
+        )
+    return extractor.images, extractor.tables
 
 
 def stringify_ai_content(content, include_reasoning: bool = False) -> str:
@@ -219,18 +227,81 @@ def stringify_ai_content(content, include_reasoning: bool = False) -> str:
     return str(content)
 
 
-async def repair_incomplete_tool_calls(agent, thread_id, logger):
+def _tool_call_fields(tool_call) -> tuple:
+    if isinstance(tool_call, dict):
+        return tool_call.get("id"), tool_call.get("name") or "unknown", tool_call.get("args") or {}
+    return getattr(tool_call, "id", None), getattr(tool_call, "name", "unknown"), getattr(tool_call, "args", {}) or {}
+
+
+def _incomplete_tool_call_message(tool_name: str, reason: str | None) -> str:
+    return reason or (
+        f"Tool call to '{tool_name}' failed to complete. This may have been due to a network error, "
+        f"permission issue (403), or service unavailability. Please try again or use a different approach."
+    )
+
+
+class ToolCallTracker:
+    """
+    Tool calls from the current run that have no ToolMessage yet.
+
+    Kept up to date from the messages stream_agent_response sees, so checking
+    for (and answering) orphaned tool calls at the end of a run doesn't need to
+    load and rescan the whole thread.
+    """
+
+    def __init__(self):
+        self.pending: dict = {}
+
+    def observe(self, message: Any) -> None:
+        message_type = getattr(message, "type", None)
+        if message_type == "ai":
+            for tool_call in getattr(message, "tool_calls", None) or []:
+                tool_call_id, tool_name, _ = _tool_call_fields(tool_call)
+                if tool_call_id:
+                    self.pending[tool_call_id] = tool_name
+        elif message_type == "tool":
+            self.pending.pop(getattr(message, "tool_call_id", None), None)
+
+    async def repair(self, agent, thread_id, logger, reason: str | None = None) -> bool:
+        """Append error ToolMessages for the pending tool calls. Returns True if any were added."""
+        if not self.pending:
+            return False
+        pending, self.pending = self.pending, {}
+        from langchain_core.messages import ToolMessage
+
+        error_tool_messages = [
+            ToolMessage(
+                content=_incomplete_tool_call_message(tool_name, reason),
+                tool_call_id=tool_call_id,
+                name=tool_name
+            )
+            for tool_call_id, tool_name in pending.items()
+        ]
+        try:
+            # add_messages appends these; the rest of the thread isn't read or rewritten
+            await agent.aupdate_state({"configurable": {"thread_id": thread_id}}, {"messages": error_tool_messages})
+        except Exception as repair_error:
+            logger.warning(f"[{thread_id}] Error repairing incomplete tool calls: {str(repair_error)}")
+            return False
+        logger.info(f"[{thread_id}] Injected {len(error_tool_messages)} error ToolMessage(s) to repair state")
+        return True
+
+
+async def repair_incomplete_tool_calls(agent, thread_id, logger, reason: str | None = None):
     """
     Check agent state for incomplete tool calls and inject error ToolMessages.
     
     This ensures that any AIMessage with tool_calls that don't have corresponding
     ToolMessages get error responses, allowing the agent to continue gracefully.
+    Scans the whole thread; runs that went through stream_agent_response use
+    ToolCallTracker instead, and this is the fallback when its index can't be trusted.
+    ``reason`` replaces the generic failure text (e.g. when the user stopped the run).
     """
     try:
         from langchain_core.messages import ToolMessage, AIMessage
         
         config = {"configurable": {"thread_id": thread_id}}
-        state_snapshot = agent.get_state(config)
+        state_snapshot = await agent.aget_state(config)
         
         if not state_snapshot or not state_snapshot.values:
             return False
@@ -257,13 +328,13 @@ async def repair_incomplete_tool_calls(agent, thread_id, logger):
             logger.warning(f"[{thread_id}] Found {len(tool_calls_needing_responses)} incomplete tool call(s), injecting error responses")
             error_tool_messages = [
                 ToolMessage(
-                    content=f"Tool call to '{tool_name}' failed to complete. This may have been due to a network error, permission issue (403), or service unavailability. Please try again or use a different approach.",
+                    content=_incomplete_tool_call_message(tool_name, reason),
                     tool_call_id=tool_call_id,
                     name=tool_name
                 )
                 for tool_call_id, tool_name in tool_calls_needing_responses
             ]
-            agent.update_state(config, {"messages": list(messages) + error_tool_messages})
+            await agent.aupdate_state(config, {"messages": list(messages) + error_tool_messages})
             logger.info(f"[{thread_id}] Injected {len(error_tool_messages)} error ToolMessage(s) to repair state")
             return True
         
@@ -305,64 +376,145 @@ async def repair_incomplete_tool_calls(agent, thread_id, logger):
 #             return "I encountered a validation error while processing your request. Please try rephrasing your question or refresh your browser to start a new session."
 #         raise
 
-async def stream_agent_response(agent, messages, callback_handler, thread_id):
-    """Stream intermediate steps and final response from agent"""
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"[{thread_id}] Starting stream for thread")
+def _add_usage(totals: dict, message: Any) -> None:
+    """Accumulate an AI message's usage_metadata, splitting cached from uncached input tokens."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    details = usage.get("input_token_details") or {}
+    totals["model_calls"] += 1
+    totals["input_tokens"] += usage.get("input_tokens") or 0
+    totals["output_tokens"] += usage.get("output_tokens") or 0
+    totals["cache_read_tokens"] += details.get("cache_read") or 0
+    totals["cache_write_tokens"] += details.get("cache_creation") or 0
+    totals["uncached_input_tokens"] = (
+        totals["input_tokens"] - totals["cache_read_tokens"] - totals["cache_write_tokens"]
+    )
+
+
+async def stream_agent_response(agent, messages, callback_handler, thread_id, stream_tokens: bool = False, image_store=None, tool_calls: ToolCallTracker | None = None):
+    """
+    Stream intermediate steps and final response from agent.
+
+    Only each step's new messages are processed (LangGraph "updates"), so the
+    per-step cost doesn't grow with the length of the conversation.
+
+    Always emits ``step`` events (one per AI message) and a closing ``final`` event.
+    With ``stream_tokens=True`` it additionally emits ``token`` events as the model
+    generates, plus ``tool_start``/``tool_end`` events around each tool call.
+    With an ``image_store`` (BlobStore), view images are stored there and events
+    carry ``/images/<hash>`` URLs instead of inline data URLs.
+    ``tool_calls`` (ToolCallTracker) indexes unanswered tool calls as they stream,
+    so the caller can repair the thread after a cancel without rescanning it.
+    """
+    logger.info(f"[{thread_id}] Starting stream for thread (tokens={stream_tokens})")
     
     final_response = ""
     collected_images: List[str] = []
     collected_tables: List[dict] = []
+    image_keys: set = set()
+    table_keys: set = set()
     seen_message_ids = set()
-    initial_message_count = None
+    if tool_calls is None:
+        tool_calls = ToolCallTracker()
+    usage = {
+        "model_calls": 0,
+        "input_tokens": 0,
+        "uncached_input_tokens": 0,
+        "cache_read_tokens": 0,
+        "cache_write_tokens": 0,
+        "output_tokens": 0,
+    }
+
+    def process_message(message) -> List[dict]:
+        """Collect images/tables from a new message and build the events it produces."""
+        nonlocal final_response
+        events: List[dict] = []
+        message_id = getattr(message, 'id', None)
+
+        # Skip if we've already seen this message in this stream
+        if message_id and message_id in seen_message_ids:
+            return events
+        if message_id:
+            seen_message_ids.add(message_id)
+        tool_calls.observe(message)
+
+        if getattr(message, "type", None) == "tool":
+            images, tables = extract_from_tool_message(message)
+            for url in images:
+                if image_store is not None:
+                    digest = image_store.put_data_url(url)
+                    if digest:
+                        url = f"/images/{digest}"
+                if url not in image_keys:
+                    image_keys.add(url)
+                    collected_images.append(url)
+            for table in tables:
+                key = table_key(table)
+                if key not in table_keys:
+                    table_keys.add(key)
+                    collected_tables.append(table)
+            if stream_tokens:
+                events.append({
+                    "type": "tool_end",
+                    "name": getattr(message, "name", None) or "unknown",
+                    "tool_call_id": getattr(message, "tool_call_id", None),
+                    "status": getattr(message, "status", None) or "success",
+                    "is_final": False
+                })
+
+        # Stream AI thinking/reasoning
+        if hasattr(message, 'type') and message.type == 'ai':
+            _add_usage(usage, message)
+            if hasattr(message, 'content') and message.content:
+                step_text = stringify_ai_content(message.content, include_reasoning=True)
+                final_text = stringify_ai_content(message.content, include_reasoning=False)
+                if step_text:
+                    events.append({
+                        "type": "step",
+                        "content": step_text,
+                        "is_final": False
+                    })
+                if final_text:
+                    final_response = final_text
+            if stream_tokens:
+                for tool_call in getattr(message, "tool_calls", None) or []:
+                    tool_call_id, tool_name, tool_args = _tool_call_fields(tool_call)
+                    events.append({
+                        "type": "tool_start",
+                        "name": tool_name,
+                        "tool_call_id": tool_call_id,
+                        "args": tool_args,
+                        "is_final": False
+                    })
+        return events
+
+    # checks if callback handler is not None then add it to the config, otherwise add an empty list
+    config = {"configurable": {"thread_id": thread_id}, "callbacks": [callback_handler] if callback_handler else []}
     
     try:
-        async for chunk in agent.astream(
-            {"messages": messages}, 
-            # checks if callback handler is not None then add it to the config, otherwise add an empty list
-            config={"configurable": {"thread_id": thread_id}, "callbacks": [callback_handler] if callback_handler else []},
-            stream_mode="values"
+        # "updates" yields each node's new messages (never the whole thread), which
+        # drive step/tool events and extraction; with tokens on, "messages" also
+        # yields LLM token chunks as they arrive.
+        async for mode, payload in agent.astream(
+            {"messages": messages},
+            config=config,
+            stream_mode=["messages", "updates"] if stream_tokens else ["updates"]
         ):
-            if 'messages' in chunk and chunk['messages']:
-                # Capture initial message count on first chunk
-                if initial_message_count is None:
-                    initial_message_count = len(chunk['messages'])
-                
-                # Only process messages beyond the initial count (new messages)
-                new_messages = chunk['messages'][initial_message_count:]
-                
-                for message in new_messages:
-                    message_id = getattr(message, 'id', None)
-                    
-                    # Skip if we've already seen this message in this stream
-                    if message_id and message_id in seen_message_ids:
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") != "agent" or getattr(chunk, "type", None) != "AIMessageChunk":
+                    continue
+                token_text = stringify_ai_content(chunk.content, include_reasoning=True)
+                if token_text:
+                    yield {"type": "token", "content": token_text, "is_final": False}
+            elif mode == "updates" and isinstance(payload, dict):
+                for node_name, update in payload.items():
+                    if node_name not in ("agent", "tools") or not isinstance(update, dict):
                         continue
-                        
-                    if message_id:
-                        seen_message_ids.add(message_id)
-
-                    if getattr(message, "type", None) == "tool":
-                        for url in extract_images_from_tool_message(message):
-                            if url not in collected_images:
-                                collected_images.append(url)
-                        for table in extract_tables_from_tool_message(message):
-                            if table not in collected_tables:
-                                collected_tables.append(table)
-                    
-                    # Stream AI thinking/reasoning
-                    if hasattr(message, 'type') and message.type == 'ai':
-                        if hasattr(message, 'content') and message.content:
-                            step_text = stringify_ai_content(message.content, include_reasoning=True)
-                            final_text = stringify_ai_content(message.content, include_reasoning=False)
-                            if step_text:
-                                yield {
-                                    "type": "step",
-                                    "content": step_text,
-                                    "is_final": False
-                                }
-                            if final_text:
-                                final_response = final_text
+                    for message in update.get("messages") or []:
+                        for event in process_message(message):
+                            yield event
         
         # Send final response
         if not final_response:
@@ -381,14 +533,20 @@ async def stream_agent_response(agent, messages, callback_handler, thread_id):
             # Replace with a user-friendly message
             final_response = "I encountered an issue processing your request. I've recovered and can continue - please try asking your question again or rephrase it."
         
-        # Repair incomplete tool calls - check state for orphaned tool calls and inject error responses
-        await repair_incomplete_tool_calls(agent, thread_id, logger)
+        # Answer any tool calls from this run that never got a result
+        await tool_calls.repair(agent, thread_id, logger)
         
+        logger.info(
+            f"[{thread_id}] Token usage: {usage['model_calls']} model calls, input={usage['input_tokens']} "
+            f"(cached={usage['cache_read_tokens']}, cache_write={usage['cache_write_tokens']}, "
+            f"uncached={usage['uncached_input_tokens']}), output={usage['output_tokens']}"
+        )
         yield {
             "type": "final",
             "content": final_response,
             "images": collected_images,
             "tables": collected_tables,
+            "usage": usage,
             "is_final": True
         }
         logger.info(f"[{thread_id}] Stream completed, final response length: {len(final_response)}")
@@ -413,8 +571,11 @@ async def stream_agent_response(agent, messages, callback_handler, thread_id):
             "content": final_error_message,
             "images": collected_images,
             "tables": collected_tables,
+            "usage": usage,
             "is_final": True
         }
         
-        # Repair incomplete tool calls after error
-        await repair_incomplete_tool_calls(agent, thread_id, logger)
+        # Repair incomplete tool calls after error. Orphans left by an earlier turn
+        # (LangGraph refuses to run the thread) need the full scan.
+        if not await tool_calls.repair(agent, thread_id, logger) and "do not have a corresponding ToolMessage" in error_str:
+            await repair_incomplete_tool_calls(agent, thread_id, logger)
@@ -0,0 +1,866 @@
+"""
+Chat Model Wrappers
+
+Chat models that wrap the provider model from get_llm and add behavior around
+each call, while LangGraph, callbacks and token streaming see an ordinary
+BaseChatModel:
+
+- DelegatingChatModel: forwards generation, streaming, tool binding and token
+  counting to the wrapped model
+- RateLimitedChatModel: shared RPM/TPM budgets and retries with backoff
+- CachePointFilterChatModel: drops Bedrock cache points for models that reject them
+- RoutingChatModel: a small model plans tool calls, the large model answers
+- FailoverChatModel: fails over between providers and optionally hedges slow calls
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+
+from utilities import metrics
+from utilities.rate_limit import RateLimiter, backoff_delay, classify_error
+
+logger = logging.getLogger(__name__)
+
+
+def unwrap_chat_model(llm: Any) -> Any:
+    """The provider model at the bottom of a chain of DelegatingChatModels."""
+    while isinstance(llm, DelegatingChatModel):
+        llm = llm.inner
+    return llm
+
+
+class DelegatingChatModel(BaseChatModel):
+    """
+    Chat model that forwards everything to `inner`.
+
+    Subclasses override _agenerate/_astream to wrap the calls. bind_tools lets the
+    inner model format the tools for its provider and binds the result to the
+    wrapper, so every model call still goes through the wrapper.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+
+    def __init__(self, inner: BaseChatModel, **kwargs: Any):
+        # Streaming and output formatting behave like the wrapped model
+        kwargs.setdefault("disable_streaming", inner.disable_streaming)
+        kwargs.setdefault("output_version", inner.output_version)
+        super().__init__(inner=inner, **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any):
+        return self.inner._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def get_token_ids(self, text: str) -> List[int]:
+        return self.inner.get_token_ids(text)
+
+    def get_num_tokens_from_messages(self, messages: List[BaseMessage], tools=None) -> int:
+        return self.inner.get_num_tokens_from_messages(messages, tools=tools)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        return self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+def _usage_tokens(message: Any) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    return (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+
+
+def _observe_tokens(model: str, usage: Optional[dict]) -> None:
+    if usage:
+        metrics.LLM_CALL_TOKENS.observe(usage.get("input_tokens") or 0, model=model, type="input")
+        metrics.LLM_CALL_TOKENS.observe(usage.get("output_tokens") or 0, model=model, type="output")
+
+
+def _retryable(error: Exception, attempt: int, max_retries: int) -> str:
+    """Label for LLM_ERRORS: whether _retry_or_raise will retry this attempt."""
+    return "true" if classify_error(error)[0] and attempt < max_retries else "false"
+
+
+class RateLimitedChatModel(DelegatingChatModel):
+    """
+    Waits for the shared RPM/TPM budget before each call and retries throttled
+    or transient failures with jittered exponential backoff.
+
+    A throttling response with Retry-After pauses the whole limiter, so other
+    conversations back off too instead of adding to the storm. Streamed calls
+    are only retried before their first chunk.
+
+    Args:
+        inner: Provider chat model.
+        limiter: Shared RateLimiter (see utilities.rate_limit.get_rate_limiter).
+        max_retries: If None, reads LLM_MAX_RETRIES (default 3).
+        retry_base_seconds: If None, reads LLM_RETRY_BASE_SECONDS (default 1.0).
+        retry_max_seconds: If None, reads LLM_RETRY_MAX_SECONDS (default 30).
+    """
+
+    limiter: RateLimiter
+    max_retries: int = 3
+    retry_base_seconds: float = 1.0
+    retry_max_seconds: float = 30.0
+
+    def __init__(
+        self,
+        inner: BaseChatModel,
+        limiter: RateLimiter,
+        max_retries: Optional[int] = None,
+        retry_base_seconds: Optional[float] = None,
+        retry_max_seconds: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(
+            inner=inner,
+            limiter=limiter,
+            max_retries=max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "3")),
+            retry_base_seconds=(
+                retry_base_seconds if retry_base_seconds is not None
+                else float(os.getenv("LLM_RETRY_BASE_SECONDS", "1.0"))
+            ),
+            retry_max_seconds=(
+                retry_max_seconds if retry_max_seconds is not None
+                else float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+            ),
+            **kwargs,
+        )
+
+    @staticmethod
+    def estimate_tokens(messages: List[BaseMessage], **kwargs: Any) -> int:
+        """Approximate prompt size, including bound tool definitions."""
+        tokens = count_tokens_approximately(messages)
+        if kwargs.get("tools"):
+            tokens += len(json.dumps(kwargs["tools"], default=str)) // 4
+        return tokens
+
+    async def _retry_or_raise(self, error: Exception, attempt: int) -> None:
+        """Sleep before the next attempt, or re-raise if the error isn't retryable."""
+        retryable, throttled, retry_after = classify_error(error)
+        if throttled:
+            self.limiter.throttled += 1
+            if retry_after:
+                self.limiter.pause(retry_after)
+        if not retryable or attempt >= self.max_retries:
+            self.limiter.failures += 1
+            raise error
+        delay = backoff_delay(attempt, self.retry_base_seconds, self.retry_max_seconds, retry_after)
+        self.limiter.retries += 1
+        logger.warning(
+            f"[{self.limiter.name}] LLM call failed ({type(error).__name__}"
+            f"{', throttled' if throttled else ''}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        estimate = self.estimate_tokens(messages, **kwargs)
+        model = self.limiter.name
+        attempt = 0
+        while True:
+            metrics.LLM_RATE_LIMIT_WAIT_SECONDS.observe(await self.limiter.acquire(estimate), model=model)
+            start = time.monotonic()
+            try:
+                result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                self.limiter.settle(estimate, 0)
+                metrics.LLM_ERRORS.inc(model=model, retried=_retryable(e, attempt, self.max_retries))
+                await self._retry_or_raise(e, attempt)
+                attempt += 1
+                continue
+            metrics.LLM_CALL_SECONDS.observe(time.monotonic() - start, model=model, mode="invoke")
+            for generation in result.generations:
+                _observe_tokens(model, getattr(generation.message, "usage_metadata", None))
+            used = [_usage_tokens(g.message) for g in result.generations]
+            self.limiter.settle(estimate, sum(u for u in used if u) if any(used) else None)
+            return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        estimate = self.estimate_tokens(messages, **kwargs)
+        model = self.limiter.name
+        attempt = 0
+        while True:
+            metrics.LLM_RATE_LIMIT_WAIT_SECONDS.observe(await self.limiter.acquire(estimate), model=model)
+            start = time.monotonic()
+            used: Optional[int] = None
+            usage: Dict[str, int] = {}
+            yielded = False
+            try:
+                async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    tokens = _usage_tokens(chunk.message)
+                    if tokens:
+                        used = (used or 0) + tokens
+                        for key in ("input_tokens", "output_tokens"):
+                            usage[key] = usage.get(key, 0) + (chunk.message.usage_metadata.get(key) or 0)
+                    if not yielded:
+                        metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - start, model=model)
+                    yielded = True
+                    yield chunk
+            except Exception as e:
+                self.limiter.settle(estimate, used or 0)
+                if yielded:
+                    # Part of the answer was already streamed; a retry would repeat it
+                    self.limiter.failures += 1
+                    metrics.LLM_ERRORS.inc(model=model, retried="false")
+                    raise
+                metrics.LLM_ERRORS.inc(model=model, retried=_retryable(e, attempt, self.max_retries))
+                await self._retry_or_raise(e, attempt)
+                attempt += 1
+                continue
+            metrics.LLM_CALL_SECONDS.observe(time.monotonic() - start, model=model, mode="stream")
+            _observe_tokens(model, usage)
+            self.limiter.settle(estimate, used)
+            return
+
+
+def _is_cache_point(block: Any) -> bool:
+    return isinstance(block, dict) and "cachePoint" in block
+
+
+def strip_cache_points(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Messages without Bedrock cachePoint blocks. Only the leading system
+    messages are checked, since that is where get_system_prompt puts them.
+    """
+    stripped = list(messages)
+    for i, message in enumerate(stripped):
+        if not isinstance(message, SystemMessage):
+            break
+        if isinstance(message.content, list) and any(_is_cache_point(b) for b in message.content):
+            blocks = [b for b in message.content if not _is_cache_point(b)]
+            if all(isinstance(b, dict) and b.get("type") == "text" for b in blocks):
+                blocks = "".join(b["text"] for b in blocks)
+            stripped[i] = message.model_copy(update={"content": blocks})
+    return stripped
+
+
+class CachePointFilterChatModel(DelegatingChatModel):
+    """
+    Removes Bedrock cache points from the system prompt before calling `inner`.
+
+    The agent has one system message for every model it may call (large,
+    router planner, failover). get_system_prompt adds a cache point when any of
+    them can use it; the others are wrapped in this so they don't reject it.
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return self.inner._generate(strip_cache_points(messages), stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return await self.inner._agenerate(strip_cache_points(messages), stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        return self.inner._stream(strip_cache_points(messages), stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.inner._astream(strip_cache_points(messages), stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+_JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+    "null": type(None),
+}
+
+
+def schema_errors(value: Any, schema: Any, path: str = "args") -> List[str]:
+    """
+    Check a value against the subset of JSON Schema used by tool definitions:
+    type, enum, required, properties, additionalProperties: false, items and
+    anyOf/oneOf. Anything else ($ref, formats, ranges) is accepted as-is.
+    """
+    if not isinstance(schema, dict):
+        return []
+    alternatives = schema.get("anyOf") or schema.get("oneOf")
+    if alternatives:
+        if any(not schema_errors(value, option, path) for option in alternatives):
+            return []
+        return [f"{path}: matches none of the allowed shapes"]
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        allowed = tuple(_JSON_TYPES.get(name, object) for name in types)
+        # bool is an int subclass, but JSON Schema keeps them apart
+        if not isinstance(value, allowed) or (isinstance(value, bool) and "boolean" not in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+
+    errors: List[str] = []
+    if isinstance(value, dict):
+        properties = schema.get("properties") or {}
+        for key in schema.get("required") or []:
+            if key not in value:
+                errors.append(f"{path}.{key}: missing required field")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(schema_errors(item, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}.{key}: unexpected field")
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def _tool_schemas(tools: Any) -> Dict[str, dict]:
+    """Tool name -> parameter schema, from OpenAI or Bedrock formatted tool definitions."""
+    schemas = {}
+    for tool in tools or []:
+        if not isinstance(tool, dict):
+            continue
+        if isinstance(tool.get("function"), dict):
+            schemas[tool["function"].get("name")] = tool["function"].get("parameters") or {}
+        elif isinstance(tool.get("toolSpec"), dict):
+            spec = tool["toolSpec"]
+            schemas[spec.get("name")] = (spec.get("inputSchema") or {}).get("json") or {}
+        elif "name" in tool:
+            schemas[tool["name"]] = tool.get("input_schema") or tool.get("parameters") or {}
+    return schemas
+
+
+def tool_call_errors(message: AIMessage, tools: Any) -> List[str]:
+    """Problems with a message's tool calls: unparseable args, unknown tools, schema mismatches."""
+    errors = [f"{call.get('name')}: unparseable arguments" for call in message.invalid_tool_calls]
+    schemas = _tool_schemas(tools)
+    for call in message.tool_calls:
+        if schemas and call["name"] not in schemas:
+            errors.append(f"{call['name']}: unknown tool")
+        elif call["name"] in schemas:
+            errors.extend(f"{call['name']} {e}" for e in schema_errors(call["args"], schemas[call["name"]]))
+    return errors
+
+
+def _as_chunk(message: AIMessage) -> ChatGenerationChunk:
+    """Replay a complete AIMessage as a single stream chunk."""
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=message.content,
+        id=message.id,
+        tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+            for i, call in enumerate(message.tool_calls)
+        ],
+        usage_metadata=message.usage_metadata,
+        response_metadata=message.response_metadata,
+        additional_kwargs=message.additional_kwargs,
+    ))
+
+
+class RoutingChatModel(DelegatingChatModel):
+    """
+    Sends tool-planning steps to a small, fast model and the final answer to the
+    large model (`inner`).
+
+    Steps expected to call a tool go to the planner first: the step right after
+    a tool result, and the first step of a conversation that has no tool
+    results yet. The planner's reply is used when it calls tools with
+    arguments that match the tool schemas. When it answers instead, or its
+    tool calls are invalid, the step is re-run on the large model (an
+    escalation; counted in stats() with the planner time it wasted). Planner
+    replies are buffered, so only the reply that is kept reaches the client.
+
+    Other steps go straight to the large model and stream: the first step of a
+    later turn often answers from earlier results. Calls without tools (e.g.
+    history summaries) also go to the large model.
+
+    Args:
+        inner: Large model, used for final answers and fallbacks.
+        planner: Small model for tool-selection steps (same provider as inner,
+            since both receive the same bound tool definitions).
+        max_planner_steps: Planner steps allowed per user turn before the rest of
+            the turn goes to the large model. If None, reads
+            MODEL_ROUTER_MAX_PLANNER_STEPS (default 6).
+    """
+
+    planner: BaseChatModel
+    max_planner_steps: int = 6
+
+    _stats: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    def __init__(
+        self,
+        inner: BaseChatModel,
+        planner: BaseChatModel,
+        max_planner_steps: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(
+            inner=inner,
+            planner=planner,
+            max_planner_steps=(
+                max_planner_steps if max_planner_steps is not None
+                else int(os.getenv("MODEL_ROUTER_MAX_PLANNER_STEPS", "6"))
+            ),
+            **kwargs,
+        )
+        self._stats = {
+            "outcomes": {"planned": 0, "escalated_answer": 0, "escalated_invalid": 0, "escalated_error": 0, "large_only": 0},
+            "escalations": {"calls": 0, "seconds": 0.0},
+            "planner": {"calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0},
+            "large": {"calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0},
+        }
+
+    def _use_planner(self, messages: List[BaseMessage], kwargs: dict) -> bool:
+        if not kwargs.get("tools") or not messages:
+            return False
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        steps = sum(1 for m in messages[last_human + 1:] if isinstance(m, AIMessage))
+        if steps >= self.max_planner_steps:
+            return False
+        if isinstance(messages[-1], ToolMessage):
+            return True
+        # Nothing fetched yet, so the answer needs a tool call first
+        return not any(isinstance(m, ToolMessage) for m in messages)
+
+    def _escalate(self, outcome: str, elapsed: float) -> None:
+        self._stats["outcomes"][outcome] += 1
+        self._stats["escalations"]["calls"] += 1
+        self._stats["escalations"]["seconds"] += elapsed
+
+    def _record(self, model: str, started: float, usage: Optional[dict]) -> float:
+        elapsed = time.perf_counter() - started
+        entry = self._stats[model]
+        entry["calls"] += 1
+        entry["seconds"] += elapsed
+        if usage:
+            entry["input_tokens"] += usage.get("input_tokens") or 0
+            entry["output_tokens"] += usage.get("output_tokens") or 0
+        return elapsed
+
+    async def _plan(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> Optional[AIMessage]:
+        """Ask the planner for this step. Returns its reply if it can be used, else None."""
+        started = time.perf_counter()
+        try:
+            result = await self.planner._agenerate(messages, stop=stop, **kwargs)
+        except Exception as e:
+            self._escalate("escalated_error", self._record("planner", started, None))
+            logger.warning(f"Router: planner failed ({type(e).__name__}: {e}), using the large model")
+            return None
+        message = result.generations[0].message
+        elapsed = self._record("planner", started, message.usage_metadata)
+        usage = message.usage_metadata or {}
+        tokens = f"{usage.get('input_tokens', '?')}/{usage.get('output_tokens', '?')} tokens"
+
+        if not message.tool_calls and not message.invalid_tool_calls:
+            self._escalate("escalated_answer", elapsed)
+            logger.info(f"Router: planner answered in {elapsed:.2f}s ({tokens}); final answer goes to the large model")
+            return None
+        errors = tool_call_errors(message, kwargs.get("tools"))
+        if errors:
+            self._escalate("escalated_invalid", elapsed)
+            logger.info(f"Router: planner tool call invalid ({'; '.join(errors[:3])}); using the large model")
+            return None
+        self._stats["outcomes"]["planned"] += 1
+        logger.info(
+            f"Router: planner step {', '.join(c['name'] for c in message.tool_calls)} "
+            f"in {elapsed:.2f}s ({tokens})"
+        )
+        return message
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self._use_planner(messages, kwargs):
+            planned = await self._plan(messages, stop, kwargs)
+            if planned is not None:
+                return ChatResult(generations=[ChatGeneration(message=planned)])
+        else:
+            self._stats["outcomes"]["large_only"] += 1
+        started = time.perf_counter()
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        elapsed = self._record("large", started, result.generations[0].message.usage_metadata)
+        logger.info(f"Router: large model step in {elapsed:.2f}s")
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self._use_planner(messages, kwargs):
+            planned = await self._plan(messages, stop, kwargs)
+            if planned is not None:
+                yield _as_chunk(planned)
+                return
+        else:
+            self._stats["outcomes"]["large_only"] += 1
+        started = time.perf_counter()
+        usage: Dict[str, int] = {}
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            for key, value in (getattr(chunk.message, "usage_metadata", None) or {}).items():
+                if key in ("input_tokens", "output_tokens"):
+                    usage[key] = usage.get(key, 0) + (value or 0)
+            yield chunk
+        elapsed = self._record("large", started, usage)
+        logger.info(f"Router: large model step in {elapsed:.2f}s")
+
+    def stats(self) -> dict:
+        per_model = {}
+        for model in ("planner", "large"):
+            entry = self._stats[model]
+            per_model[model] = {
+                **entry,
+                "seconds": round(entry["seconds"], 3),
+                "avg_seconds": round(entry["seconds"] / entry["calls"], 3) if entry["calls"] else 0.0,
+            }
+        return {
+            "planner_model": _model_name(self.planner),
+            "large_model": _model_name(self.inner),
+            "max_planner_steps": self.max_planner_steps,
+            "outcomes": dict(self._stats["outcomes"]),
+            # Planner calls thrown away and re-run on the large model
+            "escalations": self._stats["escalations"]["calls"],
+            "escalation_seconds": round(self._stats["escalations"]["seconds"], 3),
+            **per_model,
+        }
+
+
+def _model_name(llm: Any) -> str:
+    llm = unwrap_chat_model(llm)
+    return getattr(llm, "model_name", None) or getattr(llm, "model_id", None) or llm._llm_type
+
+
+def _percentile(samples: Any, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class _Member:
+    """Health and latency bookkeeping for one FailoverChatModel provider."""
+
+    def __init__(self, name: str, model: BaseChatModel):
+        self.name = name
+        self.model = model
+        self.down_until = 0.0
+        self.latencies: Dict[str, Deque[float]] = {"stream": deque(maxlen=200), "invoke": deque(maxlen=200)}
+        self.counts = {"calls": 0, "served": 0, "failures": 0, "timeouts": 0, "hedges": 0, "cancelled": 0}
+
+    def stats(self) -> dict:
+        stats = {"name": self.name, **self.counts, "down": self.down_until > time.monotonic()}
+        for mode, samples in self.latencies.items():
+            p50, p95 = _percentile(samples, 0.5), _percentile(samples, 0.95)
+            stats[f"{mode}_p50_seconds"] = round(p50, 3) if p50 is not None else None
+            stats[f"{mode}_p95_seconds"] = round(p95, 3) if p95 is not None else None
+        if hasattr(self.model, "stats"):
+            stats["router"] = self.model.stats()
+        return stats
+
+
+class FailoverChatModel(DelegatingChatModel):
+    """
+    Sends each call to the first healthy provider and fails over to the next on
+    errors or timeouts. With hedging on, a call still running after the
+    primary's p95 latency gets a second request to the next provider, and the
+    first to respond wins; the other is cancelled.
+
+    Streamed calls are timed, hedged and failed over up to their first chunk.
+    After that the winning provider streams the rest. A provider that fails is
+    skipped for `cooldown_seconds`, unless every provider is down.
+
+    Tools are bound once per provider (OpenAI and Bedrock format them
+    differently). The primary's definitions travel as `tools` and the others as
+    `fallback_kwargs`.
+
+    Args:
+        inner: Primary model.
+        fallbacks: Models to fail over to, in order.
+        names: Labels for logs and stats, primary first (e.g. "openai:gpt-5").
+        timeout_seconds: If None, reads MODEL_FAILOVER_TIMEOUT_SECONDS (default 60).
+        cooldown_seconds: If None, reads MODEL_FAILOVER_COOLDOWN_SECONDS (default 30).
+        hedge: If None, reads MODEL_HEDGE_ENABLED (default false).
+        hedge_delay_seconds: Hedge delay until enough latencies are recorded. If None,
+            reads MODEL_HEDGE_DELAY_SECONDS (default 5).
+        hedge_min_samples: Latencies needed before the p95 is used. If None, reads
+            MODEL_HEDGE_MIN_SAMPLES (default 20).
+    """
+
+    fallbacks: List[BaseChatModel]
+    names: List[str]
+    timeout_seconds: float = 60.0
+    cooldown_seconds: float = 30.0
+    hedge: bool = False
+    hedge_delay_seconds: float = 5.0
+    hedge_min_samples: int = 20
+
+    _members: List[_Member] = PrivateAttr(default_factory=list)
+
+    def __init__(
+        self,
+        inner: BaseChatModel,
+        fallbacks: List[BaseChatModel],
+        names: List[str],
+        timeout_seconds: Optional[float] = None,
+        cooldown_seconds: Optional[float] = None,
+        hedge: Optional[bool] = None,
+        hedge_delay_seconds: Optional[float] = None,
+        hedge_min_samples: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(
+            inner=inner,
+            fallbacks=fallbacks,
+            names=names,
+            timeout_seconds=(
+                timeout_seconds if timeout_seconds is not None
+                else float(os.getenv("MODEL_FAILOVER_TIMEOUT_SECONDS", "60"))
+            ),
+            cooldown_seconds=(
+                cooldown_seconds if cooldown_seconds is not None
+                else float(os.getenv("MODEL_FAILOVER_COOLDOWN_SECONDS", "30"))
+            ),
+            hedge=hedge if hedge is not None else os.getenv("MODEL_HEDGE_ENABLED", "false").lower() == "true",
+            hedge_delay_seconds=(
+                hedge_delay_seconds if hedge_delay_seconds is not None
+                else float(os.getenv("MODEL_HEDGE_DELAY_SECONDS", "5"))
+            ),
+            hedge_min_samples=(
+                hedge_min_samples if hedge_min_samples is not None
+                else int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20"))
+            ),
+            **kwargs,
+        )
+        self._members = [_Member(name, model) for name, model in zip(names, [inner, *fallbacks])]
+
+    def bind_tools(self, tools, **kwargs: Any):
+        bound = [getattr(m.model.bind_tools(tools, **kwargs), "kwargs", {}) for m in self._members]
+        return self.bind(**bound[0], fallback_kwargs=bound[1:])
+
+    def _order(self) -> List[Tuple[int, _Member]]:
+        """Healthy members first, in configured order; members in cooldown last."""
+        now = time.monotonic()
+        members = list(enumerate(self._members))
+        return [x for x in members if x[1].down_until <= now] + [x for x in members if x[1].down_until > now]
+
+    def _hedge_delay(self, member: _Member, mode: str) -> float:
+        samples = member.latencies[mode]
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_delay_seconds
+        return max(0.2, _percentile(samples, 0.95))
+
+    def _fail(self, member: _Member, error: Optional[BaseException]) -> None:
+        if error is None:
+            member.counts["timeouts"] += 1
+            logger.warning(f"Failover: {member.name} timed out after {self.timeout_seconds:.0f}s")
+        else:
+            member.counts["failures"] += 1
+            logger.warning(f"Failover: {member.name} failed ({type(error).__name__}: {error})")
+        member.down_until = time.monotonic() + self.cooldown_seconds
+
+    async def _race(self, mode: str, start) -> Tuple[_Member, Any, Any]:
+        """
+        Run `start(index, member)` on members until one succeeds.
+
+        `start` returns (awaitable, handle); the awaitable resolves to the call's
+        result (invoke) or first chunk (stream). Returns the winning member, its
+        result and its handle. Losers are cancelled and their handles closed.
+        """
+        queue = self._order()
+        pending: Dict[asyncio.Future, Tuple[_Member, Any, float]] = {}
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def launch(is_hedge: bool = False) -> None:
+            index, member = queue.pop(0)
+            awaitable, handle = start(index, member)
+            member.counts["calls"] += 1
+            if is_hedge:
+                member.counts["hedges"] += 1
+                logger.info(f"Failover: hedging with {member.name}")
+            pending[asyncio.ensure_future(awaitable)] = (member, handle, time.monotonic())
+
+        async def discard(task: asyncio.Future, handle: Any) -> None:
+            task.cancel()
+            await asyncio.wait([task])
+            if not task.cancelled():
+                task.exception()
+            if handle is not None:
+                await handle.aclose()
+
+        launch()
+        try:
+            while pending:
+                now = time.monotonic()
+                deadline = min(started + self.timeout_seconds for _, _, started in pending.values())
+                wait = deadline - now
+                if self.hedge and not hedged and queue and len(pending) == 1:
+                    member, _, started = next(iter(pending.values()))
+                    wait = min(wait, started + self._hedge_delay(member, mode) - now)
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, wait), return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    now = time.monotonic()
+                    for task, (member, handle, started) in list(pending.items()):
+                        if now >= started + self.timeout_seconds:
+                            del pending[task]
+                            self._fail(member, None)
+                            await discard(task, handle)
+                            last_error = asyncio.TimeoutError(f"{member.name} timed out")
+                    if queue and (not pending or (self.hedge and not hedged)):
+                        hedged = hedged or bool(pending)
+                        launch(is_hedge=bool(pending))
+                    continue
+
+                for task in done:
+                    member, handle, started = pending.pop(task)
+                    if task.cancelled() or task.exception() is not None:
+                        error = asyncio.CancelledError() if task.cancelled() else task.exception()
+                        # A stream that ends without a chunk isn't a provider failure
+                        if isinstance(error, StopAsyncIteration):
+                            return member, None, handle
+                        self._fail(member, error)
+                        last_error = error
+                        continue
+                    member.latencies[mode].append(time.monotonic() - started)
+                    member.counts["served"] += 1
+                    member.down_until = 0.0
+                    for other, (loser, loser_handle, _) in list(pending.items()):
+                        loser.counts["cancelled"] += 1
+                        del pending[other]
+                        await discard(other, loser_handle)
+                    if member is not self._members[0]:
+                        logger.info(f"Failover: served by {member.name}")
+                    return member, task.result(), handle
+
+                if not pending and queue:
+                    launch()
+            raise last_error or RuntimeError("No model provider available")
+        finally:
+            for task, (_, handle, _) in list(pending.items()):
+                await discard(task, handle)
+
+    def _kwargs_for(self, index: int, kwargs: dict, fallback_kwargs: Optional[list]) -> dict:
+        if index == 0 or fallback_kwargs is None:
+            return kwargs
+        # Swap the primary's tool definitions for this provider's
+        own = {k: v for k, v in kwargs.items() if k not in ("tools", "tool_choice", "parallel_tool_calls")}
+        return {**own, **fallback_kwargs[index - 1]}
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        fallback_kwargs = kwargs.pop("fallback_kwargs", None)
+
+        def start(index: int, member: _Member):
+            call_kwargs = self._kwargs_for(index, kwargs, fallback_kwargs)
+            return member.model._agenerate(messages, stop=stop, **call_kwargs), None
+
+        member, result, _ = await self._race("invoke", start)
+        for generation in result.generations:
+            generation.message.response_metadata["served_by"] = member.name
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        fallback_kwargs = kwargs.pop("fallback_kwargs", None)
+
+        def start(index: int, member: _Member):
+            call_kwargs = self._kwargs_for(index, kwargs, fallback_kwargs)
+            # No run_manager: racing providers must not both emit tokens; the
+            # base class reports the chunks this generator yields
+            stream = member.model._astream(messages, stop=stop, **call_kwargs)
+            return stream.__anext__(), stream
+
+        member, first, stream = await self._race("stream", start)
+        if first is None:
+            return
+        first.message.response_metadata["served_by"] = member.name
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    def stats(self) -> dict:
+        return {
+            "timeout_seconds": self.timeout_seconds,
+            "hedge": self.hedge,
+            "members": [m.stats() for m in self._members],
+        }
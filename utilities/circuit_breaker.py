@@ -0,0 +1,253 @@
+"""
+Tool Circuit Breakers
+
+Session wrapper that stops sending calls to Tableau while it is failing. Each
+MCP tool and each datasource has its own breaker:
+
+- closed: calls go through; consecutive transient failures (5xx, 429, timeouts,
+  connection errors) are counted, any answer from Tableau resets the count
+- open: after TOOL_BREAKER_FAILURES in a row, calls fail at once with a tool
+  error for TOOL_BREAKER_RESET_SECONDS
+- half-open: then one probe call is let through; success closes the breaker,
+  failure opens it again
+
+A datasource whose extract keeps timing out only trips its own breaker; other
+datasources keep working, and a down Tableau trips the per-tool breakers. The
+wrapper sits directly above the pool, so cached and coalesced calls are still
+served while a breaker is open and each MCP request counts once.
+
+Failures are classified with utilities.tool_wrapper; exceptions are re-raised
+as ToolCallError so ToolNode's error handler can word them for the model.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from mcp.types import CallToolResult, TextContent
+
+from utilities import metrics
+from utilities.tool_wrapper import (
+    CIRCUIT_OPEN,
+    TIMEOUT,
+    TRANSIENT_KINDS,
+    UNKNOWN,
+    ToolCallError,
+    classify_tool_error,
+    classify_tool_result,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one tool or datasource."""
+
+    def __init__(self, key: str, failure_threshold: int, reset_seconds: float):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self._state = HALF_OPEN
+        return self._state
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """True if a call may go through now (in half-open state, only one probe at a time)."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self) -> None:
+        if self._state != CLOSED:
+            logger.info(f"Circuit breaker {self.key} closed")
+        self._state = CLOSED
+        self._probing = False
+        self.consecutive_failures = 0
+
+    def failure(self, kind: str) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = kind
+        if self._state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self.opens += 1
+                logger.warning(
+                    f"Circuit breaker {self.key} opened after {self.consecutive_failures} "
+                    f"consecutive failures ({kind}); failing fast for {self.reset_seconds:g}s"
+                )
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self) -> None:
+        """A call ended without an outcome (e.g. cancelled); free the probe slot."""
+        self._probing = False
+
+    def stats(self) -> dict:
+        state = self.state
+        return {
+            "state": state,
+            "consecutive_failures": self.consecutive_failures,
+            "failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "retry_in_seconds": round(self.retry_in(), 1) if state == OPEN else 0.0,
+        }
+
+
+class CircuitBreakerSession:
+    """
+    Session wrapper with a circuit breaker per MCP tool and per datasource.
+
+    Breakers are created on a key's first transient failure, so only tools and
+    datasources that have failed are tracked.
+
+    Args:
+        inner: Session-like object (e.g. MCPSessionPool) that performs the calls.
+        failure_threshold: If None, reads TOOL_BREAKER_FAILURES (default 5).
+        reset_seconds: How long a breaker stays open before a probe. If None,
+            reads TOOL_BREAKER_RESET_SECONDS (default 30).
+        enabled: If None, reads TOOL_BREAKER_ENABLED (default true). Errors are
+            classified either way.
+    """
+
+    def __init__(
+        self,
+        inner,
+        failure_threshold: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.inner = inner
+        self.failure_threshold = (
+            failure_threshold if failure_threshold is not None
+            else int(os.getenv("TOOL_BREAKER_FAILURES", "5"))
+        )
+        self.reset_seconds = (
+            reset_seconds if reset_seconds is not None
+            else float(os.getenv("TOOL_BREAKER_RESET_SECONDS", "30"))
+        )
+        self.enabled = enabled if enabled is not None else os.getenv("TOOL_BREAKER_ENABLED", "true").lower() == "true"
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.errors: Dict[str, int] = {}
+
+    @staticmethod
+    def keys(name: str, arguments: Optional[dict]) -> List[str]:
+        keys = [f"tool:{name}"]
+        luid = (arguments or {}).get("datasourceLuid")
+        if isinstance(luid, str) and luid:
+            keys.append(f"datasource:{luid}")
+        return keys
+
+    def _open_result(self, name: str, breaker: CircuitBreaker) -> CallToolResult:
+        self.errors[CIRCUIT_OPEN] = self.errors.get(CIRCUIT_OPEN, 0) + 1
+        metrics.MCP_ERRORS.inc(tool=name, kind=CIRCUIT_OPEN)
+        what = f"'{name}'" if breaker.key.startswith("tool:") else "this datasource"
+        text = (
+            f"Tableau has been failing for {what} ({breaker.last_error}, "
+            f"{breaker.consecutive_failures} times in a row), so this call was skipped. "
+            f"It will be retried in about {max(1, round(breaker.retry_in()))}s; meanwhile, answer "
+            f"from the results you already have or tell the user Tableau is having problems."
+        )
+        logger.info(f"Circuit breaker {breaker.key} rejected a call to '{name}'")
+        return CallToolResult(content=[TextContent(type="text", text=text)], isError=True)
+
+    def _record(self, keys: List[str], kind: Optional[str]) -> None:
+        """Record a call outcome: None for success, else the error kind."""
+        if kind is not None:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+        for key in keys:
+            breaker = self.breakers.get(key)
+            if kind in TRANSIENT_KINDS:
+                if breaker is None:
+                    breaker = self.breakers[key] = CircuitBreaker(key, self.failure_threshold, self.reset_seconds)
+                breaker.failure(kind)
+            elif breaker is not None:
+                # Tableau answered (even if the request was wrong); an unexplained failure says nothing
+                if kind == UNKNOWN:
+                    breaker.abandon()
+                else:
+                    breaker.success()
+
+    def record_timeout(self, name: str, arguments: Optional[dict]) -> None:
+        """Count a call abandoned at its deadline (see ToolExecutor) as a failure."""
+        metrics.MCP_ERRORS.inc(tool=name, kind=TIMEOUT)
+        self._record(self.keys(name, arguments), TIMEOUT)
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs: Any):
+        keys = self.keys(name, arguments)
+        admitted: List[CircuitBreaker] = []
+        if self.enabled:
+            for key in keys:
+                breaker = self.breakers.get(key)
+                if breaker is None:
+                    continue
+                if not breaker.allow():
+                    for other in admitted:
+                        other.abandon()
+                    return self._open_result(name, breaker)
+                admitted.append(breaker)
+        start = time.monotonic()
+        try:
+            result = await self.inner.call_tool(name, arguments, **kwargs)
+        except asyncio.CancelledError:
+            for breaker in admitted:
+                breaker.abandon()
+            raise
+        except Exception as e:
+            metrics.MCP_CALL_SECONDS.observe(time.monotonic() - start, tool=name)
+            kind, status = classify_tool_error(e)
+            metrics.MCP_ERRORS.inc(tool=name, kind=kind)
+            self._record(keys, kind)
+            logger.warning(f"MCP call '{name}' failed ({kind}{f', {status}' if status is not None else ''}): {str(e)[:200]}")
+            raise ToolCallError(name, kind, status, str(e)) from e
+        metrics.MCP_CALL_SECONDS.observe(time.monotonic() - start, tool=name)
+        if getattr(result, "isError", False):
+            kind, status = classify_tool_result(result)
+            metrics.MCP_ERRORS.inc(tool=name, kind=kind)
+            self._record(keys, kind)
+            if kind != UNKNOWN:
+                logger.info(f"MCP call '{name}' returned an error ({kind}, {status})")
+        else:
+            self._record(keys, None)
+        return result
+
+    async def list_tools(self, *args: Any, **kwargs: Any):
+        return await self.inner.list_tools(*args, **kwargs)
+
+    def stats(self) -> dict:
+        breakers = {key: breaker.stats() for key, breaker in self.breakers.items()}
+        return {
+            "enabled": self.enabled,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "open": sorted(key for key, s in breakers.items() if s["state"] != CLOSED),
+            "errors": dict(self.errors),
+            "breakers": breakers,
+        }
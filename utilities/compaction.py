@@ -0,0 +1,225 @@
+"""
+Conversation State Compaction
+
+Tool results from earlier turns (view images, thousand-row query results) are
+re-sent to the LLM on every later turn. ToolResultCompactor runs as the agent's
+pre_model_hook and shrinks them once the turn that produced them is over:
+
+- image blocks and inline data URLs become short text placeholders
+- oversized results are cut down to TOOL_RESULT_TOKEN_BUDGET; query rows are
+  kept whole and the row count is reported
+
+Originals are kept in blob stores (images in the /images store, full results in
+the /tool-results store) so the UI can still fetch them. Compacted messages keep
+their ids, so the checkpointed thread shrinks as well as the prompt. Ids of
+messages already checked are remembered, so each tool result is scanned once
+rather than on every model call.
+"""
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from langchain_core.messages import HumanMessage, ToolMessage
+
+from utilities.chat import _DATA_URI_IMAGE_RE, _mcp_image_block_to_data_url
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio for English text and JSON
+CHARS_PER_TOKEN = 4
+
+# Message ids remembered as needing no compaction
+CHECKED_IDS_MAX = 100000
+
+IMAGE_PLACEHOLDER = "[view image shown to the user earlier; omitted from history]"
+
+
+def _image_block_url(block: Any) -> Optional[str]:
+    """Data URL of an image content block (MCP or LangChain shapes), if it is one."""
+    url = _mcp_image_block_to_data_url(block)
+    if url:
+        return url
+    if isinstance(block, dict):
+        if block.get("type") == "image_url":
+            image_url = block.get("image_url")
+            url = image_url.get("url") if isinstance(image_url, dict) else image_url
+            return url if isinstance(url, str) else ""
+        if block.get("type") == "image" and block.get("source_type") == "base64":
+            return f"data:{block.get('mime_type') or 'image/png'};base64,{block.get('data') or ''}"
+    return None
+
+
+class ToolResultCompactor:
+    """
+    pre_model_hook that compacts tool results from completed turns.
+
+    Args:
+        image_store: BlobStore for images removed from history (optional).
+        result_store: BlobStore for full copies of truncated results (optional).
+        token_budget: Max tokens kept per tool result. If None, reads
+            TOOL_RESULT_TOKEN_BUDGET (default 2000).
+        enabled: If None, reads STATE_COMPACTION_ENABLED (default true).
+    """
+
+    def __init__(
+        self,
+        image_store=None,
+        result_store=None,
+        token_budget: Optional[int] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.image_store = image_store
+        self.result_store = result_store
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "2000"))
+        self.enabled = enabled if enabled is not None else os.getenv("STATE_COMPACTION_ENABLED", "true").lower() == "true"
+        # Ids of tool messages that are small and image-free (or already compacted)
+        self._checked: "OrderedDict[str, None]" = OrderedDict()
+        self.compacted_messages = 0
+        self.images_removed = 0
+        self.chars_saved = 0
+
+    @property
+    def char_budget(self) -> int:
+        return self.token_budget * CHARS_PER_TOKEN
+
+    def __call__(self, state: dict) -> dict:
+        messages = state["messages"]
+        compacted = self.compact(messages)
+        if not compacted:
+            return {"llm_input_messages": messages}
+        replaced = {m.id: m for m in compacted}
+        return {
+            # Same ids, so add_messages replaces them in the checkpointed thread
+            "messages": compacted,
+            "llm_input_messages": [replaced.get(m.id, m) for m in messages],
+        }
+
+    def compact(self, messages: List[Any]) -> List[ToolMessage]:
+        """Compacted copies of tool messages that precede the latest human message."""
+        if not self.enabled:
+            return []
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        compacted = []
+        for message in messages[:last_human]:
+            if isinstance(message, ToolMessage) and message.id and message.id not in self._checked:
+                replacement = self.compact_message(message)
+                if replacement is not None:
+                    compacted.append(replacement)
+                else:
+                    self._checked[message.id] = None
+                    if len(self._checked) > CHECKED_IDS_MAX:
+                        self._checked.popitem(last=False)
+        if compacted:
+            logger.info(f"Compacted {len(compacted)} tool results (total saved: {self.chars_saved} chars)")
+        return compacted
+
+    def compact_message(self, message: ToolMessage) -> Optional[ToolMessage]:
+        """Return a smaller copy of the message, or None if it is already small and image-free."""
+        if message.response_metadata.get("compacted"):
+            return None
+        before = len(str(message.content))
+        content = self._strip_images(message.content)
+        text = content if isinstance(content, str) else None
+        if text is not None and len(text) > self.char_budget:
+            content = self._truncate(text)
+        elif isinstance(content, list):
+            size = sum(len(str(block)) for block in content)
+            if size > self.char_budget:
+                content = self._truncate(self._blocks_text(content))
+
+        if content == message.content and message.artifact is None:
+            return None
+        self.compacted_messages += 1
+        self.chars_saved += max(0, before - len(str(content)))
+        # The artifact only feeds UI extraction while streaming; it isn't needed afterwards
+        return message.model_copy(update={
+            "content": content,
+            "artifact": None,
+            "response_metadata": {**message.response_metadata, "compacted": True},
+        })
+
+    def _store_image(self, url: str) -> str:
+        self.images_removed += 1
+        if self.image_store is not None and url:
+            digest = self.image_store.put_data_url(url)
+            if digest:
+                return f"[view image shown to the user earlier; omitted from history: /images/{digest}]"
+        return IMAGE_PLACEHOLDER
+
+    def _strip_images(self, content: Any) -> Any:
+        if isinstance(content, str):
+            if "data:image/" not in content:
+                return content
+            return _DATA_URI_IMAGE_RE.sub(lambda m: self._store_image(m.group(0)), content)
+        if isinstance(content, list):
+            blocks = []
+            for block in content:
+                url = _image_block_url(block)
+                if url is not None:
+                    blocks.append({"type": "text", "text": self._store_image(url)})
+                elif isinstance(block, dict) and block.get("type") == "text":
+                    text = block.get("text") or ""
+                    stripped = self._strip_images(text)
+                    blocks.append(block if stripped == text else {**block, "text": stripped})
+                else:
+                    blocks.append(block)
+            return blocks
+        return content
+
+    @staticmethod
+    def _blocks_text(blocks: List[Any]) -> str:
+        parts = []
+        for block in blocks:
+            if isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text") or "")
+            elif isinstance(block, str):
+                parts.append(block)
+            else:
+                parts.append(json.dumps(block, default=str))
+        return "\n".join(parts)
+
+    def _truncate(self, text: str) -> str:
+        """Cut a result down to the budget, keeping whole rows for tabular JSON."""
+        reference = ""
+        if self.result_store is not None:
+            digest = self.result_store.put(text.encode("utf-8"), "application/json")
+            reference = f" Full result: /tool-results/{digest}"
+        try:
+            decoded = json.loads(text)
+        except (TypeError, ValueError):
+            decoded = None
+
+        container, rows = None, None
+        if isinstance(decoded, list):
+            rows = decoded
+        elif isinstance(decoded, dict):
+            for key in ("data", "rows", "results"):
+                if isinstance(decoded.get(key), list):
+                    container, rows = key, decoded[key]
+                    break
+
+        if rows is not None:
+            kept, size = [], 0
+            for row in rows:
+                size += len(json.dumps(row, default=str, separators=(",", ":"))) + 1
+                if size > self.char_budget:
+                    break
+                kept.append(row)
+            body = {**decoded, container: kept} if container else kept
+            note = f"[Showing {len(kept)} of {len(rows)} rows from an earlier result.{reference}]"
+            return f"{note}\n{json.dumps(body, default=str, separators=(',', ':'))}"
+
+        note = f"[Truncated an earlier result from {len(text)} characters.{reference}]"
+        return f"{note}\n{text[:self.char_budget]}"
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "token_budget": self.token_budget,
+            "compacted_messages": self.compacted_messages,
+            "images_removed": self.images_removed,
+            "chars_saved": self.chars_saved,
+        }
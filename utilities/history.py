@@ -0,0 +1,232 @@
+"""
+Conversation History Policy
+
+Bounds what the agent sends to the model on each call. Runs as the react
+agent's pre_model_hook (after ToolResultCompactor, if one is given) and builds
+`llm_input_messages` from the checkpointed thread without changing it:
+
+- keep the last HISTORY_MAX_TURNS user turns
+- then drop whole turns, oldest first, until HISTORY_TOKEN_BUDGET fits
+- optionally prepend a rolling summary of the dropped turns, refreshed by a
+  background task so summarization never delays a response
+
+Every call logs prompt tokens before and after windowing. Token counts are
+cached per message id, so a call only tokenizes messages it hasn't seen.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+from langchain_core.language_models.base import BaseLanguageModel
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately, get_buffer_string
+from langchain_core.runnables import RunnableConfig
+
+from utilities.chat import stringify_ai_content
+from utilities.chat_models import unwrap_chat_model
+from utilities.prompt import HISTORY_SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# Cap on transcript text sent to the summarizer per update
+SUMMARY_INPUT_CHARS = 40000
+
+# Per-message token counts kept (LRU)
+TOKEN_CACHE_SIZE = 50000
+
+
+def make_token_counter(llm) -> Callable[[List[Any]], int]:
+    """
+    Token counter for history budgets.
+
+    Uses the model's tokenizer when it runs locally (e.g. tiktoken for OpenAI).
+    Providers that count tokens remotely or fall back to a generic tokenizer get
+    an approximate count, which is cheap enough to run before every model call.
+    """
+    if llm is not None and type(unwrap_chat_model(llm)).get_token_ids is not BaseLanguageModel.get_token_ids:
+        def count(messages: List[Any]) -> int:
+            try:
+                return llm.get_num_tokens_from_messages(messages)
+            except Exception:
+                return count_tokens_approximately(messages)
+        return count
+    return count_tokens_approximately
+
+
+def _turn_starts(messages: List[Any]) -> List[int]:
+    return [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+
+
+class HistoryPolicy:
+    """
+    pre_model_hook that windows conversation history and keeps a rolling summary.
+
+    Args:
+        llm: Chat model used for summaries and, when possible, token counting.
+        compactor: Optional ToolResultCompactor applied first.
+        max_turns: If None, reads HISTORY_MAX_TURNS (default 10, 0 = unlimited).
+        token_budget: If None, reads HISTORY_TOKEN_BUDGET (default 24000, 0 = unlimited).
+        summarize: If None, reads HISTORY_SUMMARY_ENABLED (default false).
+        max_threads: Threads whose summaries are kept in memory. If None, reads
+            HISTORY_SUMMARY_MAX_THREADS (default 1000).
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        compactor=None,
+        max_turns: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        summarize: Optional[bool] = None,
+        max_threads: Optional[int] = None,
+    ):
+        self.llm = llm
+        self.compactor = compactor
+        self.max_turns = max_turns if max_turns is not None else int(os.getenv("HISTORY_MAX_TURNS", "10"))
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("HISTORY_TOKEN_BUDGET", "24000"))
+        self.summarize = (
+            summarize if summarize is not None
+            else os.getenv("HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+        ) and llm is not None
+        self.max_threads = max_threads if max_threads is not None else int(os.getenv("HISTORY_SUMMARY_MAX_THREADS", "1000"))
+        self.count_tokens = make_token_counter(llm)
+        # Tokens a counter adds once per request (e.g. reply priming), not per message
+        self._request_overhead = self.count_tokens([])
+        # (message id, compacted) -> tokens; compaction rewrites a message under the same id
+        self._token_cache: "OrderedDict[tuple, int]" = OrderedDict()
+
+        # thread_id -> {"upto": id of the last summarized message, "text": summary}
+        self._summaries: "OrderedDict[str, dict]" = OrderedDict()
+        self._pending: dict = {}
+        self.calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.summaries_written = 0
+
+    async def __call__(self, state: dict, config: RunnableConfig) -> dict:
+        thread_id = (config.get("configurable") or {}).get("thread_id", "unknown")
+        update: dict = {}
+        messages = state["messages"]
+        if self.compactor is not None:
+            update = self.compactor(state)
+            messages = update["llm_input_messages"]
+
+        start = self.window_start(messages)
+        window = messages[start:]
+        summary = self._summary_for(thread_id, messages[:start]) if start else None
+        if summary:
+            window = [SystemMessage(f"Summary of the earlier conversation:\n{summary}"), *window]
+        if start and self.summarize:
+            self._schedule_summary(thread_id, messages[:start])
+
+        before = self.tokens(messages)
+        after = self.tokens(window) if start else before
+        self.calls += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        logger.info(
+            f"[{thread_id}] Prompt history: {len(messages)} messages / {before} tokens -> "
+            f"{len(window)} messages / {after} tokens{' (with summary)' if summary else ''}"
+        )
+        return {**update, "llm_input_messages": window}
+
+    def _message_tokens(self, messages: List[Any]) -> int:
+        """Sum of per-message token counts, from the cache where possible."""
+        total = 0
+        for message in messages:
+            if message.id is None:
+                total += self.count_tokens([message]) - self._request_overhead
+                continue
+            key = (message.id, bool(message.response_metadata.get("compacted")))
+            tokens = self._token_cache.get(key)
+            if tokens is None:
+                tokens = self._token_cache[key] = self.count_tokens([message]) - self._request_overhead
+                if len(self._token_cache) > TOKEN_CACHE_SIZE:
+                    self._token_cache.popitem(last=False)
+            else:
+                self._token_cache.move_to_end(key)
+            total += tokens
+        return total
+
+    def tokens(self, messages: List[Any]) -> int:
+        """Prompt tokens of a message list."""
+        return self._message_tokens(messages) + self._request_overhead
+
+    def window_start(self, messages: List[Any]) -> int:
+        """Index of the first message to send. Always starts on a user turn and keeps the current one."""
+        starts = _turn_starts(messages)
+        if not starts:
+            return 0
+        candidates = starts[-self.max_turns:] if self.max_turns > 0 else starts
+        if self.token_budget <= 0:
+            return candidates[0]
+        # Add whole turns from newest to oldest while they fit
+        bounds = candidates + [len(messages)]
+        chosen, total = candidates[-1], 0
+        for i in range(len(candidates) - 1, -1, -1):
+            total += self._message_tokens(messages[bounds[i]:bounds[i + 1]])
+            if total > self.token_budget and i < len(candidates) - 1:
+                break
+            chosen = candidates[i]
+        return chosen
+
+    def _summary_for(self, thread_id: str, dropped: List[Any]) -> Optional[str]:
+        entry = self._summaries.get(thread_id)
+        if entry is None or entry["upto"] not in {m.id for m in dropped}:
+            return None
+        self._summaries.move_to_end(thread_id)
+        return entry["text"]
+
+    def _schedule_summary(self, thread_id: str, dropped: List[Any]) -> None:
+        entry = self._summaries.get(thread_id)
+        if entry is not None and entry["upto"] == dropped[-1].id:
+            return
+        if thread_id in self._pending:
+            return
+        # Fresh context: the summary call must not be attached to (or streamed with) the current run
+        task = asyncio.get_running_loop().create_task(
+            self._write_summary(thread_id, dropped), context=contextvars.Context()
+        )
+        self._pending[thread_id] = task
+        task.add_done_callback(lambda _: self._pending.pop(thread_id, None))
+
+    async def _write_summary(self, thread_id: str, dropped: List[Any]) -> None:
+        entry = self._summaries.get(thread_id)
+        previous, new_messages = "", dropped
+        ids = [m.id for m in dropped]
+        if entry is not None and entry["upto"] in ids:
+            previous = entry["text"]
+            new_messages = dropped[ids.index(entry["upto"]) + 1:]
+        transcript = get_buffer_string(new_messages, human_prefix="User", ai_prefix="Assistant")
+        if len(transcript) > SUMMARY_INPUT_CHARS:
+            transcript = transcript[-SUMMARY_INPUT_CHARS:]
+        try:
+            response = await self.llm.ainvoke([
+                SystemMessage(HISTORY_SUMMARY_PROMPT),
+                HumanMessage(f"Existing summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"),
+            ])
+        except Exception as e:
+            logger.warning(f"[{thread_id}] History summary failed: {e}")
+            return
+        self._summaries[thread_id] = {"upto": dropped[-1].id, "text": stringify_ai_content(response.content).strip()}
+        self._summaries.move_to_end(thread_id)
+        while len(self._summaries) > self.max_threads:
+            self._summaries.popitem(last=False)
+        self.summaries_written += 1
+        logger.info(f"[{thread_id}] History summary updated ({len(new_messages)} new messages)")
+
+    def stats(self) -> dict:
+        return {
+            "max_turns": self.max_turns,
+            "token_budget": self.token_budget,
+            "summarize": self.summarize,
+            "model_calls": self.calls,
+            "prompt_tokens_before": self.tokens_before,
+            "prompt_tokens_after": self.tokens_after,
+            "summaries": len(self._summaries),
+            "summaries_written": self.summaries_written,
+        }
@@ -1,23 +1,165 @@
+"""
+Logging Setup
+
+Log records never touch the disk on the event loop. setup_logging installs a
+queue pipeline:
+
+- callers put records on a bounded queue (LOG_QUEUE_SIZE); when it is full
+  the record is dropped and counted instead of blocking the request
+- a background thread (logging.handlers.QueueListener) writes them to
+  .logs/<filename> with size-based rotation (LOG_MAX_MB, LOG_BACKUP_COUNT)
+
+The agent trace (utilities/trace_log.py) uses the same pipeline for its own
+file. logging_stats() reports queue depth and drops for /debug/sessions.
+"""
+
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+
+LOG_DIR = ".logs"
+
+# Pipelines by file, so setup_logging can be called more than once
+_pipelines: Dict[str, "LogPipeline"] = {}
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when its queue is full.
+
+    Args:
+        maxsize: Queue capacity in records.
+        format_in_caller: Format the message before queueing (the stdlib
+            behavior; safe when args are mutable). If False, records are queued
+            as they are and formatted on the writer thread.
+    """
+
+    def __init__(self, maxsize: int, format_in_caller: bool = True):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.maxsize = maxsize
+        self.format_in_caller = format_in_caller
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if self.format_in_caller:
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.maxsize,
+            "queued": self.queued,
+            "dropped": self.dropped,
+        }
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The queue may be full; the writer thread is draining it, so wait
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """A bounded queue plus a writer thread appending to a rotating file."""
+
+    def __init__(
+        self,
+        path: str,
+        formatter: logging.Formatter,
+        queue_size: int,
+        max_bytes: int,
+        backup_count: int,
+        format_in_caller: bool = True,
+    ):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file_handler = RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+        self.file_handler.setFormatter(formatter)
+        self.handler = BoundedQueueHandler(queue_size, format_in_caller=format_in_caller)
+        # Only merges args (and traceback) into the message; the writer applies formatter
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.listener = _Listener(self.handler.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Write out what is queued and stop the writer thread."""
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            self.file_handler.close()
+
+    def stats(self) -> dict:
+        return {
+            "file": self.path,
+            "max_bytes": self.file_handler.maxBytes,
+            "backup_count": self.file_handler.backupCount,
+            **self.handler.stats(),
+        }
+
+
+def open_pipeline(
+    path: str,
+    formatter: logging.Formatter,
+    env_prefix: str = "LOG",
+    format_in_caller: bool = True,
+) -> LogPipeline:
+    """
+    Get or start the pipeline writing to path. Queue size, rotation size and
+    backups come from <env_prefix>_QUEUE_SIZE (default 10000), <env_prefix>_MAX_MB
+    (default 20) and <env_prefix>_BACKUP_COUNT (default 5).
+    """
+    pipeline = _pipelines.get(path)
+    if pipeline is None:
+        pipeline = _pipelines[path] = LogPipeline(
+            path,
+            formatter,
+            queue_size=int(os.getenv(f"{env_prefix}_QUEUE_SIZE", "10000")),
+            max_bytes=int(float(os.getenv(f"{env_prefix}_MAX_MB", "20")) * 1024 * 1024),
+            backup_count=int(os.getenv(f"{env_prefix}_BACKUP_COUNT", "5")),
+            format_in_caller=format_in_caller,
+        )
+    return pipeline
+
 
 def setup_logging(filename="app.log"):
     """Setup logging configuration and return logger"""
-    # Create logs directory if it doesn't exist
-    os.makedirs(".logs", exist_ok=True)
-    
-    # Configure logging to write to file only
+    pipeline = open_pipeline(
+        os.path.join(LOG_DIR, filename),
+        logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'),
+    )
+
+    # Configure logging to write to file only (through the queue)
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(f".logs/{filename}")
-        ]
+        handlers=[pipeline.handler]
     )
-    
+
     # Suppress MCP warnings
     logging.getLogger('mcp').setLevel(logging.ERROR)
     logging.getLogger('root').setLevel(logging.ERROR)
-    
+
     # Return logger for the calling module
-    return logging.getLogger(__name__)
\ No newline at end of file
+    return logging.getLogger(__name__)
+
+
+def logging_stats() -> dict:
+    """Queue depth, drops and rotation settings of each log file."""
+    return {path: pipeline.stats() for path, pipeline in _pipelines.items()}
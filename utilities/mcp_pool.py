@@ -0,0 +1,238 @@
+"""
+MCP Session Pool
+
+Keeps a fixed number of Streamable HTTP MCP client sessions open and checks one
+out per tool call, so concurrent conversations don't serialize on one stream.
+Sessions are health-checked on checkout and reconnected (with a fresh
+initialize()) when they drop.
+
+The pool quacks like a ClientSession for the calls langchain-mcp-adapters makes
+(list_tools / call_tool), so it can be handed straight to load_mcp_tools().
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledSession:
+    """
+    A single MCP connection.
+
+    The streamable HTTP client and ClientSession are anyio context managers that
+    must be entered and exited from the same task, so each connection lives in
+    its own background task and is torn down by signalling that task.
+    """
+
+    def __init__(self, url: str, index: int):
+        self.url = url
+        self.index = index
+        self.session: Optional[ClientSession] = None
+        self.last_used = 0.0
+        # Set when a call was interrupted (timeout/cancel) and the stream may be wedged
+        self.suspect = False
+        self._task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def connect(self, timeout: float) -> None:
+        await self.close()
+        ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._run(ready, self._closing), name=f"mcp-session-{self.index}")
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except BaseException:
+            await self.close()
+            raise
+        self.suspect = False
+
+    async def _run(self, ready: asyncio.Future, closing: asyncio.Event) -> None:
+        try:
+            async with streamablehttp_client(self.url) as (read, write, _get_session_id):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    self.last_used = time.monotonic()
+                    if not ready.done():
+                        ready.set_result(None)
+                    await closing.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"MCP session {self.index} dropped: {e}")
+        finally:
+            self.session = None
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if self._closing is not None:
+            self._closing.set()
+        if task is None:
+            return
+        try:
+            await asyncio.wait_for(task, 5)
+        except asyncio.TimeoutError:
+            task.cancel()
+        except asyncio.CancelledError:
+            # Shutdown itself was cancelled: stop the session task, then let the cancellation through
+            task.cancel()
+            raise
+        except Exception as e:
+            logger.debug(f"MCP session {self.index} close error: {e}")
+        finally:
+            self.session = None
+
+
+class MCPSessionPool:
+    """
+    Pool of MCP client sessions with per-call checkout.
+
+    Args:
+        url: Streamable HTTP endpoint of the Tableau MCP server.
+        size: Number of sessions. If None, reads MCP_POOL_SIZE (default 4).
+        healthcheck_interval: Idle seconds after which a session is pinged before
+            reuse. If None, reads MCP_POOL_HEALTHCHECK_SECONDS (default 30).
+        connect_timeout: Seconds allowed for connect + initialize(). If None,
+            reads MCP_POOL_CONNECT_TIMEOUT (default 15).
+        checkout_timeout: Seconds to wait for a free session. If None, reads
+            MCP_POOL_CHECKOUT_TIMEOUT (default 60).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: Optional[int] = None,
+        healthcheck_interval: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        checkout_timeout: Optional[float] = None,
+    ):
+        self.url = url
+        self.size = max(1, size or int(os.getenv("MCP_POOL_SIZE", "4")))
+        self.healthcheck_interval = (
+            healthcheck_interval if healthcheck_interval is not None
+            else float(os.getenv("MCP_POOL_HEALTHCHECK_SECONDS", "30"))
+        )
+        self.connect_timeout = connect_timeout or float(os.getenv("MCP_POOL_CONNECT_TIMEOUT", "15"))
+        self.checkout_timeout = checkout_timeout or float(os.getenv("MCP_POOL_CHECKOUT_TIMEOUT", "60"))
+
+        self._slots = [_PooledSession(url, i) for i in range(self.size)]
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._in_use = 0
+        self._waiting = 0
+        self._calls = 0
+        self._reconnects = 0
+        self._failed_health_checks = 0
+
+    async def __aenter__(self) -> "MCPSessionPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """Open all sessions. Fails only if none of them could connect."""
+        results = await asyncio.gather(
+            *(slot.connect(self.connect_timeout) for slot in self._slots),
+            return_exceptions=True,
+        )
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if len(errors) == len(self._slots):
+            raise errors[0]
+        if errors:
+            # Disconnected slots are retried lazily on checkout
+            logger.warning(f"MCP pool started with {len(self._slots) - len(errors)}/{self.size} sessions: {errors[0]}")
+        else:
+            logger.info(f"MCP pool started with {self.size} sessions")
+        for slot in self._slots:
+            self._idle.put_nowait(slot)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(slot.close() for slot in self._slots), return_exceptions=True)
+        logger.info("MCP pool closed")
+
+    async def _reconnect(self, slot: _PooledSession) -> None:
+        self._reconnects += 1
+        logger.info(f"Reconnecting MCP session {slot.index}")
+        await slot.connect(self.connect_timeout)
+
+    async def _ensure_healthy(self, slot: _PooledSession) -> None:
+        if not slot.connected:
+            await self._reconnect(slot)
+            return
+        if not slot.suspect and time.monotonic() - slot.last_used < self.healthcheck_interval:
+            return
+        try:
+            await asyncio.wait_for(slot.session.send_ping(), self.connect_timeout)
+            slot.suspect = False
+        except Exception as e:
+            self._failed_health_checks += 1
+            logger.warning(f"MCP session {slot.index} failed health check: {e}")
+            await self._reconnect(slot)
+
+    @asynccontextmanager
+    async def checkout(self):
+        """Borrow a healthy session for the duration of the block."""
+        self._waiting += 1
+        try:
+            slot = await asyncio.wait_for(self._idle.get(), self.checkout_timeout)
+        finally:
+            self._waiting -= 1
+        self._in_use += 1
+        try:
+            await self._ensure_healthy(slot)
+            yield slot
+        finally:
+            slot.last_used = time.monotonic()
+            self._in_use -= 1
+            self._idle.put_nowait(slot)
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs: Any):
+        """Run an MCP tool call on a pooled session, reconnecting once on transport failure."""
+        self._calls += 1
+        for attempt in (1, 2):
+            async with self.checkout() as slot:
+                try:
+                    return await slot.session.call_tool(name, arguments, **kwargs)
+                except McpError:
+                    # JSON-RPC error response (e.g. -32602) - the session itself is fine
+                    raise
+                except (asyncio.CancelledError, asyncio.TimeoutError):
+                    slot.suspect = True
+                    raise
+                except Exception as e:
+                    # Tableau MCP tools are read-only, so one retry on a fresh session is safe
+                    if attempt == 2:
+                        raise
+                    logger.warning(f"MCP call '{name}' failed on session {slot.index}, reconnecting: {e}")
+                    await self._reconnect(slot)
+
+    async def list_tools(self, *args: Any, **kwargs: Any):
+        async with self.checkout() as slot:
+            return await slot.session.list_tools(*args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "connected": sum(1 for slot in self._slots if slot.connected),
+            "idle": self._idle.qsize(),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "calls": self._calls,
+            "reconnects": self._reconnects,
+            "failed_health_checks": self._failed_health_checks,
+        }
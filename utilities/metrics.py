@@ -0,0 +1,242 @@
+"""
+Prometheus Metrics
+
+Counters, gauges and histograms rendered in the Prometheus text exposition
+format at /metrics, so a slow answer can be pinned on the LLM, Tableau or this
+process. No client library needed; recording is a dict lookup and a few adds.
+
+Recorded where the work happens:
+
+- /chat/stream (web_app.py): time to the first agent event, total run time
+- RateLimitedChatModel: per-call LLM latency, time to first token, tokens per
+  call, rate-limiter wait and errors, by model
+- CircuitBreakerSession: per MCP call latency and errors (by tool and kind)
+- extract_from_tool_message: image/table extraction time, by tool
+
+Gauges (sessions, runs, admission queue, tools in flight, open breakers, log
+queues) and the log drop count are read from the components' stats() when
+/metrics is scraped. Metrics are per worker process.
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 200000)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey, extra: str = "") -> str:
+        parts = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: object) -> None:
+        """Export a running total kept elsewhere (read at scrape time). It must never decrease."""
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (not cumulative)..., +Inf bucket], sum
+        self._series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(key, list(counts), total[0]) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The process's metrics, plus callbacks that refresh gauges at scrape time."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        """Run collect() before each render, e.g. to set gauges from stats()."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# /chat/stream
+STREAM_FIRST_EVENT_SECONDS = REGISTRY.histogram(
+    "tabby_stream_first_event_seconds",
+    "Time from receiving a /chat/stream request to its first agent event (queue wait included)",
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "tabby_run_seconds",
+    "Total /chat/stream run time by outcome (ok, error, aborted = stream closed before the run ended)",
+    ["outcome"],
+)
+
+# LLM calls (per attempt, rate-limiter wait excluded)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "tabby_llm_call_seconds", "LLM call latency by model", ["model", "mode"],
+)
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "tabby_llm_first_token_seconds", "Time to the first streamed chunk by model", ["model"],
+)
+LLM_CALL_TOKENS = REGISTRY.histogram(
+    "tabby_llm_call_tokens", "Tokens per LLM call by model and type (input, output)", ["model", "type"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "tabby_llm_rate_limit_wait_seconds", "Time spent waiting for the RPM/TPM budget by model", ["model"],
+)
+LLM_ERRORS = REGISTRY.counter(
+    "tabby_llm_errors_total", "Failed LLM call attempts by model and whether they were retried", ["model", "retried"],
+)
+
+# Tableau MCP calls (what reaches the pool; cache hits and coalesced calls excluded)
+MCP_CALL_SECONDS = REGISTRY.histogram(
+    "tabby_mcp_call_seconds", "MCP tool call latency by tool", ["tool"],
+)
+MCP_ERRORS = REGISTRY.counter(
+    "tabby_mcp_errors_total", "MCP tool call errors by tool and kind (see utilities/tool_wrapper.py)", ["tool", "kind"],
+)
+
+# Our own processing
+EXTRACTION_SECONDS = REGISTRY.histogram(
+    "tabby_extraction_seconds", "Image/table extraction time per tool result by tool", ["tool"],
+    buckets=FAST_BUCKETS,
+)
+
+# Set from stats() at scrape time (see web_app.py)
+SESSIONS = REGISTRY.gauge("tabby_sessions", "Conversations in the session store")
+RUNS_ACTIVE = REGISTRY.gauge("tabby_runs_active", "Agent runs in progress")
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge("tabby_admission_queue_depth", "Runs waiting for a run slot")
+TOOLS_IN_FLIGHT = REGISTRY.gauge("tabby_tools_in_flight", "Tool calls executing")
+MCP_POOL_IN_USE = REGISTRY.gauge("tabby_mcp_pool_in_use", "MCP sessions checked out")
+MCP_POOL_WAITING = REGISTRY.gauge("tabby_mcp_pool_waiting", "Calls waiting for an MCP session")
+CIRCUIT_BREAKERS_OPEN = REGISTRY.gauge("tabby_circuit_breakers_open", "Tool and datasource circuit breakers not closed")
+LOG_QUEUE_DEPTH = REGISTRY.gauge("tabby_log_queue_depth", "Records waiting for the log writer thread", ["file"])
+LOG_DROPPED = REGISTRY.counter("tabby_log_records_dropped_total", "Records dropped because the log queue was full", ["file"])
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -3,12 +3,27 @@ Model Provider Utility
 
 Handles initialization of different LLM providers (OpenAI, AWS Bedrock, etc.)
 Can be easily extended to support additional providers.
+
+Every model is wrapped in RateLimitedChatModel, so all conversations in the
+process share one RPM/TPM budget per model and throttled calls are retried with
+backoff. The provider SDKs' own retries are turned off to avoid retrying twice.
+
+With MODEL_ROUTER_SMALL_MODEL set, get_llm returns a RoutingChatModel: the small
+model picks tools and the configured model writes the final answer.
+
+With MODEL_FAILOVER_PROVIDER set, the configured provider is wrapped in a
+FailoverChatModel together with the failover provider, so calls move to the
+other provider on errors or timeouts (and can be hedged across both).
 """
 
 import os
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import SystemMessage
+
+from utilities.chat_models import CachePointFilterChatModel, FailoverChatModel, RateLimitedChatModel, RoutingChatModel
+from utilities.rate_limit import get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +31,8 @@ logger = logging.getLogger(__name__)
 def get_llm(
     provider: Optional[str] = None,
     model_name: Optional[str] = None,
-    temperature: Optional[float] = None
+    temperature: Optional[float] = None,
+    small_model_name: Optional[str] = None
 ) -> BaseChatModel:
     """
     Initialize and return an LLM based on the specified provider.
@@ -25,9 +41,12 @@ def get_llm(
         provider: Model provider name (e.g., "openai", "aws"). If None, reads from MODEL_PROVIDER env var.
         model_name: Model name/ID to use. If None, reads from MODEL_USED env var.
         temperature: Temperature setting. If None, reads from MODEL_TEMPERATURE env var.
+        small_model_name: Model for tool-planning steps (same provider). If None, reads
+            from MODEL_ROUTER_SMALL_MODEL env var; empty disables routing.
     
     Returns:
-        Initialized chat model instance
+        Initialized chat model instance, wrapped with rate limiting and retries
+        (and routing / failover, if configured)
         
     Raises:
         ValueError: If provider is not supported or required configuration is missing
@@ -40,16 +59,52 @@ def get_llm(
     provider = provider.lower()
     
     logger.info(f"Initializing LLM: provider={provider}, model={model_name}, temperature={temperature}")
-    
+    small_model_name = small_model_name if small_model_name is not None else os.getenv("MODEL_ROUTER_SMALL_MODEL", "")
+    llm = _get_routed_llm(provider, model_name, temperature, small_model_name)
+
+    failover_provider = os.getenv("MODEL_FAILOVER_PROVIDER", "").lower()
+    if failover_provider:
+        failover_model = os.getenv("MODEL_FAILOVER_MODEL")
+        if not failover_model:
+            raise ValueError("MODEL_FAILOVER_MODEL is required when MODEL_FAILOVER_PROVIDER is set")
+        logger.info(f"Model failover: {provider}:{model_name} -> {failover_provider}:{failover_model}")
+        fallback = _get_routed_llm(
+            failover_provider, failover_model, temperature, os.getenv("MODEL_FAILOVER_SMALL_MODEL", "")
+        )
+        return FailoverChatModel(
+            llm,
+            fallbacks=[fallback],
+            names=[f"{provider}:{model_name}", f"{failover_provider}:{failover_model}"]
+        )
+    return llm
+
+
+def _get_routed_llm(provider: str, model_name: str, temperature: float, small_model_name: str) -> BaseChatModel:
+    """One provider's model, with a small planner model in front if configured"""
+    llm = _get_rate_limited_llm(provider, model_name, temperature)
+    if small_model_name and small_model_name != model_name:
+        logger.info(f"Model routing: {small_model_name} plans tool calls, {model_name} writes answers")
+        planner = _get_rate_limited_llm(provider, small_model_name, temperature)
+        return RoutingChatModel(llm, planner=planner)
+    return llm
+
+
+def _get_rate_limited_llm(provider: str, model_name: str, temperature: float) -> BaseChatModel:
+    """Provider model wrapped with the process-wide rate limiter for that model"""
     if provider == "openai":
-        return _get_openai_llm(model_name, temperature)
+        llm = _get_openai_llm(model_name, temperature)
     elif provider == "aws":
-        return _get_aws_bedrock_llm(model_name, temperature)
+        llm = _get_aws_bedrock_llm(model_name, temperature)
     else:
         raise ValueError(
             f"Unsupported model provider: {provider}. "
             f"Supported providers: 'openai', 'aws'"
         )
+    llm = RateLimitedChatModel(llm, limiter=get_rate_limiter(f"{provider}:{model_name}"))
+    if _prompt_cache_enabled() and not _supports_cache_points(provider, model_name):
+        # The shared system prompt may carry a cache point for another configured model
+        llm = CachePointFilterChatModel(llm)
+    return llm
 
 
 def _get_openai_llm(model_name: str, temperature: float) -> BaseChatModel:
@@ -63,7 +118,14 @@ def _get_openai_llm(model_name: str, temperature: float) -> BaseChatModel:
         )
     
     logger.info(f"Initializing OpenAI model: {model_name}")
-    return ChatOpenAI(model=model_name, temperature=temperature)
+    kwargs = {}
+    if _prompt_cache_enabled():
+        # OpenAI caches prompt prefixes automatically; a stable cache key routes
+        # requests that share the system prompt + tools to the same cache
+        kwargs["extra_body"] = {"prompt_cache_key": os.getenv("PROMPT_CACHE_KEY", "tabby-agent")}
+    # stream_usage: report token usage (incl. cached tokens) on streamed responses too
+    # max_retries=0: RateLimitedChatModel retries with a budget shared across conversations
+    return ChatOpenAI(model=model_name, temperature=temperature, stream_usage=True, max_retries=0, **kwargs)
 
 
 def _get_aws_bedrock_llm(model_name: str, temperature: float) -> BaseChatModel:
@@ -73,6 +135,7 @@ def _get_aws_bedrock_llm(model_name: str, temperature: float) -> BaseChatModel:
     as it properly handles tool result message formatting and avoids the
     ValidationException error with tool_result.content.text.id.
     """
+    from botocore.config import Config
     from langchain_aws import ChatBedrockConverse
     
     region_name = os.getenv("AWS_REGION", "us-east-1")
@@ -85,6 +148,77 @@ def _get_aws_bedrock_llm(model_name: str, temperature: float) -> BaseChatModel:
     return ChatBedrockConverse(
         model_id=model_name,
         temperature=temperature,
-        region_name=region_name
+        region_name=region_name,
+        # Single attempt: RateLimitedChatModel retries with a budget shared across conversations
+        config=Config(retries={"max_attempts": 1, "mode": "standard"})
     )
 
+
+def _prompt_cache_enabled() -> bool:
+    return os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+
+def _bedrock_supports_cache_points(model_name: str) -> bool:
+    """Bedrock prompt caching is available for Anthropic Claude and Amazon Nova models."""
+    model_name = model_name.lower()
+    return "anthropic" in model_name or "nova" in model_name
+
+
+def _supports_cache_points(provider: str, model_name: str) -> bool:
+    return provider == "aws" and _bedrock_supports_cache_points(model_name)
+
+
+def _agent_models(provider: str, model_name: str) -> List[Tuple[str, str]]:
+    """(provider, model) of every model get_llm can send the agent prompt to."""
+    models = [(provider, model_name)]
+    small_model = os.getenv("MODEL_ROUTER_SMALL_MODEL", "")
+    if small_model:
+        models.append((provider, small_model))
+    failover_provider = os.getenv("MODEL_FAILOVER_PROVIDER", "").lower()
+    failover_model = os.getenv("MODEL_FAILOVER_MODEL")
+    if failover_provider and failover_model:
+        models.append((failover_provider, failover_model))
+        failover_small_model = os.getenv("MODEL_FAILOVER_SMALL_MODEL", "")
+        if failover_small_model:
+            models.append((failover_provider, failover_small_model))
+    return models
+
+
+def get_system_prompt(
+    prompt: str,
+    provider: Optional[str] = None,
+    model_name: Optional[str] = None
+) -> SystemMessage:
+    """
+    Build the agent system message so providers can cache it as a prompt prefix.
+
+    The system prompt is static and comes first in every request, right after the
+    tool definitions, so tools + system prompt form a prefix that is identical on
+    every ReAct step. For Bedrock this adds an explicit cache point after the
+    prompt; OpenAI caches identical prefixes automatically (see _get_openai_llm).
+    Set PROMPT_CACHE_ENABLED=false to send a plain system message.
+
+    The same message goes to every configured model (router planner and
+    failover models included). The cache point is added when any of them
+    supports it; get_llm strips it for the ones that don't.
+
+    Args:
+        prompt: System prompt text.
+        provider: Model provider name. If None, reads from MODEL_PROVIDER env var.
+        model_name: Model name/ID. If None, reads from MODEL_USED env var.
+
+    Returns:
+        SystemMessage for create_react_agent(prompt=...)
+    """
+    provider = (provider or os.getenv("MODEL_PROVIDER", "openai")).lower()
+    model_name = model_name or os.getenv("MODEL_USED", "gpt-5")
+
+    cacheable = [name for p, name in _agent_models(provider, model_name) if _supports_cache_points(p, name)]
+    if _prompt_cache_enabled() and cacheable:
+        from langchain_aws import ChatBedrockConverse
+        logger.info(f"Prompt caching: adding Bedrock cache point after the system prompt for {', '.join(cacheable)}")
+        return SystemMessage(content=[
+            {"type": "text", "text": prompt},
+            ChatBedrockConverse.create_cache_point(),
+        ])
+    return SystemMessage(content=prompt)
@@ -161,3 +161,14 @@ AGENT_SYSTEM_PROMPT = f"""
 """
 
 
+
+HISTORY_SUMMARY_PROMPT = """
+You maintain a running summary of an analytics conversation between a user and a Tableau data assistant.
+Update the existing summary with the new messages. Keep:
+- the user's goals and open questions
+- datasources used (names and LUIDs) and the fields, filters and aggregations that worked
+- key numbers and findings already reported to the user
+- errors or dead ends worth not repeating
+
+Drop pleasantries and raw tool output. Reply with the updated summary only, at most 250 words.
+"""
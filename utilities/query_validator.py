@@ -0,0 +1,391 @@
+"""
+query-datasource Validation
+
+Checks query-datasource arguments locally before they reach Tableau. Most of
+the agent's failed queries are the same handful of mistakes (QUANTITATIVE_DATE,
+topFilter, several filters on one field, AGG, misspelled field captions), and
+each costs an MCP round-trip, a -32602 error and another LLM turn.
+
+- Known mistakes with one correct reading are repaired in place
+- Field captions are checked against get-datasource-metadata results seen
+  earlier (cached or fresh); exact-case fixes are applied, otherwise the error
+  lists the closest captions
+- Anything else that is certain to fail comes back to the model as a tool error
+  at once, without a network call
+"""
+
+import copy
+import difflib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp.types import CallToolResult, TextContent
+
+from utilities.tool_cache import QUERY_TOOL
+
+logger = logging.getLogger(__name__)
+
+METADATA_TOOL = "get-datasource-metadata"
+
+FILTER_TYPES = {"SET", "DATE", "TOP", "QUANTITATIVE_NUMERICAL", "MATCH"}
+FILTER_TYPE_ALIASES = {
+    "QUANTITATIVE_DATE": "DATE",
+    "TOPFILTER": "TOP",
+    "TOP_N": "TOP",
+    "TOPN": "TOP",
+    "QUANTITATIVE": "QUANTITATIVE_NUMERICAL",
+    "CATEGORICAL": "SET",
+}
+FUNCTIONS = {
+    "SUM", "AVG", "MEDIAN", "COUNT", "COUNTD", "MIN", "MAX", "STDEV", "VAR", "COLLECT",
+    "YEAR", "QUARTER", "MONTH", "WEEK", "DAY", "TRUNC_YEAR", "TRUNC_QUARTER", "TRUNC_MONTH",
+    "TRUNC_WEEK", "TRUNC_DAY",
+}
+FUNCTION_ALIASES = {
+    "AVERAGE": "AVG",
+    "MEAN": "AVG",
+    "COUNT_DISTINCT": "COUNTD",
+    "DISTINCT_COUNT": "COUNTD",
+    "COUNTDISTINCT": "COUNTD",
+    "MINIMUM": "MIN",
+    "MAXIMUM": "MAX",
+}
+NUMERIC_TYPES = {"INTEGER", "REAL", "NUMBER", "FLOAT", "DOUBLE"}
+DATE_RANGE_TYPES = {"CURRENT", "LAST", "NEXT", "LASTN", "NEXTN", "TODATE"}
+PERIOD_TYPES = {"MINUTES", "HOURS", "DAYS", "WEEKS", "MONTHS", "QUARTERS", "YEARS"}
+
+
+def _error_result(text: str) -> CallToolResult:
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=True)
+
+
+def _parse_metadata(result: Any) -> Dict[str, str]:
+    """{fieldCaption: dataType} from a get-datasource-metadata result."""
+    fields: Dict[str, str] = {}
+    for block in getattr(result, "content", None) or []:
+        text = getattr(block, "text", None)
+        if not isinstance(text, str):
+            continue
+        try:
+            decoded = json.loads(text)
+        except (TypeError, ValueError):
+            continue
+        entries = []
+        if isinstance(decoded, dict):
+            for key in ("fields", "data"):
+                if isinstance(decoded.get(key), list):
+                    entries.extend(decoded[key])
+        elif isinstance(decoded, list):
+            entries = decoded
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            caption = entry.get("fieldCaption") or entry.get("name")
+            if isinstance(caption, str):
+                fields[caption] = str(entry.get("dataType") or "").upper()
+    return fields
+
+
+class QueryValidator:
+    """
+    Repairs and validates query-datasource arguments.
+
+    Args:
+        max_datasources: Datasources whose field lists are kept. If None, reads
+            QUERY_VALIDATION_MAX_DATASOURCES (default 256).
+    """
+
+    def __init__(self, max_datasources: Optional[int] = None):
+        self.max_datasources = (
+            max_datasources if max_datasources is not None
+            else int(os.getenv("QUERY_VALIDATION_MAX_DATASOURCES", "256"))
+        )
+        # luid -> {fieldCaption: dataType}, least recently used first
+        self._fields: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def observe_metadata(self, luid: Optional[str], result: Any) -> None:
+        if not isinstance(luid, str) or getattr(result, "isError", False):
+            return
+        fields = _parse_metadata(result)
+        if not fields:
+            return
+        self._fields[luid] = fields
+        self._fields.move_to_end(luid)
+        while len(self._fields) > self.max_datasources:
+            self._fields.popitem(last=False)
+
+    def known_fields(self, luid: Optional[str]) -> Optional[Dict[str, str]]:
+        fields = self._fields.get(luid) if isinstance(luid, str) else None
+        if fields is not None:
+            self._fields.move_to_end(luid)
+        return fields
+
+    def check(self, arguments: Optional[dict]) -> Tuple[dict, List[str], List[str]]:
+        """
+        Repair what can be repaired, then validate.
+
+        Returns:
+            (arguments to send, repairs applied, errors). Errors mean the query
+            would fail and should not be sent.
+        """
+        arguments = copy.deepcopy(arguments or {})
+        fixes: List[str] = []
+        errors: List[str] = []
+        query = arguments.get("query")
+        if not isinstance(query, dict):
+            return arguments, fixes, ["`query` must be an object with a `fields` list."]
+        fields_meta = self.known_fields(arguments.get("datasourceLuid"))
+
+        fields = query.get("fields")
+        if not isinstance(fields, list) or not fields:
+            errors.append("`query.fields` must be a non-empty list of field objects.")
+        else:
+            for i, field in enumerate(fields):
+                self._check_field(field, f"fields[{i}]", fields_meta, fixes, errors)
+
+        filters = query.get("filters")
+        if filters is not None:
+            if not isinstance(filters, list):
+                errors.append("`query.filters` must be a list.")
+            else:
+                query["filters"] = self._check_filters(filters, fields_meta, fixes, errors)
+        return arguments, fixes, errors
+
+    def _check_caption(self, field: dict, where: str, fields_meta: Optional[Dict[str, str]], fixes, errors) -> None:
+        caption = field.get("fieldCaption")
+        if not isinstance(caption, str) or not caption:
+            errors.append(f"{where}: `fieldCaption` is required (exact field name from the metadata).")
+            return
+        # A custom calculation defines a new caption
+        if fields_meta is None or caption in fields_meta or "calculation" in field:
+            return
+        same_case = [name for name in fields_meta if name.lower() == caption.lower()]
+        if len(same_case) == 1:
+            field["fieldCaption"] = same_case[0]
+            fixes.append(f"{where}: fieldCaption '{caption}' -> '{same_case[0]}'")
+            return
+        close = difflib.get_close_matches(caption, list(fields_meta), n=3, cutoff=0.6)
+        hint = f" Did you mean: {', '.join(repr(c) for c in close)}?" if close else ""
+        errors.append(f"{where}: field '{caption}' doesn't exist in this datasource.{hint}")
+
+    def _check_field(self, field: Any, where: str, fields_meta: Optional[Dict[str, str]], fixes, errors) -> None:
+        if not isinstance(field, dict):
+            errors.append(f"{where}: must be an object like {{\"fieldCaption\": \"Sales\", \"function\": \"SUM\"}}.")
+            return
+        calculation = field.get("calculation")
+        if isinstance(calculation, str) and calculation.strip().upper() in FUNCTIONS | set(FUNCTION_ALIASES) \
+                and "function" not in field:
+            field["function"] = field.pop("calculation")
+            fixes.append(f"{where}: `calculation` -> `function`")
+        self._check_caption(field, where, fields_meta, fixes, errors)
+
+        function = field.get("function")
+        if function is None:
+            return
+        if not isinstance(function, str):
+            errors.append(f"{where}: `function` must be a string such as SUM or AVG.")
+            return
+        name = FUNCTION_ALIASES.get(function.strip().upper(), function.strip().upper())
+        if name == "AGG":
+            data_type = (fields_meta or {}).get(field.get("fieldCaption"))
+            if data_type in NUMERIC_TYPES:
+                field["function"] = "SUM"
+                fixes.append(f"{where}: function AGG -> SUM")
+            elif data_type:
+                del field["function"]
+                fixes.append(f"{where}: dropped function AGG on dimension '{field.get('fieldCaption')}'")
+            else:
+                errors.append(f"{where}: function AGG isn't supported; use SUM, AVG, COUNT, MIN or MAX for measures, or no function for dimensions.")
+            return
+        if name not in FUNCTIONS:
+            errors.append(f"{where}: unknown function '{function}'. Use one of {', '.join(sorted(FUNCTIONS))}.")
+        elif name != function:
+            field["function"] = name
+            fixes.append(f"{where}: function '{function}' -> '{name}'")
+
+    def _check_filters(self, filters: List[Any], fields_meta: Optional[Dict[str, str]], fixes, errors) -> List[Any]:
+        checked: List[Any] = []
+        by_field: Dict[str, dict] = {}
+        for i, flt in enumerate(filters):
+            where = f"filters[{i}]"
+            if not isinstance(flt, dict):
+                errors.append(f"{where}: must be an object with `field` and `filterType`.")
+                continue
+            flt, known_type = self._normalize_filter(flt, where, fixes, errors)
+            field = flt.get("field")
+            if not isinstance(field, dict):
+                errors.append(f"{where}: `field` must be an object like {{\"fieldCaption\": \"Region\"}}.")
+                checked.append(flt)
+                continue
+            self._check_caption(field, f"{where}.field", fields_meta, fixes, errors)
+            if known_type:
+                self._check_filter_shape(flt, where, fields_meta, fixes, errors)
+
+            caption = field.get("fieldCaption")
+            previous = by_field.get(caption) if isinstance(caption, str) else None
+            if previous is None:
+                if isinstance(caption, str):
+                    by_field[caption] = flt
+                checked.append(flt)
+            elif previous.get("filterType") == flt.get("filterType") == "SET" and \
+                    bool(previous.get("exclude")) == bool(flt.get("exclude")):
+                values = previous.setdefault("values", [])
+                values.extend(v for v in flt.get("values") or [] if v not in values)
+                fixes.append(f"{where}: merged into the earlier SET filter on '{caption}'")
+            else:
+                errors.append(
+                    f"{where}: '{caption}' already has a filter. Tableau allows one filter per field; "
+                    f"combine them (e.g. one SET filter with all values)."
+                )
+        return checked
+
+    @staticmethod
+    def _normalize_filter(flt: dict, where: str, fixes, errors) -> Tuple[dict, bool]:
+        """Rewrite misnamed filter types. Returns the filter and False if its type was already reported."""
+        flt = dict(flt)
+        # {"topFilter": {...}} -> {"filterType": "TOP", ...}
+        if isinstance(flt.get("topFilter"), dict):
+            inner = flt.pop("topFilter")
+            flt = {**inner, **{k: v for k, v in flt.items() if k not in inner}, "filterType": "TOP"}
+            fixes.append(f"{where}: `topFilter` key -> filterType TOP")
+        filter_type = flt.get("filterType")
+        if isinstance(filter_type, str):
+            upper = filter_type.strip().upper()
+            name = FILTER_TYPE_ALIASES.get(upper, upper)
+            if name != filter_type:
+                if upper == "QUANTITATIVE_DATE" and not (flt.get("periodType") and flt.get("dateRangeType")):
+                    errors.append(
+                        f"{where}: QUANTITATIVE_DATE isn't supported. Use filterType DATE with periodType and "
+                        f"dateRangeType (e.g. YEARS / LASTN with rangeN), or a SET filter on YEAR of the date field."
+                    )
+                    return flt, False
+                flt["filterType"] = name
+                fixes.append(f"{where}: filterType '{filter_type}' -> '{name}'")
+        return flt, True
+
+    def _check_filter_shape(self, flt: dict, where: str, fields_meta, fixes, errors) -> None:
+        filter_type = flt.get("filterType")
+        if filter_type not in FILTER_TYPES:
+            errors.append(f"{where}: filterType must be one of {', '.join(sorted(FILTER_TYPES))}, not {filter_type!r}.")
+            return
+        if filter_type == "SET":
+            if not isinstance(flt.get("values"), list) or not flt["values"]:
+                errors.append(f"{where}: SET filters need a non-empty `values` list.")
+        elif filter_type == "DATE":
+            stray = [k for k in ("quantitativeFilterType", "minDate", "maxDate") if k in flt]
+            if stray and flt.get("periodType") and flt.get("dateRangeType"):
+                for key in stray:
+                    del flt[key]
+                fixes.append(f"{where}: dropped {', '.join(stray)} from DATE filter")
+            if flt.get("periodType") not in PERIOD_TYPES:
+                errors.append(f"{where}: DATE filters need periodType, one of {', '.join(sorted(PERIOD_TYPES))}.")
+            if flt.get("dateRangeType") not in DATE_RANGE_TYPES:
+                errors.append(f"{where}: DATE filters need dateRangeType, one of {', '.join(sorted(DATE_RANGE_TYPES))}.")
+            elif flt["dateRangeType"] in ("LASTN", "NEXTN") and not isinstance(flt.get("rangeN"), int):
+                errors.append(f"{where}: dateRangeType {flt['dateRangeType']} needs an integer `rangeN`.")
+        elif filter_type == "TOP":
+            if "topN" not in flt and isinstance(flt.get("howMany"), int):
+                flt["topN"] = flt.pop("howMany")
+                fixes.append(f"{where}: `howMany` -> `topN`")
+            if not isinstance(flt.get("topN"), int):
+                errors.append(f"{where}: TOP filters need an integer `topN`.")
+            order_by = flt.get("orderBy")
+            if not isinstance(order_by, dict):
+                errors.append(f"{where}: TOP filters need `orderBy`, e.g. {{\"fieldCaption\": \"Sales\", \"function\": \"SUM\"}}.")
+            else:
+                self._check_order_by(order_by, f"{where}.orderBy", fields_meta, fixes, errors)
+        elif filter_type == "QUANTITATIVE_NUMERICAL":
+            if flt.get("quantitativeFilterType") not in ("MIN", "MAX", "RANGE", "ONLY_NULL", "ONLY_NON_NULL"):
+                errors.append(f"{where}: QUANTITATIVE_NUMERICAL filters need quantitativeFilterType MIN, MAX, RANGE, ONLY_NULL or ONLY_NON_NULL.")
+
+    def _check_order_by(self, order_by: dict, where: str, fields_meta, fixes, errors) -> None:
+        caption = order_by.get("fieldCaption")
+        if not isinstance(caption, str):
+            errors.append(f"{where}: `fieldCaption` is required.")
+        elif fields_meta is not None and caption not in fields_meta:
+            same_case = [name for name in fields_meta if name.lower() == caption.lower()]
+            if len(same_case) == 1:
+                order_by["fieldCaption"] = same_case[0]
+                fixes.append(f"{where}: fieldCaption '{caption}' -> '{same_case[0]}'")
+            else:
+                errors.append(f"{where}: field '{caption}' doesn't exist in this datasource.")
+        function = order_by.get("function")
+        if isinstance(function, str) and function.strip().upper() == "AGG":
+            order_by["function"] = "SUM"
+            fixes.append(f"{where}: function AGG -> SUM")
+
+
+class ValidatingToolSession:
+    """
+    Session wrapper that validates query-datasource calls before they are sent.
+
+    Sits in front of CachingToolSession, so it also sees metadata results that
+    are served from the cache. Repaired queries are sent in their repaired form
+    (which also makes them share cache and single-flight keys with correct
+    ones); invalid queries return an error result straight away.
+
+    Args:
+        inner: Session-like object (e.g. CachingToolSession) that performs the calls.
+        validator: QueryValidator to use. Defaults to a new one.
+        enabled: If None, reads QUERY_VALIDATION_ENABLED (default true).
+    """
+
+    def __init__(self, inner, validator: Optional[QueryValidator] = None, enabled: Optional[bool] = None):
+        self.inner = inner
+        self.validator = validator or QueryValidator()
+        self.enabled = enabled if enabled is not None else os.getenv("QUERY_VALIDATION_ENABLED", "true").lower() == "true"
+        self.checked = 0
+        self.repaired = 0
+        self.rejected = 0
+
+    @property
+    def round_trips_saved(self) -> int:
+        """Tableau calls that would have failed: rejected here, or sent only after repair."""
+        return self.repaired + self.rejected
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs: Any):
+        if not self.enabled:
+            return await self.inner.call_tool(name, arguments, **kwargs)
+        if name == QUERY_TOOL:
+            self.checked += 1
+            arguments, fixes, errors = self.validator.check(arguments)
+            luid = arguments.get("datasourceLuid")
+            if errors:
+                self.rejected += 1
+                logger.info(
+                    f"Query validator rejected query on {luid}: {'; '.join(errors)} "
+                    f"({self.round_trips_saved} round-trips saved so far)"
+                )
+                return _error_result(
+                    "The query was not sent because it would fail:\n- " + "\n- ".join(errors)
+                    + "\nFix these and call query-datasource again."
+                )
+            if fixes:
+                self.repaired += 1
+                logger.info(
+                    f"Query validator repaired query on {luid}: {'; '.join(fixes)} "
+                    f"({self.round_trips_saved} round-trips saved so far)"
+                )
+        result = await self.inner.call_tool(name, arguments, **kwargs)
+        if name == METADATA_TOOL:
+            self.validator.observe_metadata((arguments or {}).get("datasourceLuid"), result)
+        return result
+
+    async def list_tools(self, *args: Any, **kwargs: Any):
+        return await self.inner.list_tools(*args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "checked": self.checked,
+            "repaired": self.repaired,
+            "rejected": self.rejected,
+            "round_trips_saved": self.round_trips_saved,
+            "datasources_known": len(self.validator),
+        }
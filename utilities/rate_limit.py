@@ -0,0 +1,233 @@
+"""
+LLM Rate Limiting
+
+Process-wide request and token budgets for LLM calls, plus the retry policy used
+when the provider throttles anyway:
+
+- TokenBucket: a refilling budget (requests or tokens per minute)
+- RateLimiter: RPM + TPM buckets shared by every conversation in the worker,
+  with a pause that honors Retry-After and queue-wait metrics
+- classify_error / backoff_delay: which provider errors are worth retrying, and
+  how long to wait (jittered exponential backoff)
+
+Budgets are per worker process; with several gunicorn workers, divide the
+account's limits by the worker count.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Provider error codes that mean "slow down" (Bedrock / botocore)
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+# Transient provider errors that are safe to retry
+TRANSIENT_CODES = {"ServiceUnavailableException", "InternalServerException", "ModelNotReadyException", "ModelTimeoutException"}
+# Connection-level errors raised by the OpenAI SDK, httpx and botocore
+TRANSIENT_ERROR_TYPES = {
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout",
+    "EndpointConnectionError", "ReadTimeoutError", "ConnectTimeoutError",
+}
+
+
+class TokenBucket:
+    """
+    Budget that refills continuously at `per_minute` units per minute.
+
+    Waiters are served in FIFO order. Debits after the fact (e.g. actual token
+    usage) may push the balance negative, which delays later callers.
+
+    Args:
+        per_minute: Refill rate; 0 disables the bucket.
+        burst: Bucket capacity. Defaults to one minute's worth.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.per_minute = per_minute
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Wait until `amount` units are available and take them."""
+        if not self.enabled:
+            return
+        # A request larger than the bucket would never fit; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) * 60 / self.per_minute)
+
+    def debit(self, amount: float) -> None:
+        """Adjust the balance by `amount` units without waiting (negative refunds)."""
+        if not self.enabled:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    Shared RPM/TPM budget for one model, with queue-wait metrics.
+
+    Args:
+        name: Label for logs and stats (e.g. "openai:gpt-5").
+        rpm: Requests per minute. If None, reads LLM_RATE_LIMIT_RPM (default 0 = unlimited).
+        tpm: Tokens per minute. If None, reads LLM_RATE_LIMIT_TPM (default 0 = unlimited).
+    """
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(rpm if rpm is not None else float(os.getenv("LLM_RATE_LIMIT_RPM", "0")))
+        self.tokens = TokenBucket(tpm if tpm is not None else float(os.getenv("LLM_RATE_LIMIT_TPM", "0")))
+        self._paused_until = 0.0
+        self.waiting = 0
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.tokens_used = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for `seconds` (e.g. the provider's Retry-After)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, estimated_tokens: int) -> float:
+        """Wait for a request slot and the estimated tokens. Returns seconds waited."""
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0:
+                    break
+                await asyncio.sleep(pause)
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        if waited >= 0.01:
+            self.delayed += 1
+            logger.info(f"[{self.name}] LLM call waited {waited:.2f}s for rate limit budget")
+        return waited
+
+    def settle(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        """Correct the token budget once the call reports its actual usage."""
+        if used_tokens is None:
+            return
+        self.tokens_used += used_tokens
+        self.tokens.debit(used_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "rpm": self.requests.per_minute,
+            "tpm": self.tokens.per_minute,
+            "waiting": self.waiting,
+            "calls": self.acquired,
+            "delayed_calls": self.delayed,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.acquired, 3) if self.acquired else 0.0,
+            "max_wait_seconds": round(self.wait_seconds_max, 3),
+            "tokens_used": self.tokens_used,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Process-wide limiter for a model, created on first use."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = RateLimiter(name)
+    return limiter
+
+
+def rate_limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+def _parse_retry_after(headers: Any) -> Optional[float]:
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: BaseException) -> Tuple[bool, bool, Optional[float]]:
+    """
+    Decide whether a failed LLM call should be retried.
+
+    Returns:
+        (retryable, throttled, retry_after_seconds)
+    """
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None)
+    code = None
+    headers = None
+    if isinstance(response, dict):
+        # botocore ClientError
+        code = (response.get("Error") or {}).get("Code")
+        metadata = response.get("ResponseMetadata") or {}
+        status = status or metadata.get("HTTPStatusCode")
+        headers = {k.lower(): v for k, v in (metadata.get("HTTPHeaders") or {}).items()}
+    elif response is not None:
+        # openai / httpx response
+        status = status or getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None)
+
+    throttled = status == 429 or code in THROTTLE_CODES
+    if throttled:
+        return True, True, _parse_retry_after(headers)
+    if code in TRANSIENT_CODES or (isinstance(status, int) and status >= 500):
+        return True, False, _parse_retry_after(headers)
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in TRANSIENT_ERROR_TYPES:
+        return True, False, None
+    return False, False, None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
@@ -0,0 +1,160 @@
+"""
+Run Control
+
+Keeps track of the agent run behind each streaming response so it can be
+stopped. The run is consumed by its own task; the response only relays its
+events. A run is cancelled when the client disconnects (polled while waiting
+for events) or when POST /chat/cancel names its thread_id, on this worker or,
+through the session backend, on another one. Cancelling the task
+cancels the in-flight LLM request and MCP tool calls, after which the caller's
+on_cancel hook repairs the checkpointed thread.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+_IDLE = object()
+
+
+class RunRegistry:
+    """
+    Active agent runs by thread_id, for the current worker process.
+
+    Args:
+        poll_interval: Seconds between client-disconnect checks while no event
+            is ready. If None, reads RUN_DISCONNECT_POLL_SECONDS (default 1.0).
+    """
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        self.poll_interval = (
+            poll_interval if poll_interval is not None
+            else float(os.getenv("RUN_DISCONNECT_POLL_SECONDS", "1.0"))
+        )
+        self._runs: Dict[str, asyncio.Task] = {}
+        self._cancel_reasons: Dict[str, str] = {}
+        # thread_id -> on_cancel task still repairing that thread
+        self._cleanups: Dict[str, asyncio.Task] = {}
+        self.cancelled = {"client": 0, "disconnect": 0}
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._runs
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def cancel(self, thread_id: str, reason: str = "client") -> bool:
+        """Cancel the run for a thread. Returns False if no run is active on this worker."""
+        task = self._runs.get(thread_id)
+        if task is None or task.done():
+            return False
+        self._cancel_reasons[thread_id] = reason
+        task.cancel()
+        return True
+
+    async def stream(
+        self,
+        thread_id: str,
+        events: AsyncIterator[dict],
+        is_disconnected: Callable[[], Awaitable[bool]],
+        on_cancel: Optional[Callable[[], Awaitable[None]]] = None,
+        cancel_requested: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Relay events from an agent run, cancelling it on disconnect or request.
+
+        Args:
+            thread_id: Conversation the run belongs to.
+            events: The run's event stream (e.g. stream_agent_response(...)).
+            is_disconnected: Returns True once the client has gone away.
+            on_cancel: Awaited after a cancelled run has stopped. Runs in its own
+                task, so it completes even when the response is torn down; the
+                next run on the thread waits for it.
+            cancel_requested: Returns True once another worker was asked to stop
+                this run. Polled like is_disconnected.
+        """
+        cleanup = self._cleanups.get(thread_id)
+        if cleanup is not None:
+            await asyncio.shield(cleanup)
+
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def produce() -> None:
+            try:
+                async for event in events:
+                    queue.put_nowait(event)
+            finally:
+                queue.put_nowait(_DONE)
+
+        task = asyncio.create_task(produce())
+        self._runs[thread_id] = task
+        task.add_done_callback(lambda t: self._finish(thread_id, t, on_cancel))
+        next_cancel_check = time.monotonic() + self.poll_interval
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    if not task.done() and await is_disconnected():
+                        logger.info(f"[{thread_id}] Client disconnected, cancelling agent run")
+                        self.cancel(thread_id, "disconnect")
+                        continue
+                    event = _IDLE
+                # Checked on a timer, since a streaming answer may never leave the queue idle
+                if cancel_requested is not None and not task.done() and time.monotonic() >= next_cancel_check:
+                    next_cancel_check = time.monotonic() + self.poll_interval
+                    if await cancel_requested():
+                        logger.info(f"[{thread_id}] Cancel requested through another worker")
+                        self.cancel(thread_id, "client")
+                if event is _IDLE:
+                    continue
+                if event is _DONE:
+                    break
+                yield event
+        finally:
+            # No awaits here: when the server tears down the response, the
+            # surrounding cancel scope would cancel them immediately
+            if not task.done():
+                self._cancel_reasons.setdefault(thread_id, "disconnect")
+                task.cancel()
+
+        await asyncio.wait([task])
+        if task.cancelled():
+            cleanup = self._cleanups.get(thread_id)
+            if cleanup is not None:
+                await asyncio.shield(cleanup)
+            yield {
+                "type": "final",
+                "content": "Stopped.",
+                "cancelled": True,
+                "is_final": True
+            }
+        elif task.exception() is not None:
+            raise task.exception()
+
+    def _finish(self, thread_id: str, task: asyncio.Task, on_cancel) -> None:
+        if self._runs.get(thread_id) is task:
+            del self._runs[thread_id]
+        reason = self._cancel_reasons.pop(thread_id, None)
+        if not task.cancelled() or reason is None:
+            return
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        logger.info(f"[{thread_id}] Agent run cancelled ({reason})")
+        if on_cancel is not None:
+            cleanup = asyncio.ensure_future(on_cancel())
+            self._cleanups[thread_id] = cleanup
+            cleanup.add_done_callback(lambda c: self._cleanup_done(thread_id, c))
+
+    def _cleanup_done(self, thread_id: str, cleanup: asyncio.Task) -> None:
+        if self._cleanups.get(thread_id) is cleanup:
+            del self._cleanups[thread_id]
+        if not cleanup.cancelled() and cleanup.exception() is not None:
+            logger.warning(f"[{thread_id}] Cleanup after cancel failed: {cleanup.exception()}")
+
+    def stats(self) -> dict:
+        return {"active_runs": len(self._runs), "cancelled": dict(self.cancelled)}
@@ -0,0 +1,211 @@
+"""
+Agent Run Scheduler
+
+Admission control in front of stream_agent_response. Each agent run can fan out
+into many LLM and Tableau calls, so runs are limited:
+
+- a global cap on concurrent runs (per worker process)
+- one active or queued run per thread_id (web_app also claims the thread in the
+  session backend, so this holds across workers)
+- a per-user cap on concurrent runs (see AdmissionController.user_key)
+
+Runs over the caps wait in a bounded FIFO queue and see their queue position
+over SSE; once the queue is full, new requests are rejected right away.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run can't be queued; carries the HTTP status to return."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Ticket:
+    """A run's place in the scheduler: queued until `admitted` is set."""
+
+    def __init__(self, thread_id: str, user_id: str):
+        self.thread_id = thread_id
+        self.user_id = user_id
+        self.created = time.monotonic()
+        self.admitted = asyncio.Event()
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Concurrency caps and a bounded wait queue for agent runs.
+
+    Args:
+        max_concurrent: If None, reads AGENT_MAX_CONCURRENT_RUNS (default 8).
+        max_per_user: If None, reads AGENT_MAX_RUNS_PER_USER (default 2, 0 = no limit).
+        max_queue: If None, reads AGENT_MAX_QUEUED_RUNS (default 32).
+        queue_timeout: Longest a run may wait. If None, reads
+            AGENT_QUEUE_TIMEOUT_SECONDS (default 120).
+        trusted_proxies: Addresses or CIDR ranges allowed to set X-User-Id. If
+            None, reads AGENT_TRUSTED_PROXIES (comma-separated, default none).
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_per_user: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        trusted_proxies: Optional[str] = None,
+    ):
+        self.max_concurrent = max_concurrent if max_concurrent is not None else int(os.getenv("AGENT_MAX_CONCURRENT_RUNS", "8"))
+        self.max_per_user = max_per_user if max_per_user is not None else int(os.getenv("AGENT_MAX_RUNS_PER_USER", "2"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("AGENT_MAX_QUEUED_RUNS", "32"))
+        self.queue_timeout = (
+            queue_timeout if queue_timeout is not None
+            else float(os.getenv("AGENT_QUEUE_TIMEOUT_SECONDS", "120"))
+        )
+        trusted_proxies = trusted_proxies if trusted_proxies is not None else os.getenv("AGENT_TRUSTED_PROXIES", "")
+        self.trusted_proxies = [
+            ipaddress.ip_network(entry.strip(), strict=False)
+            for entry in trusted_proxies.split(",") if entry.strip()
+        ]
+        self._queue: List[Ticket] = []
+        self._threads: Dict[str, Ticket] = {}
+        self._active_by_user: Dict[str, int] = {}
+        self.active = 0
+        self.admitted_total = 0
+        self.queued_total = 0
+        self.rejected = {"thread_busy": 0, "queue_full": 0, "timeout": 0}
+        self._wait_seconds_total = 0.0
+
+    def _trusted(self, client_host: Optional[str]) -> bool:
+        if not client_host or not self.trusted_proxies:
+            return False
+        try:
+            address = ipaddress.ip_address(client_host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def user_key(self, thread_id: str, client_host: Optional[str], header_user: Optional[str]) -> str:
+        """
+        Who a run counts against for the per-user cap.
+
+        X-User-Id is only believed from a trusted proxy (anyone else could send a
+        fresh value per request). Otherwise the conversation is the unit: keying
+        by IP would make everyone behind one proxy or NAT share a single budget.
+        """
+        if header_user and self._trusted(client_host):
+            return f"user:{header_user}"
+        return f"thread:{thread_id}"
+
+    def _eligible(self, ticket: Ticket) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        return self.max_per_user <= 0 or self._active_by_user.get(ticket.user_id, 0) < self.max_per_user
+
+    def _admit(self, ticket: Ticket) -> None:
+        self.active += 1
+        self._active_by_user[ticket.user_id] = self._active_by_user.get(ticket.user_id, 0) + 1
+        self.admitted_total += 1
+        self._wait_seconds_total += time.monotonic() - ticket.created
+        ticket.admitted.set()
+
+    def _dispatch(self) -> None:
+        """Admit queued runs in FIFO order, skipping users who are at their cap."""
+        for ticket in list(self._queue):
+            if self.active >= self.max_concurrent:
+                break
+            if self._eligible(ticket):
+                self._queue.remove(ticket)
+                self._admit(ticket)
+
+    def reserve(self, thread_id: str, user_id: str) -> Ticket:
+        """
+        Claim a run slot or a queue place for a thread. Fails fast.
+
+        Raises:
+            AdmissionRejected: 409 if the thread already has a run, 429 if the queue is full.
+        """
+        if thread_id in self._threads:
+            self.rejected["thread_busy"] += 1
+            raise AdmissionRejected(409, "A response is already running for this conversation")
+        ticket = Ticket(thread_id, user_id)
+        if not self._queue and self._eligible(ticket):
+            self._admit(ticket)
+        elif len(self._queue) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected(429, "Too many requests are waiting, please try again shortly")
+        else:
+            self._queue.append(ticket)
+            self.queued_total += 1
+            self._dispatch()
+        self._threads[thread_id] = ticket
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based queue position, or 0 once admitted."""
+        if ticket.admitted.is_set():
+            return 0
+        return self._queue.index(ticket) + 1 if ticket in self._queue else 0
+
+    async def wait(self, ticket: Ticket, interval: float = 1.0) -> AsyncIterator[int]:
+        """
+        Wait until the ticket is admitted, yielding its queue position whenever it changes.
+
+        Raises:
+            AdmissionRejected: 503 if the run waited longer than the queue timeout.
+        """
+        last_position = None
+        while not ticket.admitted.is_set():
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            if time.monotonic() - ticket.created > self.queue_timeout:
+                self.rejected["timeout"] += 1
+                self.release(ticket)
+                raise AdmissionRejected(503, "The assistant is busy, please try again shortly")
+            try:
+                await asyncio.wait_for(ticket.admitted.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, ticket: Ticket) -> None:
+        """Give back a run slot or queue place. Safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if self._threads.get(ticket.thread_id) is ticket:
+            del self._threads[ticket.thread_id]
+        if ticket.admitted.is_set():
+            self.active -= 1
+            remaining = self._active_by_user.get(ticket.user_id, 1) - 1
+            if remaining > 0:
+                self._active_by_user[ticket.user_id] = remaining
+            else:
+                self._active_by_user.pop(ticket.user_id, None)
+        elif ticket in self._queue:
+            self._queue.remove(ticket)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": len(self._queue),
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted_total,
+            "queued_total": self.queued_total,
+            "avg_wait_seconds": round(self._wait_seconds_total / self.admitted_total, 3) if self.admitted_total else 0.0,
+            "rejected": dict(self.rejected),
+        }
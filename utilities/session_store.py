@@ -0,0 +1,185 @@
+"""
+Session Store
+
+Tracks chat sessions (thread_ids) and keeps them bounded: idle sessions expire
+after a TTL, the number of sessions is capped with LRU eviction, and the
+checkpointer's footprint is held under a memory budget. Evicting a session also
+deletes its thread from the LangGraph checkpointer, which is where the real
+memory (message history, tool outputs, view images) lives.
+
+Session records live in a SessionBackend (see utilities/state_backend.py), so
+the same limits apply whether sessions are process-local or shared by workers.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from utilities.state_backend import RUN_IDLE, MemorySessionBackend, SessionBackend, measure_checkpoint_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Registry of chat sessions with idle TTL, LRU cap and memory budget.
+
+    Args:
+        checkpointer: LangGraph checkpointer whose threads are purged on eviction.
+        backend: Where session records are kept. Defaults to an in-process backend.
+        ttl_seconds: Idle time before a session expires. If None, reads
+            SESSION_TTL_SECONDS (default 7200).
+        max_sessions: Maximum number of sessions kept. If None, reads
+            SESSION_MAX_SESSIONS (default 500).
+        memory_budget_mb: Upper bound for checkpointer memory across all sessions.
+            If None, reads SESSION_MEMORY_BUDGET_MB (default 1024, 0 disables).
+        run_lease_seconds: How long a run's claim pins its session and blocks other
+            runs on the thread. Bounds the damage if a worker dies mid-run and
+            never releases it. If None, reads SESSION_RUN_LEASE_SECONDS (default 1800).
+    """
+
+    def __init__(
+        self,
+        checkpointer=None,
+        backend: Optional[SessionBackend] = None,
+        ttl_seconds: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+        memory_budget_mb: Optional[float] = None,
+        run_lease_seconds: Optional[float] = None,
+    ):
+        self.checkpointer = checkpointer
+        self.backend = backend or MemorySessionBackend()
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("SESSION_TTL_SECONDS", "7200"))
+        self.max_sessions = max_sessions if max_sessions is not None else int(os.getenv("SESSION_MAX_SESSIONS", "500"))
+        budget_mb = memory_budget_mb if memory_budget_mb is not None else float(os.getenv("SESSION_MEMORY_BUDGET_MB", "1024"))
+        self.memory_budget_bytes = int(budget_mb * 1024 * 1024)
+        self.run_lease_seconds = (
+            run_lease_seconds if run_lease_seconds is not None
+            else float(os.getenv("SESSION_RUN_LEASE_SECONDS", "1800"))
+        )
+
+        self._evictions = {"ttl": 0, "lru": 0, "memory": 0}
+        self._claims_rejected = 0
+        self._checkpoint_bytes = 0
+
+    async def _call(self, method, *args):
+        """Run a backend method, in a worker thread if the backend blocks (e.g. SQLite)."""
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def contains(self, thread_id: str) -> bool:
+        return await self._call(self.backend.contains, thread_id)
+
+    async def count(self) -> int:
+        return await self._call(self.backend.count)
+
+    async def ids(self) -> List[str]:
+        return await self._call(self.backend.ids)
+
+    async def create(self, thread_id: str) -> None:
+        await self._call(self.backend.create, thread_id, time.time())
+
+    async def claim_run(self, thread_id: str) -> bool:
+        """
+        Claim a thread for an agent run, across all workers sharing the backend.
+        The claim also pins the session so the sweeper can't evict it mid-run.
+        Returns False if another run holds the thread.
+        """
+        now = time.time()
+        claimed = await self._call(self.backend.claim_run, thread_id, now, now - self.run_lease_seconds)
+        if not claimed:
+            self._claims_rejected += 1
+        return claimed
+
+    async def release_run(self, thread_id: str) -> None:
+        await self._call(self.backend.release_run, thread_id, time.time())
+
+    async def request_cancel(self, thread_id: str) -> bool:
+        """Ask whichever worker runs the thread to cancel it. Returns False if no run holds it."""
+        return await self._call(self.backend.request_cancel, thread_id)
+
+    async def cancel_requested(self, thread_id: str) -> bool:
+        return await self._call(self.backend.cancel_requested, thread_id)
+
+    async def evict(self, thread_id: str, reason: str) -> None:
+        """Drop a session and purge its checkpointer thread."""
+        if not await self._call(self.backend.remove, thread_id):
+            return
+        self._evictions[reason] = self._evictions.get(reason, 0) + 1
+        if self.checkpointer is not None:
+            try:
+                await self.checkpointer.adelete_thread(thread_id)
+            except Exception as e:
+                logger.warning(f"[{thread_id}] Failed to purge checkpointer thread: {e}")
+        logger.info(f"[{thread_id}] Session evicted ({reason})")
+
+    async def sweep(self, measure: bool = True) -> None:
+        """
+        Enforce TTL, session cap and memory budget, oldest sessions first.
+
+        Session records are read once per sweep; evicted sessions are dropped
+        from that snapshot as the passes go.
+
+        Args:
+            measure: Re-measure checkpointer memory per thread. Skip for cheap
+                sweeps on hot paths (e.g. session creation).
+        """
+        now = time.time()
+        records = await self._call(self.backend.records)
+        remaining = len(records)
+        evictable = [
+            record for record in records
+            if record["active"] == RUN_IDLE or now - record["last_seen"] > self.run_lease_seconds
+        ]
+
+        if self.ttl_seconds > 0:
+            kept = []
+            for record in evictable:
+                if now - record["last_seen"] > self.ttl_seconds:
+                    await self.evict(record["thread_id"], "ttl")
+                    remaining -= 1
+                else:
+                    kept.append(record)
+            evictable = kept
+
+        if self.max_sessions > 0:
+            excess = max(0, remaining - self.max_sessions)
+            for record in evictable[:excess]:
+                await self.evict(record["thread_id"], "lru")
+            evictable = evictable[excess:]
+
+        if not measure or self.memory_budget_bytes <= 0 or self.checkpointer is None:
+            return
+        sizes = await measure_checkpoint_bytes(self.checkpointer)
+        self._checkpoint_bytes = sum(sizes.values())
+        for record in evictable:
+            if self._checkpoint_bytes <= self.memory_budget_bytes:
+                break
+            self._checkpoint_bytes -= sizes.get(record["thread_id"], 0)
+            await self.evict(record["thread_id"], "memory")
+
+    async def run_sweeper(self, interval: Optional[float] = None) -> None:
+        """Background loop that sweeps every SESSION_SWEEP_SECONDS (default 60)."""
+        interval = interval or float(os.getenv("SESSION_SWEEP_SECONDS", "60"))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Session sweep failed: {e}")
+
+    async def stats(self) -> dict:
+        sessions, active_runs = await self._call(self.backend.totals)
+        return {
+            "sessions": sessions,
+            "active_runs": active_runs,
+            "claims_rejected": self._claims_rejected,
+            "checkpoint_bytes": self._checkpoint_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "evictions": dict(self._evictions),
+        }
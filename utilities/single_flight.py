@@ -0,0 +1,111 @@
+"""
+Single-Flight Tool Calls
+
+Coalesces concurrent identical MCP tool calls. When many agents ask for the same
+metadata or run the same query at once, only the first call goes to Tableau;
+the rest wait for it and share its result.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utilities.tool_cache import QUERY_TOOL, normalize_query_arguments, tool_call_key
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    At most one in-flight execution per key; concurrent callers share the outcome.
+
+    The shared call runs in its own task, so a caller that is cancelled (e.g. the
+    client disconnected) doesn't cancel the call for the other waiters. Once every
+    waiter has been cancelled, the shared call is cancelled too.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._finish(key, t))
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    self.abandoned += 1
+                    task.cancel()
+            raise
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Retrieve the exception so an outcome nobody awaited isn't logged as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "in_flight": len(self._inflight),
+        }
+
+
+class CoalescingToolSession:
+    """
+    Session wrapper that runs one MCP call per identical (tool, arguments) key.
+
+    Sits between CachingToolSession and the pool's circuit breakers: the cache
+    absorbs repeats over time, this absorbs repeats that arrive while the first
+    call is still running.
+    All Tableau MCP tools are read-only, so any tool may be coalesced.
+
+    Args:
+        inner: Session-like object (e.g. MCPSessionPool) that performs the calls.
+        enabled: If None, reads SINGLE_FLIGHT_ENABLED (default true).
+    """
+
+    def __init__(self, inner, enabled: Optional[bool] = None):
+        self.inner = inner
+        self.enabled = enabled if enabled is not None else os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+        self.flight = SingleFlight()
+
+    @staticmethod
+    def key(name: str, arguments: Optional[dict]) -> str:
+        if name == QUERY_TOOL and isinstance(arguments, dict):
+            arguments = normalize_query_arguments(arguments)
+        return tool_call_key(name, arguments)
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs: Any):
+        if not self.enabled:
+            return await self.inner.call_tool(name, arguments, **kwargs)
+        # Only the leading caller's progress_callback sees progress notifications
+        return await self.flight.do(
+            self.key(name, arguments),
+            lambda: self.inner.call_tool(name, arguments, **kwargs),
+        )
+
+    async def list_tools(self, *args: Any, **kwargs: Any):
+        return await self.inner.list_tools(*args, **kwargs)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, **self.flight.stats()}
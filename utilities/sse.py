@@ -0,0 +1,190 @@
+"""
+SSE Encoding for /chat/stream
+
+- Serialization uses orjson when it is installed (much faster than json.dumps on
+  large table payloads) and falls back to the stdlib
+- Two wire formats. "full" (default) sends events exactly as
+  stream_agent_response produces them. "delta" (client opt-in) sends:
+    - step/final events as {"keep": n, "append": text}: keep the first n
+      characters of the text the client is showing, then append
+    - tables once, as {"type": "table", "id": ...} events (the columnar
+      table from utilities.tables), with the final event listing "table_ids";
+      a table already sent earlier in the same conversation is only referenced.
+      Tables count as sent once their stream completes (SSEEncoder.delivered),
+      so a table from an aborted stream is sent again next time
+    - no "is_final": false on intermediate events
+- With SSE_RECORD_DIR set, every stream's events are also written as JSON lines
+  (one file per stream), which benchmarks/bench_sse.py replays
+"""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from utilities.tables import table_key
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+DELTA = "delta"
+WIRE_FORMATS = (FULL, DELTA)
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON-encode to UTF-8 bytes (non-ASCII kept as-is, unknown types via str)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits; the stdlib copes
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def format_event(event: dict) -> bytes:
+    return b"data: " + dumps(event) + b"\n\n"
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class TableLedger:
+    """
+    Which table ids each conversation's client already has (delta format).
+
+    Bounded LRU by thread; forgetting a thread only means its tables are sent again.
+    """
+
+    def __init__(self, max_threads: int = 1024):
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, set]" = OrderedDict()
+
+    def sent(self, thread_id: str) -> set:
+        ids = self._threads.get(thread_id)
+        if ids is None:
+            ids = self._threads[thread_id] = set()
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        else:
+            self._threads.move_to_end(thread_id)
+        return ids
+
+
+class SSEEncoder:
+    """
+    Turns one stream's events into SSE frames in the requested wire format.
+
+    Args:
+        thread_id: Conversation the stream belongs to.
+        wire_format: "full" or "delta".
+        ledger: TableLedger shared across requests (delta format).
+        record_dir: Directory to record events to. If None, reads SSE_RECORD_DIR
+            (default unset = no recording).
+    """
+
+    def __init__(
+        self,
+        thread_id: str,
+        wire_format: str = FULL,
+        ledger: Optional[TableLedger] = None,
+        record_dir: Optional[str] = None,
+    ):
+        self.thread_id = thread_id
+        self.wire_format = wire_format if wire_format in WIRE_FORMATS else FULL
+        self._ledger = ledger or TableLedger()
+        # A copy: this stream's tables reach the ledger only in delivered()
+        self.sent_tables = set(self._ledger.sent(thread_id)) if self.wire_format == DELTA else set()
+        self._new_tables: List[str] = []
+        # Text the client is showing, mirrored from the events sent so far
+        self.text = ""
+        self.events = 0
+        self.bytes = 0
+        record_dir = record_dir if record_dir is not None else os.getenv("SSE_RECORD_DIR", "")
+        self._record = None
+        if record_dir:
+            try:
+                os.makedirs(record_dir, exist_ok=True)
+                path = os.path.join(record_dir, f"{int(time.time() * 1000)}-{thread_id}.jsonl")
+                self._record = open(path, "ab")
+            except OSError as e:
+                logger.warning(f"[{thread_id}] Can't record SSE stream to {record_dir}: {e}")
+
+    def encode(self, event: dict) -> bytes:
+        """SSE frame(s) for one event."""
+        if self._record is not None:
+            self._record.write(dumps(event) + b"\n")
+        if self.wire_format == DELTA:
+            frames = self._delta(event)
+            data = format_event(frames[0]) if len(frames) == 1 else b"".join(format_event(frame) for frame in frames)
+        else:
+            data = format_event(event)
+        self.events += 1
+        self.bytes += len(data)
+        return data
+
+    def _delta(self, event: dict) -> List[dict]:
+        event_type = event.get("type")
+        if event_type == "token":
+            # The bulk of a stream; keep this path short
+            content = event.get("content") or ""
+            self.text += content
+            return [{"type": "token", "content": content}]
+        if event_type == "tool_start":
+            self.text = ""
+        elif event_type in ("step", "final") and isinstance(event.get("content"), str):
+            content = event["content"]
+            keep = _common_prefix(self.text, content)
+            self.text = content
+            event = {k: v for k, v in event.items() if k != "content"}
+            event["keep"] = keep
+            event["append"] = content[keep:]
+        frames: List[dict] = []
+        if event_type == "final" and "tables" in event:
+            event = dict(event)
+            table_ids = []
+            for table in event.pop("tables") or []:
+                table_id = format(table_key(table) & 0xFFFFFFFFFFFFFFFF, "x")
+                table_ids.append(table_id)
+                if table_id not in self.sent_tables:
+                    self.sent_tables.add(table_id)
+                    self._new_tables.append(table_id)
+                    frames.append(self._table_frame(table_id, table))
+            event["table_ids"] = table_ids
+        if not event.get("is_final"):
+            event = {k: v for k, v in event.items() if k != "is_final"}
+        frames.append(event)
+        return frames
+
+    @staticmethod
+    def _table_frame(table_id: str, table: dict) -> dict:
+        return {"type": "table", "id": table_id, **table}
+
+    def delivered(self) -> None:
+        """Record the tables sent by this stream in the ledger. Call when the stream completed."""
+        if self._new_tables:
+            self._ledger.sent(self.thread_id).update(self._new_tables)
+            self._new_tables = []
+
+    def close(self) -> None:
+        if self._record is not None:
+            self._record.close()
+            self._record = None
@@ -0,0 +1,335 @@
+"""
+State Backends
+
+Pluggable storage for the session registry and the LangGraph checkpointer.
+
+- "memory" (default): everything lives in the worker process. Only valid with a
+  single gunicorn worker.
+- "sqlite": sessions and checkpoints share one SQLite database in WAL mode, so
+  several workers on the same host can serve the same conversation. The run
+  claim on each session keeps them to one agent run per conversation.
+
+Other backends implement SessionBackend and pair it with any LangGraph
+BaseCheckpointSaver in open_state_backend().
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RUN_IDLE = 0
+RUN_ACTIVE = 1
+RUN_CANCELLING = 2
+
+
+class SessionBackend(ABC):
+    """
+    Storage for session records: thread_id, created, last_seen and active.
+    Timestamps are wall-clock seconds so they compare across processes.
+
+    active is RUN_IDLE, RUN_ACTIVE while an agent run holds the thread, or
+    RUN_CANCELLING once a cancel was requested for that run.
+    """
+
+    # Methods do blocking I/O; SessionStore then calls them in a worker thread
+    blocking = False
+
+    @abstractmethod
+    def create(self, thread_id: str, now: float) -> None: ...
+
+    @abstractmethod
+    def contains(self, thread_id: str) -> bool: ...
+
+    @abstractmethod
+    def count(self) -> int: ...
+
+    @abstractmethod
+    def ids(self) -> List[str]: ...
+
+    @abstractmethod
+    def claim_run(self, thread_id: str, now: float, stale_before: float) -> bool:
+        """
+        Atomically mark a run as holding the thread. Returns False if the thread
+        is unknown or another run holds it, unless that claim was last seen
+        before stale_before (its worker died without releasing it).
+        """
+
+    @abstractmethod
+    def release_run(self, thread_id: str, now: float) -> None: ...
+
+    @abstractmethod
+    def request_cancel(self, thread_id: str) -> bool:
+        """Flag the thread's run for cancellation. Returns False if no run holds it."""
+
+    @abstractmethod
+    def cancel_requested(self, thread_id: str) -> bool: ...
+
+    @abstractmethod
+    def records(self) -> List[dict]:
+        """All session records, least recently seen first."""
+
+    @abstractmethod
+    def remove(self, thread_id: str) -> bool:
+        """Delete a session. Returns False if it was already gone."""
+
+    def totals(self) -> Tuple[int, int]:
+        """(sessions, active runs)."""
+        records = self.records()
+        return len(records), sum(1 for record in records if record["active"] != RUN_IDLE)
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionBackend(SessionBackend):
+    """Process-local session records kept in LRU order."""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+
+    def create(self, thread_id: str, now: float) -> None:
+        self._sessions[thread_id] = {"thread_id": thread_id, "created": now, "last_seen": now, "active": 0}
+
+    def _touch(self, thread_id: str, now: float) -> None:
+        self._sessions[thread_id]["last_seen"] = now
+        self._sessions.move_to_end(thread_id)
+
+    def contains(self, thread_id: str) -> bool:
+        return thread_id in self._sessions
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+    def ids(self) -> List[str]:
+        return list(self._sessions.keys())
+
+    def claim_run(self, thread_id: str, now: float, stale_before: float) -> bool:
+        session = self._sessions.get(thread_id)
+        if session is None or (session["active"] != RUN_IDLE and session["last_seen"] >= stale_before):
+            return False
+        session["active"] = RUN_ACTIVE
+        self._touch(thread_id, now)
+        return True
+
+    def release_run(self, thread_id: str, now: float) -> None:
+        session = self._sessions.get(thread_id)
+        if session is not None:
+            session["active"] = RUN_IDLE
+            self._touch(thread_id, now)
+
+    def request_cancel(self, thread_id: str) -> bool:
+        session = self._sessions.get(thread_id)
+        if session is None or session["active"] == RUN_IDLE:
+            return False
+        session["active"] = RUN_CANCELLING
+        return True
+
+    def cancel_requested(self, thread_id: str) -> bool:
+        session = self._sessions.get(thread_id)
+        return session is not None and session["active"] == RUN_CANCELLING
+
+    def records(self) -> List[dict]:
+        return [dict(s) for s in self._sessions.values()]
+
+    def remove(self, thread_id: str) -> bool:
+        return self._sessions.pop(thread_id, None) is not None
+
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    Session records in a SQLite table shared by all workers on the host.
+
+    Calls block on disk and on other workers' locks, so SessionStore runs them
+    in a worker thread; WAL mode keeps readers from blocking on writers.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tabby_sessions (
+                thread_id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                active INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tabby_sessions_last_seen ON tabby_sessions (last_seen)")
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        # Rows are fetched under the lock: worker threads share the connection
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def create(self, thread_id: str, now: float) -> None:
+        self._update(
+            "INSERT OR REPLACE INTO tabby_sessions (thread_id, created, last_seen, active) VALUES (?, ?, ?, 0)",
+            (thread_id, now, now),
+        )
+
+    def contains(self, thread_id: str) -> bool:
+        return bool(self._query("SELECT 1 FROM tabby_sessions WHERE thread_id = ?", (thread_id,)))
+
+    def count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM tabby_sessions")[0][0]
+
+    def ids(self) -> List[str]:
+        return [row[0] for row in self._query("SELECT thread_id FROM tabby_sessions ORDER BY last_seen")]
+
+    def claim_run(self, thread_id: str, now: float, stale_before: float) -> bool:
+        # A single conditional UPDATE, so two workers can't both claim the thread
+        return self._update(
+            "UPDATE tabby_sessions SET active = ?, last_seen = ? "
+            "WHERE thread_id = ? AND (active = ? OR last_seen < ?)",
+            (RUN_ACTIVE, now, thread_id, RUN_IDLE, stale_before),
+        ) > 0
+
+    def release_run(self, thread_id: str, now: float) -> None:
+        self._update(
+            "UPDATE tabby_sessions SET active = ?, last_seen = ? WHERE thread_id = ?",
+            (RUN_IDLE, now, thread_id),
+        )
+
+    def request_cancel(self, thread_id: str) -> bool:
+        return self._update(
+            "UPDATE tabby_sessions SET active = ? WHERE thread_id = ? AND active != ?",
+            (RUN_CANCELLING, thread_id, RUN_IDLE),
+        ) > 0
+
+    def cancel_requested(self, thread_id: str) -> bool:
+        rows = self._query("SELECT active FROM tabby_sessions WHERE thread_id = ?", (thread_id,))
+        return bool(rows) and rows[0][0] == RUN_CANCELLING
+
+    def records(self) -> List[dict]:
+        rows = self._query("SELECT thread_id, created, last_seen, active FROM tabby_sessions ORDER BY last_seen")
+        return [{"thread_id": r[0], "created": r[1], "last_seen": r[2], "active": r[3]} for r in rows]
+
+    def totals(self) -> Tuple[int, int]:
+        sessions, active = self._query("SELECT COUNT(*), SUM(active != 0) FROM tabby_sessions")[0]
+        return sessions, int(active or 0)
+
+    def remove(self, thread_id: str) -> bool:
+        return self._update("DELETE FROM tabby_sessions WHERE thread_id = ?", (thread_id,)) > 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _payload_size(value) -> int:
+    """Size of a serialized checkpoint payload: (type, bytes) tuples or raw bytes."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_payload_size(v) for v in value)
+    return 0
+
+
+def estimate_checkpoint_bytes(checkpointer) -> Dict[str, int]:
+    """
+    Approximate serialized bytes held per thread_id by an InMemorySaver.
+
+    Walks the saver's storage/blobs/writes once. Returns an empty dict for
+    checkpointers that don't expose these in-memory structures.
+    """
+    sizes: Dict[str, int] = {}
+    storage = getattr(checkpointer, "storage", None)
+    blobs = getattr(checkpointer, "blobs", None)
+    writes = getattr(checkpointer, "writes", None)
+    if storage is None or blobs is None or writes is None:
+        return sizes
+
+    for thread_id, namespaces in list(storage.items()):
+        total = 0
+        for checkpoints in list(namespaces.values()):
+            for saved in list(checkpoints.values()):
+                total += _payload_size(saved[0]) + _payload_size(saved[1])
+        sizes[thread_id] = sizes.get(thread_id, 0) + total
+    for key, blob in list(blobs.items()):
+        sizes[key[0]] = sizes.get(key[0], 0) + _payload_size(blob)
+    for key, pending in list(writes.items()):
+        total = sum(_payload_size(write[2]) for write in pending.values())
+        sizes[key[0]] = sizes.get(key[0], 0) + total
+    return sizes
+
+
+async def measure_checkpoint_bytes(checkpointer) -> Dict[str, int]:
+    """Bytes held per thread_id by the in-memory or SQLite checkpointer."""
+    conn = getattr(checkpointer, "conn", None)
+    if conn is None:
+        return estimate_checkpoint_bytes(checkpointer)
+    sizes: Dict[str, int] = {}
+    async with conn.execute(
+        "SELECT thread_id, SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints GROUP BY thread_id"
+    ) as cursor:
+        async for thread_id, total in cursor:
+            sizes[thread_id] = int(total or 0)
+    async with conn.execute("SELECT thread_id, SUM(LENGTH(value)) FROM writes GROUP BY thread_id") as cursor:
+        async for thread_id, total in cursor:
+            sizes[thread_id] = sizes.get(thread_id, 0) + int(total or 0)
+    return sizes
+
+
+@asynccontextmanager
+async def open_state_backend(kind: Optional[str] = None, path: Optional[str] = None):
+    """
+    Open the session backend and checkpointer for the configured STATE_BACKEND.
+
+    Args:
+        kind: "memory" or "sqlite". If None, reads STATE_BACKEND (default "memory").
+        path: SQLite database file. If None, reads STATE_SQLITE_PATH (default ".state/tabby.sqlite").
+
+    Yields:
+        (SessionBackend, checkpointer) tuple
+    """
+    kind = (kind or os.getenv("STATE_BACKEND", "memory")).lower()
+
+    if kind == "memory":
+        from langgraph.checkpoint.memory import InMemorySaver
+        logger.info("Using in-memory state backend (single worker only)")
+        yield MemorySessionBackend(), InMemorySaver()
+    elif kind == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        path = path or os.getenv("STATE_SQLITE_PATH", ".state/tabby.sqlite")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        busy_timeout_ms = int(os.getenv("STATE_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        logger.info(f"Using SQLite state backend at {path}")
+
+        session_backend = await asyncio.to_thread(SqliteSessionBackend, path, busy_timeout_ms)
+        try:
+            # Autocommit: deferred read-then-write transactions fail instantly with
+            # SQLITE_BUSY under WAL when another worker committed in between
+            async with aiosqlite.connect(path, isolation_level=None) as conn:
+                # Other workers write to the same file; wait for their locks instead of failing
+                await conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+                checkpointer = AsyncSqliteSaver(conn)
+                await checkpointer.setup()  # creates tables and switches the file to WAL
+                yield session_backend, checkpointer
+        finally:
+            await asyncio.to_thread(session_backend.close)
+    else:
+        raise ValueError(
+            f"Unsupported state backend: {kind}. "
+            f"Supported backends: 'memory', 'sqlite'"
+        )
@@ -0,0 +1,416 @@
+"""
+Chart Tables
+
+Columnar, typed tables for the auto-charts the UI draws under an answer.
+A table is sent as
+
+    {"title": "Sales by Region",
+     "columns": ["Region", "SUM(Sales)"],
+     "dtypes": ["string", "number"],      # "number", "date", "string" or "boolean"
+     "values": [["West", "East"], [725457.8, 678781.2]],   # one list per column
+     "row_count": 4,                      # rows in the tool result
+     "sampled": "top_n"}                  # only when downsampled ("lttb", "top_n", "stride")
+
+Date columns are sent as whole numbers since 1970-01-01 UTC in the table's
+"date_unit": "day" when every date is a whole day, else "s" or "ms" (naive
+dates are taken as UTC).
+
+When rows were merged the table also has "aggregated": one entry per column
+naming how each number column was combined ("sum", "min" or "max"), or None.
+Only SUM/COUNT measures and plain numbers (no aggregation in the caption) are
+summed; MIN/MAX use their own reducer. AVG, MEDIAN, COUNTD and the like can't
+be rebuilt from their parts, so they are None on merged rows, and rows aren't
+merged at all when the charted column is one of them. Text columns keep
+their value when every merged row shares it and read "All" otherwise.
+
+Column names appear once instead of on every row, and dtypes are inferred
+here, once, from a sample of the result. Number columns hold numbers
+("$1,234" becomes 1234.0) and date columns are sorted. Large results are downsampled instead of truncated:
+
+- with a date column: LTTB (largest triangle three buckets) on the first
+  number column, down to TABLE_MAX_POINTS rows, which keeps the peaks and
+  troughs a line chart needs. When dates repeat (one row per date and
+  category, say), rows are merged per date first
+- with a category column: rows are merged per label, then the TABLE_TOP_N - 1
+  labels with the largest absolute values are kept plus an "Other" row
+  merging the rest
+- otherwise: evenly spaced rows
+"""
+
+import heapq
+import math
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+NUMBER = "number"
+DATE = "date"
+STRING = "string"
+BOOLEAN = "boolean"
+
+# Rows used to infer columns and dtypes
+TYPE_SAMPLE_ROWS = 1000
+# Rows read from one tool result; the rest are ignored
+TABLE_MAX_SOURCE_ROWS = int(os.getenv("TABLE_MAX_SOURCE_ROWS", "200000"))
+# Points kept for time series, bars kept (including "Other") for categories
+TABLE_MAX_POINTS = int(os.getenv("TABLE_MAX_POINTS", "500"))
+TABLE_TOP_N = int(os.getenv("TABLE_TOP_N", "30"))
+OTHER_LABEL = "Other"
+ALL_LABEL = "All"
+
+_SCALARS = (str, int, float, bool)
+_NUMBER_STRIP = str.maketrans("", "", "$,% ")
+_EPOCH = datetime(1970, 1, 1)
+_MISSING = object()
+_AGGREGATION_RE = re.compile(r"^\s*([A-Za-z]+)\s*\(.*\)\s*$")
+# Measures that can be merged exactly; other functions (AVG, MEDIAN, COUNTD...) can't
+_REDUCERS = {"SUM": "sum", "COUNT": "sum", "CNT": "sum", "MIN": "min", "MAX": "max"}
+_DATE_RE = re.compile(r"^\d{4}-\d{2}(-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?)?(Z|[+-]\d{2}:?\d{2})?$")
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        number = value
+    elif isinstance(value, str):
+        try:
+            number = float(value.translate(_NUMBER_STRIP))
+        except ValueError:
+            return None
+    else:
+        return None
+    # NaN and infinities can't be charted (or written as JSON)
+    return number if math.isfinite(number) else None
+
+
+def _to_timestamp(value: Any) -> Optional[float]:
+    if not isinstance(value, str) or not _DATE_RE.match(value):
+        return None
+    return _parse_date(value)
+
+
+def _parse_date(value: str) -> Optional[float]:
+    try:
+        parsed = datetime.fromisoformat(value if len(value) > 7 else value + "-01")
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return (parsed - _EPOCH).total_seconds()
+    return parsed.timestamp()
+
+
+def _timestamps(values: Sequence[Any]) -> List[Optional[float]]:
+    """Seconds since the epoch for a date column (already typed, so no pattern check)."""
+    # Dates repeat a lot in query results (one per day/month); parse each once
+    parsed: dict = {}
+    out: List[Optional[float]] = []
+    append = out.append
+    for value in values:
+        if type(value) is not str:
+            append(None)
+            continue
+        t = parsed.get(value, _MISSING)
+        if t is _MISSING:
+            t = parsed[value] = _parse_date(value)
+        append(t)
+    return out
+
+
+def reducer(column: str) -> Optional[str]:
+    """How a number column combines when rows merge: "sum", "min", "max", or None if it can't."""
+    match = _AGGREGATION_RE.match(column)
+    if match is None:
+        return "sum"
+    return _REDUCERS.get(match.group(1).upper())
+
+
+def _reduce(values: List[Any], how: Optional[str]) -> Any:
+    if len(values) == 1:
+        return values[0]
+    present = [v for v in values if v is not None]
+    if not present or how is None:
+        return None
+    if how == "min":
+        return min(present)
+    if how == "max":
+        return max(present)
+    return math.fsum(present)
+
+
+def _shared(values: List[Any], dtype: str) -> Any:
+    """The value merged rows have in common; "All" for differing text."""
+    first = values[0]
+    if all(v == first for v in values):
+        return first
+    return ALL_LABEL if dtype == STRING else None
+
+
+def infer_dtype(values: Sequence[Any]) -> str:
+    """Dtype of a column from a sample of its values (nulls ignored)."""
+    present = [v for v in values if v is not None and v != ""]
+    if not present:
+        return STRING
+    if all(isinstance(v, bool) for v in present):
+        return BOOLEAN
+    # Same thresholds the client used: half numeric, or 60% dates
+    if sum(1 for v in present if _to_number(v) is not None) >= max(2, len(present) // 2):
+        return NUMBER
+    if sum(1 for v in present if _to_timestamp(v) is not None) >= max(2, int(len(present) * 0.6)):
+        return DATE
+    return STRING
+
+
+def lttb(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps (x ascending).
+
+    The first and last points are always kept; each bucket in between keeps
+    the point forming the largest triangle with the previous pick and the
+    next bucket's average.
+    """
+    n = len(x)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1]
+    picked = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(x[next_start:next_end]) / span
+        avg_y = sum(y[next_start:next_end]) / span
+        ax, ay = x[a], y[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+class TableSource:
+    """
+    Rows recognized in a tool result, typed from a sample.
+
+    Creating one only looks at the first TYPE_SAMPLE_ROWS rows; build() reads
+    the rest, so candidates that are dropped (duplicates, no number column,
+    over the per-message limit) cost little.
+    """
+
+    def __init__(self, rows: List[Any], columns: List[str], keys: List[Any]):
+        self.rows = rows
+        self.columns = columns
+        # Row accessors: column names for dict rows, positions for list rows
+        self.keys = keys
+        sample = rows[:TYPE_SAMPLE_ROWS]
+        self.dtypes = [infer_dtype(self._column(key, sample)) for key in keys]
+
+    @classmethod
+    def from_records(cls, rows: Any) -> Optional["TableSource"]:
+        """A list of row dicts, e.g. query-datasource's "data"."""
+        if not isinstance(rows, list) or len(rows) < 2:
+            return None
+        rows = [row for row in rows[:TABLE_MAX_SOURCE_ROWS] if isinstance(row, dict) and row]
+        if len(rows) < 2:
+            return None
+        columns: List[str] = []
+        seen = set()
+        for row in rows[:TYPE_SAMPLE_ROWS]:
+            for key, value in row.items():
+                if key not in seen and (value is None or isinstance(value, _SCALARS)):
+                    seen.add(key)
+                    columns.append(key)
+        if not columns:
+            return None
+        return cls(rows, [str(c) for c in columns], columns)
+
+    @classmethod
+    def from_columns(cls, obj: dict) -> Optional["TableSource"]:
+        """A {"columns": [...], "rows": [[...], ...]} object."""
+        columns, rows = obj.get("columns"), obj.get("rows")
+        if not isinstance(columns, list) or not columns or not isinstance(rows, list):
+            return None
+        names = [str(c) for c in columns]
+        rows = rows[:TABLE_MAX_SOURCE_ROWS]
+        if rows and isinstance(rows[0], dict):
+            return cls.from_records(rows)
+        rows = [row for row in rows if isinstance(row, list)]
+        if len(rows) < 2:
+            return None
+        return cls(rows, names, list(range(len(names))))
+
+    @staticmethod
+    def _column(key: Any, rows: Sequence[Any]) -> List[Any]:
+        if isinstance(key, int):
+            return [row[key] if key < len(row) else None for row in rows]
+        return [row.get(key) for row in rows]
+
+    @property
+    def chartable(self) -> bool:
+        return NUMBER in self.dtypes
+
+    def key(self) -> int:
+        """Hash identifying the source by its size and first rows (for dedupe)."""
+        head = self.rows[:20]
+        return hash((len(self.rows), tuple(self.columns), tuple(
+            tuple(_cell(v) for v in self._column(key, head)) for key in self.keys
+        )))
+
+    def _typed(self, index: int, rows: Sequence[Any]) -> List[Any]:
+        values = self._column(self.keys[index], rows)
+        dtype = self.dtypes[index]
+        if dtype == NUMBER:
+            isfinite = math.isfinite
+            return [
+                v if type(v) is int or (type(v) is float and isfinite(v)) else _to_number(v)
+                for v in values
+            ]
+        if dtype == BOOLEAN:
+            return [v if isinstance(v, bool) else None for v in values]
+        return [_cell(v) for v in values]
+
+    def build(self, title: str) -> dict:
+        """The columnar payload, downsampled to what a chart can show."""
+        table = {"title": title, "columns": self.columns, "dtypes": self.dtypes}
+        rows = self.rows
+        number_index = self.dtypes.index(NUMBER)
+        if DATE in self.dtypes:
+            table["values"] = self._time_series(self.dtypes.index(DATE), number_index, table)
+        elif STRING in self.dtypes and len(rows) > TABLE_TOP_N:
+            table["values"] = self._top_n(self.dtypes.index(STRING), number_index, table)
+        else:
+            if len(rows) > TABLE_MAX_POINTS:
+                step = len(rows) / TABLE_MAX_POINTS
+                rows = [rows[int(i * step)] for i in range(TABLE_MAX_POINTS)]
+                table["sampled"] = "stride"
+            table["values"] = [self._typed(i, rows) for i in range(len(self.columns))]
+        if DATE in self.dtypes:
+            self._encode_dates(table)
+        table["row_count"] = len(self.rows)
+        return table
+
+    def _encode_dates(self, table: dict) -> None:
+        values = table["values"]
+        dates = [index for index, dtype in enumerate(self.dtypes) if dtype == DATE]
+        times = {index: _timestamps(values[index]) for index in dates}
+        present = [t for column in times.values() for t in column if t is not None]
+        if all(t % 86400 == 0 for t in present):
+            unit, scale = "day", 1 / 86400
+        elif all(t == int(t) for t in present):
+            unit, scale = "s", 1
+        else:
+            unit, scale = "ms", 1000
+        for index, column in times.items():
+            values[index] = [None if t is None else round(t * scale) for t in column]
+        table["date_unit"] = unit
+
+    def _time_series(self, date_index: int, number_index: int, table: dict) -> List[List[Any]]:
+        rows = self.rows
+        times = _timestamps(self._column(self.keys[date_index], rows))
+        ys = self._typed(number_index, rows)
+        # Sorted by date; rows without a date or value can't be plotted
+        order = sorted((i for i, t in enumerate(times) if t is not None and ys[i] is not None), key=times.__getitem__)
+        reducers = self._reducers()
+        if len({times[i] for i in order}) < len(order) and reducers[number_index] is not None:
+            # Several rows per date (e.g. one per category): chart one merged row per date
+            groups: Dict[float, List[int]] = {}
+            for i in order:
+                groups.setdefault(times[i], []).append(i)
+            table["aggregated"] = reducers
+            values = self._merged(list(groups.values()), reducers, {number_index: ys})
+            # Dates that parse alike may be written differently; keep each group's first
+            values[date_index] = self._typed(date_index, [rows[members[0]] for members in groups.values()])
+            if len(groups) > TABLE_MAX_POINTS:
+                keep = lttb(list(groups), values[number_index], TABLE_MAX_POINTS)
+                values = [[column[k] for k in keep] for column in values]
+                table["sampled"] = "lttb"
+            return values
+        if len(order) > TABLE_MAX_POINTS:
+            keep = lttb([times[i] for i in order], [ys[i] for i in order], TABLE_MAX_POINTS)
+            order = [order[k] for k in keep]
+            table["sampled"] = "lttb"
+        picked = [rows[i] for i in order]
+        return [self._typed(i, picked) for i in range(len(self.columns))]
+
+    def _reducers(self) -> List[Optional[str]]:
+        return [reducer(name) if dtype == NUMBER else None for name, dtype in zip(self.columns, self.dtypes)]
+
+    def _merged(self, groups: List[List[int]], reducers: List[Optional[str]], typed: Dict[int, List[Any]]) -> List[List[Any]]:
+        """One row per group of row indices; typed holds columns already converted."""
+        values: List[List[Any]] = []
+        for index, dtype in enumerate(self.dtypes):
+            column = typed.get(index)
+            if column is None:
+                column = self._typed(index, self.rows)
+            if dtype == NUMBER:
+                values.append([_reduce([column[i] for i in members], reducers[index]) for members in groups])
+            else:
+                values.append([_shared([column[i] for i in members], dtype) for members in groups])
+        return values
+
+    def _top_n(self, label_index: int, number_index: int, table: dict) -> List[List[Any]]:
+        # Rows are grouped by label first, so a label spread over several rows is one bar
+        rows = self.rows
+        labels = self._typed(label_index, rows)
+        ys = self._typed(number_index, rows)
+        reducers = self._reducers()
+        by_label: Dict[Any, List[int]] = {}
+        for i, label in enumerate(labels):
+            if label is not None:
+                by_label.setdefault(label, []).append(i)
+        groups = list(by_label.values())
+        if len(groups) < sum(map(len, groups)):
+            if reducers[number_index] is None:
+                # The ranked measure can't be merged (e.g. AVG): rank the rows themselves
+                groups = [[i] for members in groups for i in members]
+            else:
+                table["aggregated"] = reducers
+        typed = {label_index: labels, number_index: ys}
+        totals = [_reduce([ys[i] for i in members], reducers[number_index]) for members in groups]
+        ranked = [g for g, total in enumerate(totals) if total is not None]
+        unranked = [i for i, label in enumerate(labels) if label is None]
+        unranked += [i for g, total in enumerate(totals) if total is None for i in groups[g]]
+        if len(ranked) + bool(unranked) <= TABLE_TOP_N:
+            top = ranked
+        else:
+            # Largest bars either side of zero, then one "Other" bar merging everything else
+            top = heapq.nlargest(TABLE_TOP_N - 1, ranked, key=lambda g: abs(totals[g]))
+        top_set = set(top)
+        picked = [groups[g] for g in top]
+        rest = [i for g in ranked if g not in top_set for i in groups[g]] + unranked
+        if rest:
+            picked.append(rest)
+            table["sampled"] = "top_n"
+        values = self._merged(picked, reducers, typed)
+        if rest:
+            values[label_index][-1] = OTHER_LABEL
+        return values
+
+def _cell(value: Any) -> Any:
+    return value if value is None or isinstance(value, _SCALARS) else None
+
+
+def table_from_rows(rows: Any, title: str = "Tool Result") -> Optional[dict]:
+    """Columnar table for a list of row dicts, or None if there is nothing to chart."""
+    source = TableSource.from_records(rows)
+    return source.build(title) if source is not None and source.chartable else None
+
+
+def table_key(table: dict) -> int:
+    """Hash identifying a built table by its columns, size and first values (for dedupe)."""
+    return hash((
+        tuple(table["columns"]),
+        table.get("row_count"),
+        tuple(tuple(column[:20]) for column in table["values"]),
+    ))
@@ -0,0 +1,369 @@
+"""
+Tool Result Cache
+
+In-process TTL cache for MCP tool results that rarely change between questions
+(list-datasources, get-datasource-metadata). CachingToolSession wraps the MCP
+session pool and answers repeated calls - same tool name, same canonicalized
+arguments - without a round-trip to Tableau.
+
+Optionally, identical query-datasource calls are served from QueryResultCache
+until the datasource's extract is refreshed.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHEABLE_TOOLS = ("list-datasources", "get-datasource-metadata")
+QUERY_TOOL = "query-datasource"
+
+
+def canonical_arguments(arguments: Any) -> str:
+    """Stable JSON for tool arguments: sorted keys, no whitespace."""
+    return json.dumps(arguments or {}, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def tool_call_key(name: str, arguments: Any) -> str:
+    return f"{name}:{canonical_arguments(arguments)}"
+
+
+def result_size(result: Any) -> int:
+    """Approximate bytes held by a CallToolResult (text and base64 payloads)."""
+    total = 0
+    for block in getattr(result, "content", None) or []:
+        for attr in ("text", "data"):
+            value = getattr(block, attr, None)
+            if isinstance(value, str):
+                total += len(value)
+    structured = getattr(result, "structuredContent", None)
+    if structured:
+        total += len(json.dumps(structured, default=str))
+    return total
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry, bounded by entry count and total size.
+
+    Args:
+        ttl_seconds: Default time-to-live for entries.
+        max_entries: Maximum number of entries (0 = unbounded).
+        max_bytes: Maximum total size as reported by `sizeof` (0 = unbounded).
+        sizeof: Function returning the size of a cached value.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 0, max_bytes: int = 0, sizeof=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        # key -> (expires_at, size, value), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Read without touching LRU order or hit/miss counters."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[2]
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self._remove(key)
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while self._entries and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, prefix: Optional[str] = None) -> int:
+        """Drop all entries, or those whose key starts with `prefix`. Returns the count dropped."""
+        keys = [k for k in self._entries if prefix is None or k.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+def normalize_query_arguments(arguments: dict) -> dict:
+    """
+    Canonical form of query-datasource arguments for cache keys.
+
+    Field and filter lists are order-insensitive in VizQL Data Service queries
+    (sorting is explicit via sortPriority), and so are SET filter values, so
+    all three are sorted. Everything else is kept as-is.
+    """
+    normalized = dict(arguments)
+    query = normalized.get("query")
+    if not isinstance(query, dict):
+        return normalized
+    query = dict(query)
+    if isinstance(query.get("fields"), list):
+        query["fields"] = sorted(query["fields"], key=canonical_arguments)
+    if isinstance(query.get("filters"), list):
+        filters = []
+        for flt in query["filters"]:
+            if isinstance(flt, dict) and isinstance(flt.get("values"), list):
+                flt = {**flt, "values": sorted(flt["values"], key=canonical_arguments)}
+            filters.append(flt)
+        query["filters"] = sorted(filters, key=canonical_arguments)
+    normalized["query"] = query
+    return normalized
+
+
+def _find_refresh_times(value: Any, found: dict) -> None:
+    """Collect {luid: extractLastRefreshTime} from decoded tool output."""
+    if isinstance(value, dict):
+        refreshed = value.get("extractLastRefreshTime")
+        luid = value.get("luid") or value.get("id")
+        if refreshed and isinstance(luid, str):
+            found[luid] = str(refreshed)
+        for sub in value.values():
+            _find_refresh_times(sub, found)
+    elif isinstance(value, list):
+        for item in value:
+            _find_refresh_times(item, found)
+
+
+class QueryResultCache:
+    """
+    Cache for query-datasource results keyed on datasource LUID + normalized query.
+
+    Entries are tied to the datasource's extractLastRefreshTime, as learned from
+    the listing/metadata results that pass through CachingToolSession (the same
+    field find_datasource_luid.gql reads from the Metadata API). When a newer
+    refresh time is seen, every cached query for that datasource is dropped.
+    Datasources with no known refresh time (live connections) get a short TTL.
+
+    Refresh times only arrive when a listing is fetched from Tableau, and the
+    listings themselves are cached, so a refresh can go unseen for as long as
+    the listing cache keeps its entry. Extract-backed entries therefore live no
+    longer than that (see set()): a cached query trails an extract refresh by
+    at most min(ttl_seconds, TOOL_CACHE_TTL_SECONDS).
+
+    Args:
+        enabled: If None, reads QUERY_CACHE_ENABLED (default false).
+        ttl_seconds: Upper bound for extract-backed entries. If None, reads
+            QUERY_CACHE_TTL_SECONDS (default 3600).
+        live_ttl_seconds: TTL when no refresh time is known. If None, reads
+            QUERY_CACHE_LIVE_TTL_SECONDS (default 120).
+        max_entries: If None, reads QUERY_CACHE_MAX_ENTRIES (default 512).
+        max_mb: If None, reads QUERY_CACHE_MAX_MB (default 128).
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        ttl_seconds: Optional[float] = None,
+        live_ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_mb: Optional[float] = None,
+    ):
+        self.enabled = enabled if enabled is not None else os.getenv("QUERY_CACHE_ENABLED", "false").lower() == "true"
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+        self.live_ttl_seconds = (
+            live_ttl_seconds if live_ttl_seconds is not None
+            else float(os.getenv("QUERY_CACHE_LIVE_TTL_SECONDS", "120"))
+        )
+        entries = max_entries if max_entries is not None else int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "512"))
+        mb = max_mb if max_mb is not None else float(os.getenv("QUERY_CACHE_MAX_MB", "128"))
+        self.cache = TTLCache(self.ttl_seconds, max_entries=entries, max_bytes=int(mb * 1024 * 1024), sizeof=result_size)
+        # luid -> last seen extractLastRefreshTime
+        self.refresh_times: dict = {}
+        self.refresh_invalidations = 0
+
+    @staticmethod
+    def key(arguments: Optional[dict]) -> Optional[str]:
+        luid = (arguments or {}).get("datasourceLuid")
+        if not isinstance(luid, str) or not luid:
+            return None
+        return f"{luid}:{canonical_arguments(normalize_query_arguments(arguments))}"
+
+    def get(self, arguments: Optional[dict]):
+        key = self.key(arguments)
+        return self.cache.get(key) if key else None
+
+    def set(self, arguments: Optional[dict], result: Any, max_ttl: Optional[float] = None) -> None:
+        """
+        Cache a query result.
+
+        Args:
+            max_ttl: How old the known refresh times may be, i.e. the listing
+                cache's TTL. Extract-backed entries don't outlive it; 0 means
+                unknown, so they get the live TTL.
+        """
+        key = self.key(arguments)
+        if key is None or getattr(result, "isError", False):
+            return
+        ttl = self.live_ttl_seconds
+        if arguments["datasourceLuid"] in self.refresh_times and max_ttl != 0:
+            ttl = self.ttl_seconds if max_ttl is None else min(self.ttl_seconds, max_ttl)
+        self.cache.set(key, result, ttl)
+
+    def observe(self, result: Any) -> None:
+        """Learn refresh times from a listing/metadata result; drop queries made stale by a refresh."""
+        found: dict = {}
+        for block in getattr(result, "content", None) or []:
+            text = getattr(block, "text", None)
+            if not isinstance(text, str) or "extractLastRefreshTime" not in text:
+                continue
+            try:
+                _find_refresh_times(json.loads(text), found)
+            except (TypeError, ValueError):
+                continue
+        _find_refresh_times(getattr(result, "structuredContent", None), found)
+        for luid, refreshed in found.items():
+            previous = self.refresh_times.get(luid)
+            self.refresh_times[luid] = refreshed
+            if previous is not None and previous != refreshed:
+                dropped = self.invalidate(luid)
+                self.refresh_invalidations += 1
+                logger.info(f"Datasource {luid} extract refreshed ({previous} -> {refreshed}), dropped {dropped} cached queries")
+
+    def invalidate(self, luid: Optional[str] = None) -> int:
+        return self.cache.invalidate(f"{luid}:" if luid else None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "known_refresh_times": len(self.refresh_times),
+            "refresh_invalidations": self.refresh_invalidations,
+            **self.cache.stats(),
+        }
+
+
+class CachingToolSession:
+    """
+    Session wrapper that caches results of read-mostly MCP tools.
+
+    Quacks like a ClientSession for load_mcp_tools(); everything other than the
+    cacheable tools passes straight through to `inner`. Error results are never
+    cached.
+
+    Args:
+        inner: Session-like object (e.g. MCPSessionPool) that performs the calls.
+        cacheable_tools: Tool names to cache. If None, reads TOOL_CACHE_TOOLS
+            (default "list-datasources,get-datasource-metadata").
+        ttl_seconds: If None, reads TOOL_CACHE_TTL_SECONDS (default 600, 0 disables).
+        max_entries: If None, reads TOOL_CACHE_MAX_ENTRIES (default 256).
+        max_mb: If None, reads TOOL_CACHE_MAX_MB (default 64).
+        query_cache: Optional QueryResultCache for query-datasource results.
+    """
+
+    def __init__(
+        self,
+        inner,
+        cacheable_tools: Optional[Iterable[str]] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_mb: Optional[float] = None,
+        query_cache: Optional[QueryResultCache] = None,
+    ):
+        self.inner = inner
+        self.query_cache = query_cache
+        if cacheable_tools is None:
+            configured = os.getenv("TOOL_CACHE_TOOLS", ",".join(DEFAULT_CACHEABLE_TOOLS))
+            cacheable_tools = [t.strip() for t in configured.split(",") if t.strip()]
+        self.cacheable_tools = set(cacheable_tools)
+        ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv("TOOL_CACHE_TTL_SECONDS", "600"))
+        entries = max_entries if max_entries is not None else int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "256"))
+        mb = max_mb if max_mb is not None else float(os.getenv("TOOL_CACHE_MAX_MB", "64"))
+        self.enabled = ttl > 0
+        self.cache = TTLCache(ttl, max_entries=entries, max_bytes=int(mb * 1024 * 1024), sizeof=result_size)
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs: Any):
+        if name == QUERY_TOOL and self.query_cache is not None and self.query_cache.enabled:
+            return await self._call_query(name, arguments, **kwargs)
+        if not self.enabled or name not in self.cacheable_tools:
+            return await self._call_inner(name, arguments, **kwargs)
+        key = tool_call_key(name, arguments)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug(f"Tool cache hit: {name}")
+            return cached
+        result = await self._call_inner(name, arguments, **kwargs)
+        if not getattr(result, "isError", False):
+            self.cache.set(key, result)
+        return result
+
+    async def _call_inner(self, name: str, arguments: Optional[dict], **kwargs: Any):
+        result = await self.inner.call_tool(name, arguments, **kwargs)
+        if self.query_cache is not None and name != QUERY_TOOL and not getattr(result, "isError", False):
+            self.query_cache.observe(result)
+        return result
+
+    async def _call_query(self, name: str, arguments: Optional[dict], **kwargs: Any):
+        cached = self.query_cache.get(arguments)
+        if cached is not None:
+            logger.debug(f"Query cache hit: {(arguments or {}).get('datasourceLuid')}")
+            return cached
+        result = await self.inner.call_tool(name, arguments, **kwargs)
+        # Refresh times come from listings this cache may serve for up to its TTL
+        self.query_cache.set(arguments, result, max_ttl=self.cache.ttl_seconds if self.enabled else 0)
+        return result
+
+    async def list_tools(self, *args: Any, **kwargs: Any):
+        return await self.inner.list_tools(*args, **kwargs)
+
+    def invalidate(self, tool_name: Optional[str] = None) -> int:
+        """Drop cached results for one tool, or all of them."""
+        if tool_name == QUERY_TOOL:
+            dropped = self.query_cache.invalidate() if self.query_cache is not None else 0
+        else:
+            dropped = self.cache.invalidate(f"{tool_name}:" if tool_name else None)
+            if tool_name is None and self.query_cache is not None:
+                dropped += self.query_cache.invalidate()
+        logger.info(f"Tool cache invalidated ({tool_name or 'all tools'}): {dropped} entries")
+        return dropped
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.enabled, "tools": sorted(self.cacheable_tools), **self.cache.stats()}
+        if self.query_cache is not None:
+            stats["query_cache"] = self.query_cache.stats()
+        return stats
@@ -0,0 +1,189 @@
+"""
+Tool Call Execution Policy
+
+ToolNode already runs the tool calls of one AIMessage concurrently (results come
+back in call order). This module adds the controls it lacks, as an
+awrap_tool_call interceptor:
+
+- a per-call deadline, with per-tool overrides (query-datasource is slower than
+  a metadata lookup); a call that runs over becomes an error ToolMessage for
+  that call only, so its siblings' results still reach the model
+- a process-wide cap on in-flight tool calls, so one wide fan-out can't take
+  every MCP pool session from other conversations
+
+Cancelling a timed-out call propagates down the session chain: the coalescer
+abandons the MCP request once no other caller is waiting on it, and the pool
+marks the interrupted session for a health check. Timeouts are also reported to
+the circuit breakers, since a hung Tableau never produces an error of its own.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.prebuilt.tool_node import ToolCallRequest
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_timeouts(spec: str) -> Dict[str, float]:
+    """Parse "tool=seconds,tool=seconds" into a dict, skipping malformed entries."""
+    timeouts: Dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if not name or not value.strip():
+            continue
+        try:
+            timeouts[name] = float(value)
+        except ValueError:
+            logger.warning(f"Ignoring malformed TOOL_TIMEOUTS entry: {item!r}")
+    return timeouts
+
+
+def _batch_size(request: ToolCallRequest) -> int:
+    """Number of tool calls in the AIMessage this call came from, or 0 if it isn't the first of them."""
+    state = request.state
+    messages = state.get("messages", []) if isinstance(state, dict) else getattr(state, "messages", [])
+    call_id = request.tool_call.get("id")
+    for message in reversed(messages or []):
+        if isinstance(message, AIMessage) and message.tool_calls:
+            if message.tool_calls[0].get("id") == call_id:
+                return len(message.tool_calls)
+            if any(call.get("id") == call_id for call in message.tool_calls):
+                return 0
+    return 0
+
+
+class ToolExecutor:
+    """
+    awrap_tool_call interceptor for ToolNode: per-call timeouts and a concurrency cap.
+
+    Args:
+        max_concurrency: Tool calls in flight across all conversations. If None,
+            reads TOOL_MAX_CONCURRENCY (default 8, 0 = no limit).
+        timeout_seconds: Default per-call deadline. If None, reads
+            TOOL_TIMEOUT_SECONDS (default 90, 0 = no deadline).
+        timeouts: Per-tool deadlines. If None, reads TOOL_TIMEOUTS
+            (e.g. "query-datasource=120,list-datasources=30").
+        breakers: CircuitBreakerSession to report timeouts to (optional).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        timeout_seconds: Optional[float] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        breakers=None,
+    ):
+        self.max_concurrency = (
+            max_concurrency if max_concurrency is not None
+            else int(os.getenv("TOOL_MAX_CONCURRENCY", "8"))
+        )
+        self.timeout_seconds = (
+            timeout_seconds if timeout_seconds is not None
+            else float(os.getenv("TOOL_TIMEOUT_SECONDS", "90"))
+        )
+        self.timeouts = timeouts if timeouts is not None else _parse_timeouts(os.getenv("TOOL_TIMEOUTS", ""))
+        self.breakers = breakers
+        self._slots = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency > 0 else None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.delayed = 0
+        self.wait_seconds_total = 0.0
+        self.batches = 0
+        self.parallel_batches = 0
+        self.max_batch = 0
+        self.timed_out: Dict[str, int] = {}
+        self.seconds_by_tool: Dict[str, float] = {}
+        self.calls_by_tool: Dict[str, int] = {}
+
+    def timeout_for(self, tool_name: str) -> Optional[float]:
+        timeout = self.timeouts.get(tool_name, self.timeout_seconds)
+        return timeout if timeout > 0 else None
+
+    async def _acquire(self) -> float:
+        if self._slots is None:
+            return 0.0
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - start
+
+    async def __call__(
+        self,
+        request: ToolCallRequest,
+        execute: Callable[[ToolCallRequest], Awaitable[ToolMessage]],
+    ):
+        call = request.tool_call
+        name = call["name"]
+        batch = _batch_size(request)
+        if batch:
+            self.batches += 1
+            self.max_batch = max(self.max_batch, batch)
+            if batch > 1:
+                self.parallel_batches += 1
+                logger.info(f"Running {batch} tool calls concurrently")
+
+        waited = await self._acquire()
+        self.calls += 1
+        self.wait_seconds_total += waited
+        if waited >= 0.01:
+            self.delayed += 1
+            logger.info(f"Tool call '{name}' waited {waited:.2f}s for a free slot")
+
+        timeout = self.timeout_for(name)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(execute(request), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out[name] = self.timed_out.get(name, 0) + 1
+            logger.warning(f"Tool call '{name}' timed out after {timeout:g}s")
+            if self.breakers is not None:
+                self.breakers.record_timeout(name, call.get("args"))
+            return ToolMessage(
+                content=(
+                    f"The call to '{name}' timed out after {timeout:g} seconds. "
+                    f"Try a narrower request (fewer fields, more filters, or a smaller date range)."
+                ),
+                name=name,
+                tool_call_id=call["id"],
+                status="error",
+            )
+        finally:
+            self.in_flight -= 1
+            self.calls_by_tool[name] = self.calls_by_tool.get(name, 0) + 1
+            self.seconds_by_tool[name] = self.seconds_by_tool.get(name, 0.0) + time.monotonic() - start
+            if self._slots is not None:
+                self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout_seconds,
+            "timeouts": dict(self.timeouts),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "delayed_calls": self.delayed,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.calls, 3) if self.calls else 0.0,
+            "batches": self.batches,
+            "parallel_batches": self.parallel_batches,
+            "max_batch": self.max_batch,
+            "timed_out": dict(self.timed_out),
+            "avg_seconds_by_tool": {
+                name: round(self.seconds_by_tool[name] / count, 3)
+                for name, count in self.calls_by_tool.items()
+            },
+        }
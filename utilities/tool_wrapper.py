@@ -1,156 +1,169 @@
 """
-Tool wrapper utilities for better error handling of MCP tools.
+Tool error classification for MCP tools.
 
-This module provides wrappers that convert HTTP errors (400, 403, etc.) into
-ToolException messages that LangGraph can handle gracefully, preventing graph
-state corruption.
+Failures are sorted into a small set of kinds from structured data rather than
+by searching exception strings:
+
+- McpError: the JSON-RPC error code (-32602 invalid params, 408 read timeout, ...)
+- httpx.HTTPStatusError and other errors carrying a response: the HTTP status
+- timeouts and transport errors: by exception type
+- CallToolResult(isError=True): Tableau MCP reports REST failures as text, so
+  the Tableau status code is read from structuredContent when present, else
+  from the "status code NNN" the server includes in the message
+
+The kind decides whether a failure says anything about Tableau's health
+(circuit breakers only count transient kinds) and which message the model sees.
 """
+import asyncio
 import logging
-from typing import List
-from langchain_core.tools import BaseTool, ToolException
-from langchain_core.callbacks import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
+import re
+from typing import Any, Optional, Tuple
+
+import httpx
+from mcp import types as mcp_types
+from mcp.shared.exceptions import McpError
 
 logger = logging.getLogger(__name__)
 
+# Error kinds
+BAD_REQUEST = "bad_request"
+AUTH = "auth"
+NOT_FOUND = "not_found"
+RATE_LIMITED = "rate_limited"
+UNAVAILABLE = "unavailable"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+CIRCUIT_OPEN = "circuit_open"
+UNKNOWN = "unknown"
+
+# Kinds that mean Tableau (or the MCP server) is unhealthy rather than the call being wrong
+TRANSIENT_KINDS = {RATE_LIMITED, UNAVAILABLE, TIMEOUT, CONNECTION}
+
+_MCP_CODE_KINDS = {
+    mcp_types.INVALID_PARAMS: BAD_REQUEST,
+    mcp_types.INVALID_REQUEST: BAD_REQUEST,
+    mcp_types.METHOD_NOT_FOUND: BAD_REQUEST,
+    mcp_types.PARSE_ERROR: BAD_REQUEST,
+    mcp_types.INTERNAL_ERROR: UNAVAILABLE,
+    mcp_types.CONNECTION_CLOSED: CONNECTION,
+}
+
+_STATUS_IN_TEXT = re.compile(r"\b(?:status(?: code)?|HTTP)[\s:=]*([1-5]\d\d)\b", re.IGNORECASE)
+
+_MESSAGES = {
+    BAD_REQUEST: (
+        "The request to {tool} was invalid{status}. This usually means the parameters "
+        "were malformed or missing required fields. Please check the tool arguments and try again."
+    ),
+    AUTH: (
+        "Access denied{status} when calling {tool}. The user may not have access to the "
+        "requested resource, or the credentials may be insufficient. Try a different approach."
+    ),
+    NOT_FOUND: (
+        "Resource not found{status} when calling {tool}. The datasource, view or workbook "
+        "may not exist or may have been moved. Please verify the identifier and try again."
+    ),
+    RATE_LIMITED: (
+        "Tableau is rate limiting requests{status} for {tool}. Wait before retrying, "
+        "or answer from the results you already have."
+    ),
+    UNAVAILABLE: (
+        "Tableau returned a server error{status} for {tool}. Please try again later "
+        "or answer from the results you already have."
+    ),
+    TIMEOUT: "The call to {tool} timed out. Try a narrower request.",
+    CONNECTION: "Could not reach Tableau when calling {tool}. Please try again later.",
+}
+
+
+class ToolCallError(Exception):
+    """A failed MCP tool call, with its classification attached."""
+
+    def __init__(self, tool_name: str, kind: str, status: Optional[int], message: str):
+        super().__init__(message)
+        self.tool_name = tool_name
+        self.kind = kind
+        self.status = status
+
 
-def wrap_tool_with_error_handling(tool: BaseTool) -> BaseTool:
+def kind_for_status(status: Optional[int]) -> str:
+    """Map an HTTP status code to an error kind."""
+    if status is None:
+        return UNKNOWN
+    if status in (401, 403):
+        return AUTH
+    if status == 404:
+        return NOT_FOUND
+    if status == 408:
+        return TIMEOUT
+    if status == 429:
+        return RATE_LIMITED
+    if 400 <= status < 500:
+        return BAD_REQUEST
+    if status >= 500:
+        return UNAVAILABLE
+    return UNKNOWN
+
+
+def classify_tool_error(error: BaseException) -> Tuple[str, Optional[int]]:
     """
-    Wrap a LangChain tool to catch HTTP errors and convert them to ToolException.
-    
-    This ensures that 400/403 errors from Tableau become user-friendly tool error
-    messages instead of crashing the LangGraph agent state.
-    
-    Args:
-        tool: The original LangChain tool to wrap
-        
+    Classify an exception raised by an MCP tool call.
+
     Returns:
-        A new tool instance with error handling
+        (kind, status) - status is the HTTP status or MCP error code, if any
     """
-    # Store original methods
-    original_run = tool.run
-    original_arun = tool.arun
-    original_invoke = getattr(tool, 'invoke', None)
-    original_ainvoke = getattr(tool, 'ainvoke', None)
-    
-    def _extract_error_message(error: Exception) -> str:
-        """Extract and format error message from exception."""
-        error_msg = str(error).lower()
-        
-        # Check for HTTP status codes in error messages (various formats)
-        # Patterns: "status code 400", "Request failed with status code 400", "HTTP 400", etc.
-        if "status code 400" in error_msg or ("400" in error_msg and ("request failed" in error_msg or "http" in error_msg)):
-            return (
-                f"The request to '{tool.name}' was invalid (HTTP 400). "
-                f"This usually means the parameters were malformed or missing required fields. "
-                f"Please check the tool arguments and try again."
-            )
-        elif "status code 403" in error_msg or ("403" in error_msg and ("request failed" in error_msg or "http" in error_msg)):
-            return (
-                f"Access denied (HTTP 403) when calling '{tool.name}'. "
-                f"This is typically a permissions issue. The user may not have access to "
-                f"the requested resource, or the authentication credentials may be insufficient. "
-                f"Please verify permissions or try a different approach."
-            )
-        elif "status code 404" in error_msg or ("404" in error_msg and ("request failed" in error_msg or "http" in error_msg)):
-            return (
-                f"Resource not found (HTTP 404) when calling '{tool.name}'. "
-                f"The requested resource (datasource, view, workbook, etc.) may not exist "
-                f"or may have been moved. Please verify the resource identifier and try again."
-            )
-        elif "status code 500" in error_msg or ("500" in error_msg and ("request failed" in error_msg or "http" in error_msg)):
-            return (
-                f"Server error (HTTP 500) when calling '{tool.name}'. "
-                f"This indicates an internal error on the Tableau server. "
-                f"Please try again later or contact support if the issue persists."
-            )
-        else:
-            # For other errors, provide a generic but informative message
-            original_msg = str(error)
-            return (
-                f"An error occurred when calling '{tool.name}': {original_msg[:300]}. "
-                f"Please try again or use a different approach."
-            )
-    
-    def wrapped_run(*args, **kwargs) -> str:
-        """Wrapped synchronous run method with error handling."""
-        try:
-            return original_run(*args, **kwargs)
-        except ToolException:
-            # Re-raise ToolException as-is (already user-friendly)
-            raise
-        except Exception as e:
-            error_msg = str(e)
-            friendly_msg = _extract_error_message(e)
-            logger.warning(f"Tool {tool.name} error (HTTP detection): {error_msg[:200]}")
-            raise ToolException(friendly_msg)
-    
-    async def wrapped_arun(*args, **kwargs) -> str:
-        """Wrapped asynchronous run method with error handling."""
-        try:
-            return await original_arun(*args, **kwargs)
-        except ToolException:
-            # Re-raise ToolException as-is (already user-friendly)
-            raise
-        except Exception as e:
-            error_msg = str(e)
-            friendly_msg = _extract_error_message(e)
-            logger.warning(f"Tool {tool.name} error (HTTP detection): {error_msg[:200]}")
-            raise ToolException(friendly_msg)
-    
-    # Monkey-patch the tool's methods
-    tool.run = wrapped_run
-    tool.arun = wrapped_arun
-    
-    # Also wrap invoke/ainvoke if they exist (LangChain newer API)
-    if original_invoke:
-        def wrapped_invoke(*args, **kwargs):
-            try:
-                return original_invoke(*args, **kwargs)
-            except ToolException:
-                raise
-            except Exception as e:
-                friendly_msg = _extract_error_message(e)
-                logger.warning(f"Tool {tool.name} invoke error: {str(e)[:200]}")
-                raise ToolException(friendly_msg)
-        tool.invoke = wrapped_invoke
-    
-    if original_ainvoke:
-        async def wrapped_ainvoke(*args, **kwargs):
-            try:
-                return await original_ainvoke(*args, **kwargs)
-            except ToolException:
-                raise
-            except Exception as e:
-                friendly_msg = _extract_error_message(e)
-                logger.warning(f"Tool {tool.name} ainvoke error: {str(e)[:200]}")
-                raise ToolException(friendly_msg)
-        tool.ainvoke = wrapped_ainvoke
-    
-    return tool
-
-
-def wrap_mcp_tools(tools: List[BaseTool]) -> List[BaseTool]:
+    if isinstance(error, McpError):
+        code = error.error.code
+        if code in _MCP_CODE_KINDS:
+            return _MCP_CODE_KINDS[code], code
+        return kind_for_status(code) if 100 <= code < 600 else UNKNOWN, code
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return kind_for_status(status), status
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return TIMEOUT, None
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return CONNECTION, None
+    return UNKNOWN, None
+
+
+def classify_tool_result(result: Any) -> Tuple[str, Optional[int]]:
     """
-    Wrap a list of MCP tools with error handling.
-    
-    Args:
-        tools: List of LangChain tools from MCP
-        
+    Classify a CallToolResult with isError=True.
+
     Returns:
-        List of wrapped tools with error handling (same list, tools modified in place)
+        (kind, status) - UNKNOWN when the result carries no status
+    """
+    structured = getattr(result, "structuredContent", None)
+    if isinstance(structured, dict):
+        for key in ("status", "statusCode"):
+            if isinstance(structured.get(key), int):
+                return kind_for_status(structured[key]), structured[key]
+    for block in getattr(result, "content", None) or []:
+        match = _STATUS_IN_TEXT.search(getattr(block, "text", "") or "")
+        if match:
+            status = int(match.group(1))
+            return kind_for_status(status), status
+    return UNKNOWN, None
+
+
+def format_tool_error(error: Exception) -> str:
+    """
+    Turn an exception from a tool call into the message the model sees.
+
+    Passed to ToolNode as handle_tool_errors.
     """
-    wrapped_count = 0
-    for tool in tools:
-        try:
-            if not isinstance(tool, BaseTool):
-                logger.warning(f"Tool '{getattr(tool, 'name', 'unknown')}' is not a BaseTool, skipping wrapper")
-                continue
-            wrap_tool_with_error_handling(tool)
-            wrapped_count += 1
-            logger.debug(f"Wrapped tool '{tool.name}' with error handling")
-        except Exception as e:
-            logger.error(f"Failed to wrap tool '{getattr(tool, 'name', 'unknown')}': {str(e)}")
-            # Continue with original tool if wrapping fails
-    
-    logger.info(f"Wrapped {wrapped_count} out of {len(tools)} MCP tools with error handling")
-    return tools  # Return same list (tools modified in place)
+    if isinstance(error, ToolCallError):
+        tool, kind, status = f"'{error.tool_name}'", error.kind, error.status
+    else:
+        tool = "the tool"
+        kind, status = classify_tool_error(error)
+        logger.warning(f"Tool error ({kind}): {str(error)[:200]}")
+    template = _MESSAGES.get(kind)
+    if template is None:
+        return f"An error occurred when calling {tool}: {str(error)[:300]}. Please try again or use a different approach."
+    suffix = f" (HTTP {status})" if status is not None and 100 <= status < 600 else ""
+    return template.format(tool=tool, status=suffix)
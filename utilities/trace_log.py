@@ -0,0 +1,202 @@
+"""
+Local Agent Trace
+
+LangChain callback handler writing agent runs to .logs/agent_trace.jsonl
+(one JSON object per event) when Langfuse is off. It replaces
+FileCallbackHandler, which wrote every event to the file synchronously and,
+as a sync handler, cost a thread-pool hop per event.
+
+- Events are handed to the logging queue pipeline (utilities.logging_config):
+  bounded queue, drops counted on overflow, a writer thread, size-based
+  rotation (TRACE_QUEUE_SIZE, TRACE_MAX_MB, TRACE_BACKUP_COUNT)
+- The handler runs inline and copies each payload into small plain data
+  (strings cut at TRACE_MAX_FIELD_CHARS, at most 50 items per collection), so
+  queued records never hold on to live messages or image payloads; only JSON
+  serialization happens on the writer thread
+- TRACE_SAMPLE_RATE keeps that fraction of agent runs; a run's events are all
+  kept or all skipped
+- Token-by-token events are not written
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utilities.logging_config import LOG_DIR, open_pipeline
+
+# Runs whose sampling decision is remembered (a run's end event may never come after a cancel)
+MAX_TRACKED_RUNS = 10000
+
+
+def _compact(value: Any, limit: int, depth: int = 0) -> Any:
+    """JSON-friendly copy of a callback payload with long strings and collections cut."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= limit else value[:limit] + f"... [{len(value) - limit} more chars]"
+    if depth >= 6:
+        return _compact(repr(value), limit)
+    if isinstance(value, dict):
+        items = list(value.items())
+        out = {str(k): _compact(v, limit, depth + 1) for k, v in items[:50]}
+        if len(items) > 50:
+            out["..."] = f"{len(items) - 50} more keys"
+        return out
+    if isinstance(value, (list, tuple)):
+        out = [_compact(v, limit, depth + 1) for v in value[:50]]
+        if len(value) > 50:
+            out.append(f"... {len(value) - 50} more items")
+        return out
+    message_type = getattr(value, "type", None)
+    if isinstance(message_type, str) and hasattr(value, "content"):
+        # LangChain messages
+        out = {"type": message_type, "content": _compact(value.content, limit, depth + 1)}
+        for attr in ("name", "tool_calls", "tool_call_id", "status"):
+            attr_value = getattr(value, attr, None)
+            if attr_value:
+                out[attr] = _compact(attr_value, limit, depth + 1)
+        return out
+    if hasattr(value, "generations"):
+        # LLMResult
+        return {"generations": _compact(
+            [[getattr(g, "message", None) or getattr(g, "text", None) for g in gens] for gens in value.generations],
+            limit, depth + 1,
+        )}
+    return _compact(repr(value), limit)
+
+
+class _TraceFormatter(logging.Formatter):
+    """Serializes a queued (already compacted) trace event on the writer thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = record.msg
+        if not isinstance(event, dict):
+            return json.dumps({"event": "log", "message": str(event)})
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Non-blocking JSONL trace of agent runs.
+
+    Args:
+        path: Trace file. If None, reads TRACE_FILE (default .logs/agent_trace.jsonl).
+        sample_rate: Fraction of runs written. If None, reads TRACE_SAMPLE_RATE (default 1.0).
+        max_field_chars: Longest string kept in a payload. If None, reads
+            TRACE_MAX_FIELD_CHARS (default 2000).
+    """
+
+    # Called directly on the event loop: it only queues a record
+    run_inline = True
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        max_field_chars: Optional[int] = None,
+    ):
+        path = path or os.getenv("TRACE_FILE", os.path.join(LOG_DIR, "agent_trace.jsonl"))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+        self.max_field_chars = (
+            max_field_chars if max_field_chars is not None
+            else int(os.getenv("TRACE_MAX_FIELD_CHARS", "2000"))
+        )
+        self.pipeline = open_pipeline(path, _TraceFormatter(), env_prefix="TRACE", format_in_caller=False)
+        self._sampled: "OrderedDict[UUID, bool]" = OrderedDict()
+        self.runs_sampled = 0
+        self.runs_skipped = 0
+
+    def _keep(self, run_id: UUID, parent_run_id: Optional[UUID]) -> bool:
+        keep = self._sampled.get(run_id)
+        if keep is not None:
+            return keep
+        keep = self._sampled.get(parent_run_id) if parent_run_id is not None else None
+        if keep is None:
+            # A new agent run: sample it
+            keep = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+            if keep:
+                self.runs_sampled += 1
+            else:
+                self.runs_skipped += 1
+        self._sampled[run_id] = keep
+        while len(self._sampled) > MAX_TRACKED_RUNS:
+            self._sampled.popitem(last=False)
+        return keep
+
+    def _write(self, event: str, run_id: UUID, parent_run_id: Optional[UUID], data: Any = None,
+               name: Optional[str] = None, end: bool = False) -> None:
+        keep = self._keep(run_id, parent_run_id)
+        if end:
+            self._sampled.pop(run_id, None)
+        if not keep:
+            return
+        try:
+            payload = _compact(data, self.max_field_chars)
+        except Exception as e:  # e.g. a broken repr
+            payload = f"<unserializable: {e!r}>"
+        record = logging.LogRecord("agent_trace", logging.INFO, "", 0, {
+            "ts": time.time(),
+            "event": event,
+            "run_id": str(run_id),
+            "parent_run_id": str(parent_run_id) if parent_run_id else None,
+            "name": name,
+            "data": payload,
+        }, None, None)
+        self.pipeline.handler.handle(record)
+
+    @staticmethod
+    def _name(serialized: Optional[dict], kwargs: dict) -> Optional[str]:
+        if kwargs.get("name"):
+            return kwargs["name"]
+        if isinstance(serialized, dict):
+            return serialized.get("name") or (serialized.get("id") or [None])[-1]
+        return None
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._write("chain_start", run_id, parent_run_id, inputs, self._name(serialized, kwargs))
+
+    def on_chain_end(self, outputs, *, run_id, parent_run_id=None, **kwargs):
+        self._write("chain_end", run_id, parent_run_id, outputs, end=True)
+
+    def on_chain_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._write("chain_error", run_id, parent_run_id, repr(error), end=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._write("chat_model_start", run_id, parent_run_id, messages, self._name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._write("llm_start", run_id, parent_run_id, prompts, self._name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, parent_run_id=None, **kwargs):
+        self._write("llm_end", run_id, parent_run_id, response, end=True)
+
+    def on_llm_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._write("llm_error", run_id, parent_run_id, repr(error), end=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._write("tool_start", run_id, parent_run_id, kwargs.get("inputs") or input_str, self._name(serialized, kwargs))
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        self._write("tool_end", run_id, parent_run_id, output, end=True)
+
+    def on_tool_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._write("tool_error", run_id, parent_run_id, repr(error), end=True)
+
+    def close(self) -> None:
+        """Write out queued events and stop the writer thread."""
+        self.pipeline.stop()
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "runs_sampled": self.runs_sampled,
+            "runs_skipped": self.runs_skipped,
+            **self.pipeline.stats(),
+        }
@@ -1,29 +1,44 @@
 # Web UI Libraries
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 
 # MCP libraries
-from mcp import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
+from utilities.mcp_pool import MCPSessionPool
+from utilities.single_flight import CoalescingToolSession
+from utilities.tool_cache import CachingToolSession, QueryResultCache
+from utilities.query_validator import ValidatingToolSession
+from utilities.tool_execution import ToolExecutor
+from utilities.circuit_breaker import CircuitBreakerSession
+from utilities.tool_wrapper import format_tool_error
 
 # LangChain Libraries
 from langchain_mcp_adapters.tools import load_mcp_tools
 from langgraph.prebuilt import create_react_agent
 from langchain_core.messages import HumanMessage
-from langgraph.checkpoint.memory import InMemorySaver
 from langchain_core.tools import tool
 
 # Set Local MCP Logging
-from utilities.logging_config import setup_logging
+from utilities.logging_config import setup_logging, logging_stats
 logger = setup_logging("web_app.log")
 
 # Load System Prompt and Message Formatter
 from utilities.prompt import AGENT_SYSTEM_PROMPT
-from utilities.chat import stream_agent_response
-from utilities.model_provider import get_llm
+from utilities.chat import stream_agent_response, repair_incomplete_tool_calls, ToolCallTracker
+from utilities.sse import SSEEncoder, TableLedger, format_event
+from utilities.model_provider import get_llm, get_system_prompt
+from utilities.session_store import SessionStore
+from utilities.state_backend import open_state_backend
+from utilities.blob_store import BlobStore
+from utilities.compaction import ToolResultCompactor
+from utilities.history import HistoryPolicy
+from utilities.run_control import RunRegistry
+from utilities.scheduler import AdmissionController, AdmissionRejected
+from utilities.rate_limit import rate_limiter_stats
+from utilities import metrics
 # LEGACY/TESTING: format_agent_response is commented out - uncomment if you need non-streaming endpoint
 # from utilities.chat import format_agent_response
 
@@ -32,7 +47,9 @@ from langgraph.prebuilt.tool_node import ToolNode
 
 # Load Environment and set MCP endpoint
 import os
-import json
+import asyncio
+import time
+from typing import Literal
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -45,102 +62,143 @@ if not mcp_http_url:
 
 # Set Langfuse Tracing or local Tracing
 callback_handler = None
-_file_callback_handler_ctx = None  # Store context manager reference
+trace_handler = None  # local JSONL trace, written by a background thread
 
 if os.getenv("USE_LANGFUSE", "false").lower() == "true":
     from langfuse.langchain import CallbackHandler
     callback_handler = CallbackHandler()
 elif os.getenv("USE_LANGFUSE", "false").lower() == "false":
-    from langchain_core.callbacks import FileCallbackHandler
-    os.makedirs(".logs", exist_ok=True)  # Ensure .logs directory exists
-    # FileCallbackHandler will be entered as context manager in lifespan
-    _file_callback_handler_ctx = FileCallbackHandler(filename=".logs/agent_trace.jsonl")
+    from utilities.trace_log import TraceCallbackHandler
+    trace_handler = callback_handler = TraceCallbackHandler()
 else:
     callback_handler = None
-    _file_callback_handler_ctx = None
 
 
 # Global variables for agent and session
 agent = None
-session_context = None
+mcp_pool = None
+tool_cache = None
+single_flight = None
+query_validator = None
+tool_executor = None
+circuit_breakers = None
 import uuid
-SESSION_STORE = {}
+session_store = None
+image_store = None
+result_store = None
+compactor = None
+history_policy = None
+llm = None
+run_registry = RunRegistry()
+# Table ids each conversation's client already has (delta wire format)
+table_ledger = TableLedger()
+admission = None
 
 # Global async context manager for MCP connection
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global agent, callback_handler, _file_callback_handler_ctx
+    global agent, mcp_pool, tool_cache, single_flight, query_validator, tool_executor, circuit_breakers, session_store, image_store, result_store, compactor, history_policy, admission, llm
     logger.info("Starting up application...")
     
-    # Enter FileCallbackHandler context manager if using file-based callbacks
-    if _file_callback_handler_ctx is not None:
-        callback_handler = _file_callback_handler_ctx.__enter__()
-        logger.info("FileCallbackHandler context entered")
-    
     try:
-        logger.info("Connecting to Tableau MCP via Streamable HTTP at %s", mcp_http_url)
+        # View images are served from /images/<hash> instead of riding inside SSE events
+        image_store = BlobStore()
+        # Full copies of tool results that were truncated in the conversation state
+        result_store = BlobStore(env_prefix="TOOL_RESULT_STORE", default_directory=".state/tool_results")
+        # Shrinks images and oversized tool results from earlier turns before each model call
+        compactor = ToolResultCompactor(image_store=image_store, result_store=result_store)
 
-        # Use Streamable HTTP transport instead of stdio
-        async with streamablehttp_client(mcp_http_url) as (read, write, _get_session_id):
-            async with ClientSession(read, write) as client_session:
-                # Initialize the connection
-                await client_session.initialize()
+        logger.info("Connecting to Tableau MCP via Streamable HTTP at %s", mcp_http_url)
 
-                # Get tools, filter tools using the .env config
-                mcp_tools = await load_mcp_tools(client_session)
-                logger.info(f"Loaded {len(mcp_tools)} MCP tools")
-                
-                # Debug: Log ALL tool descriptions to understand what the agent sees
-                # logger.info(f"Loaded {len(mcp_tools)} MCP tools")
-                # print(f"🔧 Loaded {len(mcp_tools)} MCP tools:")
+        # Use Streamable HTTP transport instead of stdio. Tool calls check out a
+        # session from the pool, which reconnects and re-initializes dropped sessions.
+        async with MCPSessionPool(mcp_http_url) as pool:
+            mcp_pool = pool
+            # Calls to a tool or datasource that keeps failing are refused until Tableau recovers
+            circuit_breakers = CircuitBreakerSession(mcp_pool)
+            # Concurrent identical calls share one round-trip to Tableau
+            single_flight = CoalescingToolSession(circuit_breakers)
+            # Listing/metadata results (and, if enabled, identical queries until the
+            # extract refreshes) are served from TTL caches in front of that
+            tool_cache = CachingToolSession(single_flight, query_cache=QueryResultCache())
+            # Malformed query-datasource calls are repaired or rejected before any of that
+            query_validator = ValidatingToolSession(tool_cache)
+
+            # Get tools, filter tools using the .env config
+            mcp_tools = await load_mcp_tools(query_validator)
+            logger.info(f"Loaded {len(mcp_tools)} MCP tools")
+            
+            # Debug: Log ALL tool descriptions to understand what the agent sees
+            # logger.info(f"Loaded {len(mcp_tools)} MCP tools")
+            # print(f"🔧 Loaded {len(mcp_tools)} MCP tools:")
+            
+            # for tool in mcp_tools:
+            #     logger.info(f"Tool: {tool.name}")
+            #     print(f"  {tool.name}")
                 
-                # for tool in mcp_tools:
-                #     logger.info(f"Tool: {tool.name}")
-                #     print(f"  {tool.name}")
+            #     if tool.name == "query-datasource":
+            #         logger.info(f"Query-datasource DESCRIPTION: {tool.description}")
+            #         logger.info(f"Query-datasource ARGS SCHEMA: {tool.args_schema}")
+            #         print(f"   QUERY-DATASOURCE DESCRIPTION:")
+            #         print(f"     {tool.description}")
+            #         print(f"   QUERY-DATASOURCE ARGS SCHEMA:")
+            #         print(f"     {tool.args_schema}")
                     
-                #     if tool.name == "query-datasource":
-                #         logger.info(f"Query-datasource DESCRIPTION: {tool.description}")
-                #         logger.info(f"Query-datasource ARGS SCHEMA: {tool.args_schema}")
-                #         print(f"   QUERY-DATASOURCE DESCRIPTION:")
-                #         print(f"     {tool.description}")
-                #         print(f"   QUERY-DATASOURCE ARGS SCHEMA:")
-                #         print(f"     {tool.args_schema}")
-                        
-                #         # Also log the actual schema properties if available
-                #         if hasattr(tool.args_schema, 'schema'):
-                #             logger.info(f"Query-datasource SCHEMA DETAILS: {tool.args_schema.schema()}")
-                #             print(f"   SCHEMA DETAILS:")
-                #             print(f"     {tool.args_schema.schema()}")
-                
-                # logger.info("Tool loading and inspection complete")
-                
-                # Initialize LLM using model provider utility
-                llm = get_llm()
-
-                # Create tool node with error handling - errors will be returned as ToolMessages
-                # This allows the agent to see the error and retry with a different approach
-                tool_node = ToolNode(mcp_tools, handle_tool_errors=True)
-
+            #         # Also log the actual schema properties if available
+            #         if hasattr(tool.args_schema, 'schema'):
+            #             logger.info(f"Query-datasource SCHEMA DETAILS: {tool.args_schema.schema()}")
+            #             print(f"   SCHEMA DETAILS:")
+            #             print(f"     {tool.args_schema.schema()}")
+            
+            # logger.info("Tool loading and inspection complete")
+            
+            # Initialize LLM using model provider utility
+            llm = get_llm()
+
+            # Compacts old tool results, then windows/summarizes history before each model call
+            history_policy = HistoryPolicy(llm=llm, compactor=compactor)
+
+            # Create tool node with error handling - errors will be returned as ToolMessages
+            # This allows the agent to see the error and retry with a different approach.
+            # Calls from one model turn run concurrently, each with its own deadline.
+            tool_executor = ToolExecutor(breakers=circuit_breakers)
+            tool_node = ToolNode(mcp_tools, handle_tool_errors=format_tool_error, awrap_tool_call=tool_executor)
+
+            # Checkpointer and session registry come from the configured state backend
+            # (in-memory for one worker, SQLite to share conversations across workers)
+            async with open_state_backend() as (session_backend, checkpointer):
                 # Create the agent with error-aware tool node
-                checkpointer = InMemorySaver()
                 agent = create_react_agent(
                     model=llm, 
                     tools=tool_node,  # Use ToolNode instead of raw tools
-                    prompt=AGENT_SYSTEM_PROMPT, 
-                    checkpointer=checkpointer
+                    prompt=get_system_prompt(AGENT_SYSTEM_PROMPT),  # cacheable static prefix
+                    checkpointer=checkpointer,
+                    pre_model_hook=history_policy
                 )
+
+                # Caps concurrent agent runs; excess runs wait in a bounded queue
+                admission = AdmissionController()
+
+                # Bounded session registry; eviction also purges the checkpointer thread
+                session_store = SessionStore(checkpointer=checkpointer, backend=session_backend)
+                sweeper = asyncio.create_task(session_store.run_sweeper())
                 
-                yield
+                try:
+                    yield
+                finally:
+                    sweeper.cancel()
         
     # Error Handling
     except Exception as e:
         logger.error(f"Failed to initialize agent: {e}")
         raise
     finally:
-        # Exit FileCallbackHandler context manager on shutdown
-        if _file_callback_handler_ctx is not None:
-            _file_callback_handler_ctx.__exit__(None, None, None)
-            logger.info("FileCallbackHandler context exited")
+        # Write out the queued trace events and blobs on shutdown
+        if trace_handler is not None:
+            trace_handler.close()
+        for store in (image_store, result_store):
+            if store is not None:
+                store.flush()
 
 # Create FastAPI app with lifespan
 app = FastAPI(
@@ -156,10 +214,17 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 class ChatRequest(BaseModel):
     message: str
     thread_id: str
+    # Opt-in token streaming: adds token/tool_start/tool_end SSE events alongside step/final
+    stream_tokens: bool = False
+    # "delta": steps/final carry only appended text and tables are sent once by id (see utilities/sse.py)
+    wire_format: Literal["full", "delta"] = "full"
 
 class ChatResponse(BaseModel):
     response: str
 
+class CancelRequest(BaseModel):
+    thread_id: str
+
 
 
 
@@ -176,21 +241,102 @@ def static_index():
 @app.get("/session")
 async def init_session():
     thread_id = f"chat_session_{uuid.uuid4()}"
-    logger.info(f"New session created: {thread_id} (total sessions: {len(SESSION_STORE)})")
-     # Initialize empty graph state for the conversation that the langraph checkpointer can populate
-    SESSION_STORE[thread_id] = {
-        "state": {},          # LangGraph state (checkpointer will populate it)
-    }
+    # Register the session; the langgraph checkpointer populates its state on first message.
+    # A cheap sweep keeps the session cap enforced without waiting for the background sweeper.
+    await session_store.create(thread_id)
+    await session_store.sweep(measure=False)
+    logger.info(f"New session created: {thread_id} (total sessions: {await session_store.count()})")
     return {"thread_id": thread_id}
 
+def _blob_response(store, digest: str, request: Request) -> Response:
+    """Serve a blob by content hash; the URL never changes meaning, so it is cached forever"""
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    blob = store.get(digest) if store is not None else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    mime, data = blob
+    return Response(content=data, media_type=mime, headers=headers)
+
+@app.get("/images/{digest}")
+async def get_image(digest: str, request: Request):
+    """View images referenced by SSE events"""
+    # A memory miss reads the file, so keep it off the event loop
+    return await asyncio.to_thread(_blob_response, image_store, digest, request)
+
+@app.get("/tool-results/{digest}")
+async def get_tool_result(digest: str, request: Request):
+    """Full tool results that were truncated in the conversation state"""
+    return await asyncio.to_thread(_blob_response, result_store, digest, request)
+
 @app.get("/debug/sessions")
 async def debug_sessions():
     """Debug endpoint to check active sessions"""
     return {
-        "active_sessions": len(SESSION_STORE),
-        "session_ids": list(SESSION_STORE.keys())
+        "active_sessions": await session_store.count(),
+        "session_ids": await session_store.ids(),
+        "store": await session_store.stats(),
+        "runs": run_registry.stats(),
+        "admission": admission.stats(),
+        "logging": logging_stats(),
+        "trace": trace_handler.stats() if trace_handler is not None else None
     }
 
+def collect_gauges():
+    """Refresh /metrics gauges from the components' stats()."""
+    metrics.RUNS_ACTIVE.set(run_registry.stats()["active_runs"])
+    if admission is not None:
+        metrics.ADMISSION_QUEUE_DEPTH.set(admission.stats()["queued"])
+    if tool_executor is not None:
+        metrics.TOOLS_IN_FLIGHT.set(tool_executor.in_flight)
+    if mcp_pool is not None:
+        pool = mcp_pool.stats()
+        metrics.MCP_POOL_IN_USE.set(pool["in_use"])
+        metrics.MCP_POOL_WAITING.set(pool["waiting"])
+    if circuit_breakers is not None:
+        metrics.CIRCUIT_BREAKERS_OPEN.set(len(circuit_breakers.stats()["open"]))
+    for path, log in logging_stats().items():
+        metrics.LOG_QUEUE_DEPTH.set(log["queue_depth"], file=path)
+        metrics.LOG_DROPPED.set_total(log["dropped"], file=path)
+
+metrics.REGISTRY.add_collector(collect_gauges)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: stream, LLM, MCP tool and extraction latencies plus load gauges"""
+    if session_store is not None:
+        # May query the shared backend, so it is read here rather than in collect_gauges
+        metrics.SESSIONS.set(await session_store.count())
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/debug/mcp")
+async def debug_mcp():
+    """Debug endpoint to check MCP session pool health"""
+    if mcp_pool is None:
+        raise HTTPException(status_code=503, detail="MCP pool not initialized")
+    return {
+        "pool": mcp_pool.stats(),
+        "tool_cache": tool_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "query_validator": query_validator.stats(),
+        "tool_execution": tool_executor.stats(),
+        "circuit_breakers": circuit_breakers.stats(),
+        "image_store": image_store.stats(),
+        "compaction": compactor.stats(),
+        "history": history_policy.stats(),
+        "llm": rate_limiter_stats(),
+        "models": llm.stats() if hasattr(llm, "stats") else None
+    }
+
+@app.delete("/debug/mcp/cache")
+async def invalidate_tool_cache(tool: str | None = None):
+    """Drop cached tool results, e.g. after publishing or changing a datasource"""
+    if tool_cache is None:
+        raise HTTPException(status_code=503, detail="MCP pool not initialized")
+    return {"invalidated": tool_cache.invalidate(tool)}
+
 # LEGACY/TESTING: Non-streaming chat endpoint (currently not used by frontend)
 # Uncomment if you need a non-streaming endpoint for testing purposes
 # @app.post("/chat")
@@ -205,7 +351,7 @@ async def debug_sessions():
 #     # Bring in the chat thread id
 #     thread_id = request.thread_id
 # 
-#     if thread_id not in SESSION_STORE:
+#     if thread_id not in session_store:
 #         raise HTTPException(status_code=400, detail="Unknown thread_id")
 # 
 #     try:   
@@ -222,8 +368,18 @@ async def debug_sessions():
 #         logger.error(f"Error processing chat request: {str(e)}", exc_info=True)
 #         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/chat/cancel")
+async def chat_cancel(request: CancelRequest):
+    """Stop the agent run for a thread (the Stop button); in-flight LLM and MCP calls are cancelled"""
+    cancelled = run_registry.cancel(request.thread_id)
+    if not cancelled:
+        # The run may be streaming from another worker, which polls for this flag
+        cancelled = await session_store.request_cancel(request.thread_id)
+    logger.info(f"[{request.thread_id}] Cancel requested, run {'cancelled' if cancelled else 'not active'}")
+    return {"cancelled": cancelled}
+
 @app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     """Handle streaming chat messages with intermediate steps"""
     global agent
     
@@ -231,50 +387,140 @@ async def chat_stream(request: ChatRequest):
         logger.error("Agent not initialized")
         raise HTTPException(status_code=500, detail="Agent not initialized. Please restart the server.")
     
+    received = time.monotonic()
     thread_id = request.thread_id
     logger.info(f"[{thread_id}] Received streaming request: {request.message[:50]}...")
     
-    if thread_id not in SESSION_STORE:
-        logger.warning(f"[{thread_id}] Unknown thread_id")
+    if not await session_store.contains(thread_id):
+        logger.warning(f"[{thread_id}] Unknown or expired thread_id")
         raise HTTPException(status_code=400, detail="Unknown thread_id")
 
+    # Admission control: one run per thread, per-user and global caps, bounded queue.
+    # The local check fails fast; the session claim covers runs on other workers.
+    user_id = admission.user_key(
+        thread_id,
+        http_request.client.host if http_request.client else None,
+        http_request.headers.get("x-user-id")
+    )
+    try:
+        ticket = admission.reserve(thread_id, user_id)
+    except AdmissionRejected as e:
+        logger.warning(f"[{thread_id}] Run rejected ({e.status_code}): {e.detail}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": "5"} if e.status_code == 429 else None
+        )
+    if not await session_store.claim_run(thread_id):
+        admission.release(ticket)
+        logger.warning(f"[{thread_id}] Run rejected (409): thread busy on another worker")
+        raise HTTPException(status_code=409, detail="A response is already running for this conversation")
+
+    released = False
+
+    async def release_run():
+        # Safe to call more than once; shielded so a torn-down response still frees the claim
+        nonlocal released
+        if released:
+            return
+        released = True
+        admission.release(ticket)
+        await asyncio.shield(session_store.release_run(thread_id))
+
     try:
         messages = [HumanMessage(content=request.message)]
-        logger.info(f"[{thread_id}] Starting agent stream, active threads: {len(SESSION_STORE)}")
+        logger.info(f"[{thread_id}] Starting agent stream, active threads: {await session_store.count()}")
         
+        # Unanswered tool calls of this run, indexed as the stream goes
+        tool_calls = ToolCallTracker()
+
+        async def repair_after_cancel():
+            # Answer tool calls that were cut off so the thread stays valid for the next message.
+            # The run may have been cancelled right after a step was checkpointed but before
+            # the stream saw it, so fall back to scanning the thread when the index is empty.
+            reason = "The user stopped this response before the tool call completed."
+            if not await tool_calls.repair(agent, thread_id, logger, reason=reason):
+                await repair_incomplete_tool_calls(agent, thread_id, logger, reason=reason)
+
+        encoder = SSEEncoder(thread_id, request.wire_format, ledger=table_ledger)
+
         async def generate_stream():
+            # Stays "aborted" if the response is closed before the run ends
+            outcome = "aborted"
+            admitted = False
+            first_event = True
             try:
-                async for chunk in stream_agent_response(agent, messages, callback_handler, thread_id):
-                    try:
-                        # Ensure proper JSON encoding
-                        json_str = json.dumps(chunk, ensure_ascii=False)
-                        yield f"data: {json_str}\n\n"
-                    except Exception as json_error:
-                        logger.error(f"[{thread_id}] Error encoding chunk to JSON: {str(json_error)}")
-                        # Send error as final response
-                        yield f"data: {json.dumps({'type': 'final', 'content': 'Error encoding response', 'is_final': True})}\n\n"
-                        break
-                logger.info(f"[{thread_id}] Stream completed successfully")
-            except Exception as e:
-                logger.error(f"[{thread_id}] Error during streaming: {str(e)}", exc_info=True)
-                # Always send a final error response
                 try:
-                    yield f"data: {json.dumps({'type': 'final', 'content': f'Error: {str(e)}', 'is_final': True})}\n\n"
-                except:
-                    # If even JSON encoding fails, send plain text
-                    yield f"data: {json.dumps({'type': 'final', 'content': 'An error occurred', 'is_final': True})}\n\n"
+                    # Wait for a run slot, telling the client where it is in the queue.
+                    # Inside the outer try so a client leaving the queue frees its place.
+                    async for position in admission.wait(ticket):
+                        logger.info(f"[{thread_id}] Queued at position {position}")
+                        yield format_event({'type': 'queued', 'position': position, 'is_final': False})
+                except AdmissionRejected as e:
+                    logger.warning(f"[{thread_id}] Gave up waiting for a run slot")
+                    yield format_event({'type': 'final', 'content': e.detail, 'is_final': True})
+                    return
+
+                admitted = True
+                try:
+                    # The run is cancelled if the client disconnects or POSTs /chat/cancel
+                    async for chunk in run_registry.stream(
+                        thread_id,
+                        stream_agent_response(
+                            agent, messages, callback_handler, thread_id,
+                            stream_tokens=request.stream_tokens, image_store=image_store,
+                            tool_calls=tool_calls
+                        ),
+                        is_disconnected=http_request.is_disconnected,
+                        on_cancel=repair_after_cancel,
+                        cancel_requested=lambda: session_store.cancel_requested(thread_id)
+                    ):
+                        if first_event:
+                            first_event = False
+                            metrics.STREAM_FIRST_EVENT_SECONDS.observe(time.monotonic() - received)
+                        try:
+                            yield encoder.encode(chunk)
+                        except Exception as json_error:
+                            logger.error(f"[{thread_id}] Error encoding chunk to JSON: {str(json_error)}")
+                            # Send error as final response
+                            outcome = "error"
+                            yield format_event({'type': 'final', 'content': 'Error encoding response', 'is_final': True})
+                            break
+                    else:
+                        outcome = "ok"
+                        # Only now may later delta-format turns reference this stream's tables
+                        encoder.delivered()
+                    logger.info(f"[{thread_id}] Stream completed successfully ({encoder.events} events, {encoder.bytes} bytes, {encoder.wire_format})")
+                except Exception as e:
+                    outcome = "error"
+                    logger.error(f"[{thread_id}] Error during streaming: {str(e)}", exc_info=True)
+                    # Always send a final error response
+                    try:
+                        yield format_event({'type': 'final', 'content': f'Error: {str(e)}', 'is_final': True})
+                    except:
+                        # If even JSON encoding fails, send plain text
+                        yield format_event({'type': 'final', 'content': 'An error occurred', 'is_final': True})
+            finally:
+                if admitted:
+                    metrics.RUN_SECONDS.observe(time.monotonic() - received, outcome=outcome)
+                encoder.close()
+                await release_run()
         
         return StreamingResponse(
             generate_stream(),
-            media_type="text/plain",
+            # Also release the slot and claim if the body is never iterated
+            background=BackgroundTask(release_run),
+            media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
-                "Content-Type": "text/event-stream"
+                # Don't let nginx buffer the stream
+                "X-Accel-Buffering": "no"
             }
         )
         
     except Exception as e:
+        await release_run()
         logger.error(f"[{thread_id}] Error processing streaming chat request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 